@@ -0,0 +1,38 @@
+"""add conversation read watermarks
+
+Revision ID: 2d9e5a7c0f14
+Revises: e61b0d93a7c4
+Create Date: 2026-10-18 16:21:44.730158
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2d9e5a7c0f14'
+down_revision: Union[str, Sequence[str], None] = 'e61b0d93a7c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Watermarks start at 0; chat_messages.is_read keeps the read state of
+    # messages marked before this migration.
+    op.add_column(
+        'conversations',
+        sa.Column('user_a_last_read_id', sa.Integer(), server_default='0', nullable=False),
+    )
+    op.add_column(
+        'conversations',
+        sa.Column('user_b_last_read_id', sa.Integer(), server_default='0', nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('conversations', 'user_b_last_read_id')
+    op.drop_column('conversations', 'user_a_last_read_id')
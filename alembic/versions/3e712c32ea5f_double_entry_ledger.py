@@ -0,0 +1,72 @@
+"""double entry ledger
+
+Revision ID: 3e712c32ea5f
+Revises: 9469afce57c5
+Create Date: 2026-10-18 12:26:03.901457
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e712c32ea5f'
+down_revision: Union[str, Sequence[str], None] = '9469afce57c5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+EXTERNAL_WALLET_ID = '00000000-0000-0000-0000-000000000000'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('ledger_entries', 'amount',
+               existing_type=sa.BIGINT(),
+               type_=sa.Numeric(precision=12, scale=2),
+               existing_nullable=False)
+    op.add_column('ledger_entries', sa.Column('seq', sa.BigInteger(), sa.Identity(always=False), nullable=False))
+    op.add_column('ledger_entries', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True))
+    op.create_unique_constraint('uq_ledger_entries_seq', 'ledger_entries', ['seq'])
+
+    op.create_table('wallet_balance_snapshots',
+    sa.Column('wallet_id', sa.UUID(), nullable=False),
+    sa.Column('balance', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('last_entry_seq', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('wallet_id')
+    )
+    op.create_table('ledger_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('last_entry_seq', sa.BigInteger(), nullable=False),
+    sa.Column('entries_folded', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Opening entries so existing balances are backed by the ledger
+    op.execute(f"""
+        INSERT INTO ledger_entries (id, debit_wallet_id, credit_wallet_id, amount)
+        SELECT gen_random_uuid(), '{EXTERNAL_WALLET_ID}', id, balance
+        FROM wallets WHERE balance > 0
+    """)
+    op.execute(f"""
+        INSERT INTO ledger_entries (id, debit_wallet_id, credit_wallet_id, amount)
+        SELECT gen_random_uuid(), id, '{EXTERNAL_WALLET_ID}', -balance
+        FROM wallets WHERE balance < 0
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('ledger_checkpoints')
+    op.drop_table('wallet_balance_snapshots')
+    op.execute("DELETE FROM ledger_entries")
+    op.drop_constraint('uq_ledger_entries_seq', 'ledger_entries', type_='unique')
+    op.drop_column('ledger_entries', 'created_at')
+    op.drop_column('ledger_entries', 'seq')
+    op.alter_column('ledger_entries', 'amount',
+               existing_type=sa.Numeric(precision=12, scale=2),
+               type_=sa.BIGINT(),
+               existing_nullable=False)
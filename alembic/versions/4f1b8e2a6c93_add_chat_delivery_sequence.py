@@ -0,0 +1,83 @@
+"""add chat delivery sequence
+
+Revision ID: 4f1b8e2a6c93
+Revises: 2d9e5a7c0f14
+Create Date: 2026-10-18 18:05:12.318440
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f1b8e2a6c93'
+down_revision: Union[str, Sequence[str], None] = '2d9e5a7c0f14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_chat_messages() -> bool:
+    # chat_messages was created outside of Alembic on some databases
+    return 'chat_messages' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'chat_inboxes',
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('last_seq', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('acked_seq', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    if not _has_chat_messages():
+        return
+
+    # Nullable, no default: adding them does not rewrite the table. Existing
+    # messages keep NULL and are still replayed by the unread backlog.
+    op.add_column('chat_messages', sa.Column('recipient_seq', sa.Integer(), nullable=True))
+    op.add_column('chat_messages', sa.Column('client_msg_id', sa.String(length=64), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chat_messages_receiver_seq',
+            'chat_messages',
+            ['receiver_id', 'recipient_seq'],
+            unique=True,
+            postgresql_where=sa.text('recipient_seq IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_chat_messages_sender_client_msg_id',
+            'chat_messages',
+            ['sender_id', 'client_msg_id'],
+            unique=True,
+            postgresql_where=sa.text('client_msg_id IS NOT NULL'),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if _has_chat_messages():
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                'ix_chat_messages_sender_client_msg_id',
+                table_name='chat_messages',
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+            op.drop_index(
+                'ix_chat_messages_receiver_seq',
+                table_name='chat_messages',
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+        op.drop_column('chat_messages', 'client_msg_id')
+        op.drop_column('chat_messages', 'recipient_seq')
+    op.drop_table('chat_inboxes')
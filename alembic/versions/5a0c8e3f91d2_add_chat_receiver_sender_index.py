@@ -0,0 +1,55 @@
+"""add chat receiver sender index
+
+Revision ID: 5a0c8e3f91d2
+Revises: 3e712c32ea5f
+Create Date: 2026-10-18 14:02:17.552931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a0c8e3f91d2'
+down_revision: Union[str, Sequence[str], None] = '3e712c32ea5f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# The conversation list filters on sender_id = me OR receiver_id = me; the
+# sender side is covered by ix_chat_messages_sender_receiver_timestamp.
+INDEX_NAME = 'ix_chat_messages_receiver_sender_timestamp'
+
+
+def _has_chat_messages() -> bool:
+    # chat_messages was created outside of Alembic on some databases
+    return 'chat_messages' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _has_chat_messages():
+        return
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX_NAME,
+            'chat_messages',
+            ['receiver_id', 'sender_id', 'timestamp'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_chat_messages():
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            INDEX_NAME,
+            table_name='chat_messages',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,53 @@
+"""add conversations
+
+Revision ID: 8c2f47b1d6e0
+Revises: 5a0c8e3f91d2
+Create Date: 2026-10-18 14:48:55.104772
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c2f47b1d6e0'
+down_revision: Union[str, Sequence[str], None] = '5a0c8e3f91d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing history is loaded afterwards with
+    #   python -m app.commands.backfill_conversations
+    op.create_table(
+        'conversations',
+        sa.Column('user_a_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('user_b_id', postgresql.UUID(as_uuid=True), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=False),
+        sa.Column('last_activity', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('user_a_unread', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('user_b_unread', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('user_a_id', 'user_b_id'),
+        sa.CheckConstraint('user_a_id <= user_b_id', name='ck_conversations_ordered_pair'),
+    )
+    op.create_index(
+        'ix_conversations_user_a_activity',
+        'conversations',
+        ['user_a_id', sa.text('last_activity DESC'), sa.text('last_message_id DESC')],
+    )
+    op.create_index(
+        'ix_conversations_user_b_activity',
+        'conversations',
+        ['user_b_id', sa.text('last_activity DESC'), sa.text('last_message_id DESC')],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_user_b_activity', table_name='conversations')
+    op.drop_index('ix_conversations_user_a_activity', table_name='conversations')
+    op.drop_table('conversations')
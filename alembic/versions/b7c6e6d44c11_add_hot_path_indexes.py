@@ -0,0 +1,89 @@
+"""add hot path indexes
+
+Revision ID: b7c6e6d44c11
+Revises: 597f62fc2949
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c6e6d44c11'
+down_revision: Union[str, Sequence[str], None] = '597f62fc2949'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns, extra create_index kwargs)
+INDEXES = [
+    # Every wallet route looks the wallet up by owner
+    ('ix_wallets_user_id', 'wallets', ['user_id'], {}),
+    # History pages: WHERE wallet_id = ? ORDER BY created_at DESC, id DESC
+    (
+        'ix_transactions_wallet_id_created_at',
+        'transactions',
+        ['wallet_id', sa.text('created_at DESC'), sa.text('id DESC')],
+        {},
+    ),
+    # Chat history / last message between a pair of users
+    (
+        'ix_chat_messages_sender_receiver_timestamp',
+        'chat_messages',
+        ['sender_id', 'receiver_id', 'timestamp'],
+        {},
+    ),
+    # Unread badges and pending-message replay only ever look at unread rows
+    (
+        'ix_chat_messages_receiver_unread',
+        'chat_messages',
+        ['receiver_id'],
+        {'postgresql_where': sa.text('is_read = false')},
+    ),
+    # find_user_by_identifier falls back to these lookups
+    ('ix_users_full_name', 'users', ['full_name'], {}),
+    ('ix_users_mobile_number', 'users', ['mobile_number'], {}),
+]
+
+
+def _existing_tables() -> set:
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = _existing_tables()
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in INDEXES:
+            # chat_messages was created outside of Alembic on some databases
+            if table not in tables:
+                continue
+            op.create_index(
+                name,
+                table,
+                columns,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+                **kwargs,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    tables = _existing_tables()
+
+    with op.get_context().autocommit_block():
+        for name, table, _columns, _kwargs in reversed(INDEXES):
+            if table not in tables:
+                continue
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
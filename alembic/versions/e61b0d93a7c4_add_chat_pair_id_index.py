@@ -0,0 +1,60 @@
+"""add chat pair id index
+
+Revision ID: e61b0d93a7c4
+Revises: 8c2f47b1d6e0
+Create Date: 2026-10-18 15:37:09.486120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e61b0d93a7c4'
+down_revision: Union[str, Sequence[str], None] = '8c2f47b1d6e0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Chat history windows filter on the unordered pair and walk by id:
+#   WHERE least(sender_id, receiver_id) = ? AND greatest(...) = ?
+#     AND id < ? ORDER BY id DESC LIMIT ?
+INDEX_NAME = 'ix_chat_messages_pair_id'
+
+
+def _has_chat_messages() -> bool:
+    # chat_messages was created outside of Alembic on some databases
+    return 'chat_messages' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _has_chat_messages():
+        return
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX_NAME,
+            'chat_messages',
+            [
+                sa.text('least(sender_id, receiver_id)'),
+                sa.text('greatest(sender_id, receiver_id)'),
+                'id',
+            ],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_chat_messages():
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            INDEX_NAME,
+            table_name='chat_messages',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -1,10 +1,12 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.db.session import get_db
 from app.models.user import User
-from app.core.security import hash_password, verify_password, hash_pin, verify_pin
+from app.core.security import hash_password_async, verify_password_async, hash_pin_async
 from app.core.jwt import get_current_user, create_access_token
+from app.services.user_cache import user_cache
 from app.schemas.auth import (
     UserCreate, UserLogin, UserRead, TokenResponse, PinVerifyRequest,
     UpdateProfileRequest, ChangePasswordRequest, UserProfileResponse,
@@ -17,7 +19,6 @@ router = APIRouter(prefix="/auth", tags=["Auth"])
 # --------------------
 # SIGNUP
 # --------------------
-from app.core.security import hash_password, verify_password, hash_pin  # 👈 add hash_pin
 @router.post("/signup", response_model=UserRead, status_code=201)
 async def signup(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
 
@@ -27,11 +28,17 @@ async def signup(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
+    # Both bcrypt hashes run in parallel on the hashing pool
+    hashed_password, pin_hashed = await asyncio.gather(
+        hash_password_async(user_data.password),
+        hash_pin_async(user_data.pin),
+    )
+
     new_user = User(
         email=user_data.email,
-        hashed_password=hash_password(user_data.password),
+        hashed_password=hashed_password,
         full_name=user_data.full_name,
-        pin_hashed=hash_pin(user_data.pin),
+        pin_hashed=pin_hashed,
     )
 
     db.add(new_user)
@@ -43,6 +50,8 @@ async def signup(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     db.add(wallet)
 
     await db.commit()
+    # Chat lookups may have cached "no such user" for this email or name
+    user_cache.invalidate(new_user.id)
     await db.refresh(new_user)
 
     return new_user
@@ -62,7 +71,7 @@ async def login(user_data: UserLogin, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.email == user_data.email))
     user = result.scalar_one_or_none()
 
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    if not user or not await verify_password_async(user_data.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Invalid login credentials")
 
     access_token = create_access_token({"sub": str(user.id)})
@@ -1,43 +1,48 @@
 # app/api/v1/chat/routes.py - COMPLETELY FIXED
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Query, Response
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, or_, and_
 from datetime import datetime
-import json
 from uuid import UUID
-# app/api/v1/chat/routes.py - FIXED VERSION
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_
-from datetime import datetime
+import asyncio
 import json
 import logging
 
 from app.db.session import get_db
+from app.db.database import async_session_maker
+from app.core.config import settings
+from app.core.cursor import encode_cursor, decode_cursor
 from app.core.jwt import get_current_user, get_current_user_ws_light
 from app.models.user import User
 from app.models.chat import ChatMessage
-from app.services.chat_manager import ConnectionManager
-
-router = APIRouter(prefix="/chat", tags=["Chat"])
-logger = logging.getLogger(__name__)
-
-# Create connection manager instance
-manager = ConnectionManager()
-from app.schemas.chat import MessageCreate, MessageResponse
-from app.services.chat_manager import ConnectionManager
+from app.schemas.chat import MessageCreate, MessageResponse, MarkReadRequest
 from app.crud.chat import (
     create_message, 
     get_chat_history, 
-    get_conversation_users, 
-    get_last_message, 
-    get_unread_count,
-    get_received_messages,
-    get_all_user_messages,
-    mark_messages_as_read
+    get_conversation_summaries,
+    get_received_messages_with_senders,
+    get_all_user_messages_with_users,
+    get_total_unread,
+    get_pending_messages_with_senders,
+    get_messages_since_seq,
+    get_inbox_position,
+    ack_delivered,
+    get_conversation_partner_ids,
+    get_last_read_ids,
+    message_is_read,
+    advance_read_watermark,
+    mark_messages_as_read,
+    mark_message_as_read as mark_single_message_as_read
 )
+from app.services.chat_manager import Connection, manager
+from app.services.message_writer import message_writer
+from app.services.user_cache import user_cache
+from app.services.ws_protocol import FrameDecodeError, negotiate
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
+logger = logging.getLogger(__name__)
+
 # Add this to your routes.py for debugging
 @router.get("/debug-token")
 async def debug_token(current_user: User = Depends(get_current_user)):
@@ -55,8 +60,6 @@ async def public_test():
         "message": "Public endpoint works",
         "status": "success"
     }
-# Create connection manager instance
-manager = ConnectionManager()
 async def get_user_by_id(db: AsyncSession, user_id: int) -> User:
     """Get user by ID with error handling"""
     try:
@@ -69,10 +72,16 @@ async def get_user_by_id(db: AsyncSession, user_id: int) -> User:
         return None
 
 async def find_user_by_identifier(db: AsyncSession, identifier: str) -> User:
-    """Find user by email or full name with error handling"""
+    """Find user by id, email or full name with error handling"""
     try:
         from sqlalchemy import select, or_
         
+        # Conversation lists hand out user ids
+        try:
+            return await get_user_by_id(db, UUID(identifier))
+        except ValueError:
+            pass
+
         # Try by email
         query = select(User).where(User.email == identifier)
         result = await db.execute(query)
@@ -91,7 +100,24 @@ async def find_user_by_identifier(db: AsyncSession, identifier: str) -> User:
     except Exception as e:
         print(f"❌ Error finding user by identifier {identifier}: {e}")
         return None
-    
+
+
+async def resolve_user_identifier(identifier: str, db: Optional[AsyncSession] = None):
+    """
+    find_user_by_identifier through the per-process identifier cache.
+    Returns a UserSnapshot, or None if no user matches. Without `db` a
+    short-lived session is borrowed on a miss.
+    """
+    cached, snapshot = user_cache.get_by_identifier(identifier)
+    if cached:
+        return snapshot
+    if db is not None:
+        user = await find_user_by_identifier(db, identifier)
+    else:
+        async with async_session_maker() as db:
+            user = await find_user_by_identifier(db, identifier)
+    return user_cache.set_identifier(identifier, user)
+
 
 @router.get("/test-websocket")
 async def test_websocket_connection(
@@ -100,73 +126,258 @@ async def test_websocket_connection(
 ):
     """Test if WebSocket connection would work for current user"""
     user_id_str = str(current_user.id)
-    is_online = user_id_str in manager.active_connections
+    is_online = await manager.is_user_online(user_id_str)
     
     return {
         "user_id": user_id_str,
         "user_email": current_user.email,
         "is_online": is_online,
-        "active_connections": len(manager.active_connections),
+        "active_connections": manager.connection_count,
+        "devices": len(manager.connections_of(user_id_str)),
         "websocket_url": f"ws://localhost:8000/api/v1/chat/ws/{current_user.email}?token=YOUR_TOKEN"
     }
-async def send_pending_messages(db: AsyncSession, user: User, websocket: WebSocket):
-    """Send any undelivered messages to user when they connect"""
+
+@router.get("/ws-metrics")
+async def get_websocket_metrics(current_user: User = Depends(get_current_user)):
+    """
+    Outbound queue depth, time-in-queue and overflow counters of this
+    worker, plus the hit rates of the user and chat identifier caches
+    """
+    return {
+        **manager.get_metrics(),
+        "user_cache": user_cache.stats(),
+        "identifier_cache": user_cache.identifier_stats(),
+    }
+
+async def send_pending_messages(
+    user: User,
+    connection: Connection,
+    after_id: Optional[int] = None,
+    since_seq: Optional[int] = None
+):
+    """
+    Send undelivered messages to user in bundled "backlog" frames.
+
+    Without since_seq these are the unread messages, oldest first. With
+    since_seq (a client resuming with ?since=) they are every message
+    numbered above it in the user's stream, read or not: only the gap the
+    client missed, instead of all unread messages again.
+
+    At most CHAT_BACKLOG_LIMIT messages per call, loaded with one joined
+    query on a session of its own (this runs as a task next to the receive
+    loop). If more are waiting, the last frame carries more_available and
+    next_after_id (or next_since); the client asks for them with
+    {"type": "backlog", "after_id": next_after_id} (or "since": next_since).
+    """
     try:
-        # Get messages where this user is receiver and not read
-        from sqlalchemy import select
-        from app.models.chat import ChatMessage
-        
-        query = select(ChatMessage).where(
-            ChatMessage.receiver_id == user.id,
-            ChatMessage.is_read == False
-        ).order_by(ChatMessage.timestamp.asc())
-        
-        result = await db.execute(query)
-        pending_messages = result.scalars().all()
-        
-        for message in pending_messages:
-            # Get sender info
-            sender_query = select(User).where(User.id == message.sender_id)
-            sender_result = await db.execute(sender_query)
-            sender = sender_result.scalar_one_or_none()
-            
-            if sender:
-                message_data = {
-                    "id": message.id,
-                    "sender_id": str(message.sender_id),
-                    "receiver_id": str(message.receiver_id),
-                    "content": message.content,
-                    "message_type": message.message_type,
-                    "timestamp": message.timestamp.isoformat(),
-                    "is_read": message.is_read,
-                    "sender_email": sender.email,
-                    "sender_name": sender.full_name,
-                    "receiver_email": user.email,
-                    "receiver_name": user.full_name,
-                    "is_pending": True  # Flag to indicate this was a pending message
-                }
-                
-                await websocket.send_text(json.dumps(message_data))
-                print(f"📨 Delivered pending message {message.id} to {user.email}")
+        limit = settings.CHAT_BACKLOG_LIMIT
+        async with async_session_maker() as db:
+            if since_seq is None:
+                rows = [
+                    (message, sender, False)
+                    for message, sender in await get_pending_messages_with_senders(
+                        db, user.id, limit=limit + 1, after_id=after_id
+                    )
+                ]
+            else:
+                rows = await get_messages_since_seq(db, user.id, since_seq, limit=limit + 1)
+        more_available = len(rows) > limit
+        rows = rows[:limit]
+
+        # Nothing waiting on connect: stay quiet. An explicit request gets an answer.
+        if not rows and after_id is None and since_seq is None:
+            return
+
+        frame_size = settings.CHAT_BACKLOG_FRAME_SIZE
+        for start in range(0, max(len(rows), 1), frame_size):
+            frame_rows = rows[start:start + frame_size]
+            done = start + frame_size >= len(rows)
+            last = rows[-1][0] if done and more_available else None
+            frame = {
+                "type": "backlog",
+                "messages": [
+                    {
+                        "id": message.id,
+                        "seq": message.recipient_seq,
+                        "sender_id": str(message.sender_id),
+                        "receiver_id": str(message.receiver_id),
+                        "content": message.content,
+                        "message_type": message.message_type,
+                        "timestamp": message.timestamp.isoformat(),
+                        "is_read": is_read,
+                        "sender_email": sender.email,
+                        "sender_name": sender.full_name,
+                        "receiver_email": user.email,
+                        "receiver_name": user.full_name,
+                        "is_pending": True  # Flag to indicate this was a pending message
+                    }
+                    for message, sender, is_read in frame_rows
+                ],
+                "done": done,
+                "more_available": done and more_available,
+                "next_after_id": last.id if last is not None and since_seq is None else None,
+                "next_since": last.recipient_seq if last is not None and since_seq is not None else None,
+            }
+            connection.send_frame(frame)
         
-        if pending_messages:
-            print(f"✅ Delivered {len(pending_messages)} pending messages to {user.email}")
+        if rows:
+            print(f"✅ Delivered {len(rows)} pending messages to {user.email}"
+                  f"{' (more available)' if more_available else ''}")
             
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         print(f"❌ Error delivering pending messages: {e}")
+
+async def _validate_send(message_data):
+    """(receiver, content, message_type, client_msg_id) for one client send, or an error frame"""
+    # Validate message data
+    if not isinstance(message_data, dict) or not all(
+        k in message_data for k in ["receiver_identifier", "content"]
+    ):
+        return None, {"error": "Invalid message format. Required: receiver_identifier, content"}
+
+    # Validate content
+    content = str(message_data.get("content", "")).strip()
+    if not content:
+        return None, {"error": "Message content cannot be empty"}
+
+    # Find receiver
+    receiver_identifier = message_data["receiver_identifier"]
+    receiver = await resolve_user_identifier(str(receiver_identifier))
+    if not receiver:
+        return None, {"error": f"Receiver '{receiver_identifier}' not found"}
+
+    # Sender-chosen id that makes a retried send idempotent
+    client_msg_id = message_data.get("client_msg_id")
+    if client_msg_id is not None and (not isinstance(client_msg_id, str) or len(client_msg_id) > 64):
+        return None, {"error": "client_msg_id must be a string of at most 64 characters"}
+
+    # v1 clients put the message type in "type", v2 in "message_type"
+    message_type = message_data.get("message_type") or message_data.get("type", "text")
+    return (receiver, content, message_type, client_msg_id), None
+
+async def _save_and_forward(
+    user: User, receiver, content: str, message_type: str, client_msg_id: Optional[str]
+) -> dict:
+    """Store one message, push it to the receiver, return the sender's ack"""
+    # Create message in database (group-committed with other senders)
+    try:
+        message, duplicate = await message_writer.submit(
+            sender_id=user.id,
+            receiver_id=receiver.id,
+            content=content,
+            message_type=message_type,
+            client_msg_id=client_msg_id
+        )
+    except Exception as e:
+        print(f"❌ Error saving message: {e}")
+        return {"error": "Failed to save message"}
+
+    # Sending ends the sender's typing indicator in this conversation
+    manager.presence.typing_stopped(str(user.id), str(receiver.id))
+
+    # A retry of a send that was already stored: ack it again, deliver nothing
+    if duplicate:
+        return {
+            "type": "message_status",
+            "status": "duplicate",
+            "message_id": message.id,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+    # Prepare message response
+    message_response = {
+        "id": message.id,
+        "seq": message.recipient_seq,
+        "sender_id": str(message.sender_id),
+        "receiver_id": str(message.receiver_id),
+        "content": message.content,
+        "message_type": message.message_type,
+        "timestamp": message.timestamp.isoformat(),
+        "is_read": message.is_read,
+        "sender_email": user.email,
+        "sender_name": user.full_name,
+        "receiver_email": receiver.email,
+        "receiver_name": receiver.full_name
+    }
+
+    # Send to receiver if online
+    receiver_sent = await manager.send_personal_message(
+        json.dumps(message_response),
+        str(receiver.id)
+    )
+
+    # Confirmation for the sender
+    return {
+        "type": "message_status",
+        "status": "sent" if receiver_sent else "saved_offline",
+        "message_id": message.id,
+        "receiver_online": receiver_sent,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+async def handle_client_sends(user: User, sends: list) -> list:
+    """
+    Process message sends from one client frame and return one ack (or
+    error) per send, in order, echoing each send's client_msg_id. Sends
+    are validated in order, then saved together so a batch shares one
+    group commit and keeps its order.
+    """
+    acks = [None] * len(sends)
+    pending = []
+    for index, message_data in enumerate(sends):
+        send, error = await _validate_send(message_data)
+        if error is not None:
+            acks[index] = error
+        else:
+            pending.append((index, _save_and_forward(user, *send)))
+
+    results = await asyncio.gather(*(coroutine for _, coroutine in pending))
+    for (index, _), ack in zip(pending, results):
+        acks[index] = ack
+
+    for ack, message_data in zip(acks, sends):
+        if isinstance(message_data, dict) and message_data.get("client_msg_id") is not None:
+            ack["client_msg_id"] = message_data["client_msg_id"]
+    return acks
+
 # Add this to your app/api/v1/chat/routes.py WebSocket endpoint
 @router.websocket("/ws/{user_identifier}")
 async def websocket_endpoint(
     websocket: WebSocket,
-    user_identifier: str,
-    db: AsyncSession = Depends(get_db)
+    user_identifier: str
 ):
     """
     WebSocket endpoint for real-time chat
+
+    Holds no database session between frames: lookups borrow a short-lived
+    session and message writes go through the group-commit writer, so an
+    idle socket does not pin a pooled connection.
+
+    Plain JSON frames unless the client negotiates a subprotocol
+    (Sec-WebSocket-Protocol): chat.v2.json or chat.v2.msgpack use compact
+    keys and accept a list of sends per frame, answered with one "acks"
+    frame. See app/services/ws_protocol.py.
+
+    Every received message carries "seq", its position in the receiver's
+    stream. Clients confirm with {"type": "ack", "seq": n} and reconnect
+    with ?since=<last seq seen> to get only what they missed; sends with
+    a client_msg_id are stored once however often they are retried.
+
+    {"type": "presence_subscribe"} watches the user's conversation partners
+    (optionally only those in "user_ids"): one "presence" frame with their
+    current state, then only changes. {"type": "typing", "user_id": partner}
+    shows a typing indicator to that partner for a few seconds.
+
+    Idle sockets get {"type": "ping"} and should answer {"type": "pong"};
+    see app/services/heartbeat.py for when silent ones are closed.
     """
     print(f"🔗 WebSocket connection attempt for: {user_identifier}")
     
     user = None
+    connection = None
+    replay_task = None
     try:
         # Authenticate user
         authenticated_user_id = await get_current_user_ws_light(websocket)
@@ -175,17 +386,29 @@ async def websocket_endpoint(
             return
 
         # Get full user object from database
-        user = await get_user_by_id(db, authenticated_user_id)
+        async with async_session_maker() as db:
+            user = await get_user_by_id(db, authenticated_user_id)
+            inbox = await get_inbox_position(db, user.id) if user else None
         if not user:
             await websocket.close(code=1008)
             return
 
+        # ?since=<seq>: resume after the last sequence number the client has
+        since_seq = None
+        since_error = None
+        if websocket.query_params.get("since") is not None:
+            try:
+                since_seq = max(int(websocket.query_params["since"]), 0)
+            except ValueError:
+                since_error = {"error": "since must be an integer sequence number"}
+
         print(f"✅ User {user.email} authenticated")
 
         # Connect user
         user_id_str = str(user.id)
-        await manager.connect(websocket, user_id_str)
-        print(f"✅ User {user.email} connected. Active connections: {len(manager.active_connections)}")
+        protocol = negotiate(websocket.scope.get("subprotocols", []))
+        connection = await manager.connect(websocket, user_id_str, protocol)
+        print(f"✅ User {user.email} connected. Active connections: {manager.connection_count}")
 
         # Send connection confirmation
         welcome_msg = {
@@ -193,105 +416,127 @@ async def websocket_endpoint(
             "content": "WebSocket connected successfully",
             "timestamp": datetime.utcnow().isoformat(),
             "user_id": user_id_str,
-            "user_email": user.email
+            "user_email": user.email,
+            "connection_id": connection.connection_id,
+            "protocol": protocol.name,
+            "last_seq": inbox["last_seq"],
+            "acked_seq": inbox["acked_seq"]
         }
-        await websocket.send_text(json.dumps(welcome_msg))
+        connection.send_frame(welcome_msg)
+        if since_error is not None:
+            connection.send_frame(since_error)
+        acked_seq = inbox["acked_seq"]
 
-        # Send pending messages if any
-        await send_pending_messages(db, user, websocket)
+        # Replay pending messages (or the gap since ?since=) alongside the
+        # receive loop so live messages are not held up behind a long backlog
+        replay_task = asyncio.create_task(
+            send_pending_messages(user, connection, since_seq=since_seq)
+        )
 
         # Main message loop
         while True:
-            data = await websocket.receive_text()
-            
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            data = frame["text"] if frame.get("text") is not None else frame.get("bytes")
+            connection.touch()
+
             try:
-                message_data = json.loads(data)
-                
-                # Validate message data
-                if not all(k in message_data for k in ["receiver_identifier", "content"]):
-                    error_msg = {"error": "Invalid message format. Required: receiver_identifier, content"}
-                    await websocket.send_text(json.dumps(error_msg))
+                message_data = protocol.decode(data)
+
+                # Heartbeat: answer to our ping, or the client checking on us
+                if isinstance(message_data, dict) and message_data.get("type") == "pong":
+                    manager.heartbeat.pong(connection)
+                    continue
+                if isinstance(message_data, dict) and message_data.get("type") == "ping":
+                    connection.send_frame({"type": "pong", "timestamp": datetime.utcnow().isoformat()})
                     continue
 
-                # Validate content
-                content = message_data.get("content", "").strip()
-                if not content:
-                    error_msg = {"error": "Message content cannot be empty"}
-                    await websocket.send_text(json.dumps(error_msg))
+                # Several sends in one frame (v2 protocols): one batched ack
+                if isinstance(message_data, list) and protocol.batching:
+                    if len(message_data) > settings.CHAT_WS_MAX_BATCH:
+                        connection.send_frame({"error": f"At most {settings.CHAT_WS_MAX_BATCH} messages per batch"})
+                        continue
+                    acks = await handle_client_sends(user, message_data)
+                    connection.send_frame({"type": "acks", "acks": acks})
                     continue
 
-                # Find receiver
-                receiver_identifier = message_data["receiver_identifier"]
-                receiver = await find_user_by_identifier(db, receiver_identifier)
-                if not receiver:
-                    error_msg = {"error": f"Receiver '{receiver_identifier}' not found"}
-                    await websocket.send_text(json.dumps(error_msg))
+                # Client asks for the next page of its backlog
+                if isinstance(message_data, dict) and message_data.get("type") == "backlog":
+                    after_id = message_data.get("after_id")
+                    since = message_data.get("since")
+                    if not isinstance(after_id, int) and not isinstance(since, int):
+                        connection.send_frame({"error": "backlog requires an integer after_id or since"})
+                        continue
+                    if replay_task is None or replay_task.done():
+                        replay_task = asyncio.create_task(
+                            send_pending_messages(
+                                user,
+                                connection,
+                                after_id=after_id if isinstance(after_id, int) else None,
+                                since_seq=since if isinstance(since, int) else None
+                            )
+                        )
                     continue
 
-                # Create message in database
-                try:
-                    from app.crud.chat import create_message
-                    message = await create_message(
-                        db=db,
-                        sender_id=user.id,
-                        receiver_id=receiver.id,
-                        content=content,
-                        message_type=message_data.get("type", "text")
-                    )
-                except Exception as e:
-                    print(f"❌ Error saving message: {e}")
-                    error_msg = {"error": "Failed to save message"}
-                    await websocket.send_text(json.dumps(error_msg))
+                # Client watches its conversation partners (or those of user_ids)
+                if isinstance(message_data, dict) and message_data.get("type") == "presence_subscribe":
+                    user_ids = message_data.get("user_ids")
+                    if user_ids is not None and not isinstance(user_ids, list):
+                        connection.send_frame({"error": "user_ids must be a list"})
+                        continue
+                    async with async_session_maker() as db:
+                        partners = [
+                            str(partner_id)
+                            for partner_id in await get_conversation_partner_ids(
+                                db, user.id, limit=manager.presence.max_subscriptions
+                            )
+                        ]
+                    if user_ids is not None:
+                        wanted = {str(user_id) for user_id in user_ids}
+                        partners = [partner_id for partner_id in partners if partner_id in wanted]
+                    snapshot = await manager.presence.subscribe(connection, partners)
+                    connection.send_frame({"type": "presence", "changes": snapshot})
+                    continue
+
+                # Client is typing to a partner; repeat every few seconds while it lasts
+                if isinstance(message_data, dict) and message_data.get("type") == "typing":
+                    partner_id = message_data.get("user_id")
+                    if not isinstance(partner_id, str):
+                        connection.send_frame({"error": "typing requires the partner's user_id"})
+                    else:
+                        manager.presence.typing(user_id_str, partner_id)
                     continue
 
-                # Prepare message response
-                message_response = {
-                    "id": message.id,
-                    "sender_id": str(message.sender_id),
-                    "receiver_id": str(message.receiver_id),
-                    "content": message.content,
-                    "message_type": message.message_type,
-                    "timestamp": message.timestamp.isoformat(),
-                    "is_read": message.is_read,
-                    "sender_email": user.email,
-                    "sender_name": user.full_name,
-                    "receiver_email": receiver.email,
-                    "receiver_name": receiver.full_name
-                }
-
-                # Send to receiver if online
-                receiver_id_str = str(receiver.id)
-                receiver_sent = await manager.send_personal_message(
-                    json.dumps(message_response),
-                    receiver_id_str
-                )
-
-                # Send confirmation to sender
-                confirmation = {
-                    "type": "message_status",
-                    "status": "sent" if receiver_sent else "saved_offline",
-                    "message_id": message.id,
-                    "receiver_online": receiver_sent,
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                await websocket.send_text(json.dumps(confirmation))
-
-            except json.JSONDecodeError:
-                error_msg = {"error": "Invalid JSON format"}
-                await websocket.send_text(json.dumps(error_msg))
+                # Client confirms receipt of everything up to seq (cumulative)
+                if isinstance(message_data, dict) and message_data.get("type") == "ack":
+                    seq = message_data.get("seq")
+                    if not isinstance(seq, int):
+                        connection.send_frame({"error": "ack requires an integer seq"})
+                    elif seq > acked_seq:
+                        async with async_session_maker() as db:
+                            acked_seq = await ack_delivered(db, user.id, seq) or acked_seq
+                    continue
+
+                connection.send_frame((await handle_client_sends(user, [message_data]))[0])
+
+            except FrameDecodeError as e:
+                connection.send_frame({"error": str(e)})
             except Exception as e:
                 print(f"❌ Error processing message: {e}")
                 error_msg = {"error": f"Error processing message: {str(e)}"}
-                await websocket.send_text(json.dumps(error_msg))
+                connection.send_frame(error_msg)
                 
     except WebSocketDisconnect:
         print(f"🔴 WebSocket disconnected for {user_identifier}")
     except Exception as e:
         print(f"❌ WebSocket error: {e}")
     finally:
+        if replay_task is not None and not replay_task.done():
+            replay_task.cancel()
         # Always clean up connection
-        if user:
-            manager.disconnect(str(user.id))
+        if connection is not None:
+            await manager.disconnect(connection)
             print(f"🧹 Cleaned up connection for {user.email}")
 # Keep your existing HTTP endpoints...
 @router.post("/test-send-message")
@@ -305,7 +550,7 @@ async def test_send_message(
     logger.info(f"🧪 Testing message send: from {current_user.email} to {receiver_identifier}")
     
     # Find receiver
-    receiver = await find_user_by_identifier(db, receiver_identifier)
+    receiver = await resolve_user_identifier(receiver_identifier, db)
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
     
@@ -356,24 +601,49 @@ async def test_send_message(
         "receiver_email": receiver.email,
         "receiver_online": receiver_sent,
         "sender_online": sender_sent,
-        "active_connections": list(manager.active_connections.keys()),
+        "active_connections": await manager.get_online_users(),
         "message_content": content
     }
 
 @router.get("/history/{receiver_identifier}")
 async def get_chat_history_endpoint(
     receiver_identifier: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    before_id: Optional[int] = Query(None),
+    after_id: Optional[int] = Query(None),
+    around_id: Optional[int] = Query(None),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get chat history between current user and receiver
+    Get chat history between current user and receiver, oldest first.
+
+    Returns the newest `limit` messages by default. Page older with
+    `before_id` (the first id you have), newer with `after_id` (the last id
+    you have), or jump to a message with `around_id`. X-Has-More-Before /
+    X-Has-More-After tell whether another page exists in that direction.
     """
-    receiver = await find_user_by_identifier(db, receiver_identifier)
+    cursors = [c for c in (before_id, after_id, around_id) if c is not None]
+    if len(cursors) > 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Use only one of before_id, after_id and around_id"
+        )
+
+    receiver = await resolve_user_identifier(receiver_identifier, db)
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
     
-    messages = await get_chat_history(db, current_user.id, receiver.id)
+    messages, has_more_before, has_more_after = await get_chat_history(
+        db, current_user.id, receiver.id,
+        limit=limit, before_id=before_id, after_id=after_id, around_id=around_id
+    )
+    if has_more_before is not None:
+        response.headers["X-Has-More-Before"] = "true" if has_more_before else "false"
+    if has_more_after is not None:
+        response.headers["X-Has-More-After"] = "true" if has_more_after else "false"
+    last_read_ids = await get_last_read_ids(db, current_user.id, receiver.id)
     
     # Convert to response format
     response_messages = []
@@ -385,7 +655,7 @@ async def get_chat_history_endpoint(
             "content": message.content,
             "message_type": message.message_type,
             "timestamp": message.timestamp.isoformat(),
-            "is_read": message.is_read,
+            "is_read": message_is_read(message, last_read_ids),
             "is_sent_by_me": message.sender_id == current_user.id
         })
     
@@ -412,76 +682,60 @@ async def get_available_users(
         for user in users
     ]
 
-@router.get("/conversations")
-async def get_user_conversations(
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """
-    Get all conversations for current user
-    """
-    users = await get_conversation_users(db, current_user.id)
-    
-    conversations = []
-    for user in users:
-        last_message = await get_last_message(db, current_user.id, user.id)
-        unread_count = await get_unread_count(db, current_user.id, user.id)
-        
-        conversations.append({
-            "user": {
-                "id": str(user.id),
-                "email": user.email,
-                "full_name": user.full_name
-            },
-            "last_message": {
-                "content": last_message.content if last_message else None,
-                "timestamp": last_message.timestamp.isoformat() if last_message else None,
-                "is_sent_by_me": last_message.sender_id == current_user.id if last_message else None
-            },
-            "unread_count": unread_count
-        })
-    
-    # Sort by timestamp
-    conversations.sort(key=lambda x: x["last_message"]["timestamp"] or "0001-01-01T00:00:00", reverse=True)
-    
-    return conversations
+def _parse_message_cursor(cursor: Optional[str]):
+    """Decode a (timestamp, id) message cursor from a previous X-Next-Cursor header"""
+    if not cursor:
+        return None
+    try:
+        values = decode_cursor(cursor)
+        return datetime.fromisoformat(values["ts"]), int(values["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _set_next_cursor(response: Response, rows: list, limit: Optional[int]):
+    """Expose the next page cursor in a header so the body stays a plain list"""
+    if limit is not None and len(rows) == limit:
+        last_message = rows[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            {"ts": last_message.timestamp.isoformat(), "id": last_message.id}
+        )
+
 
 @router.get("/received-messages")
 async def get_received_messages(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all messages received by current user - SIMPLEST VERSION
+    Get messages received by current user, newest first.
+
+    Senders are joined in the same query. Without `limit` every message is
+    returned (old clients); with it, follow the X-Next-Cursor header.
     """
+    before = _parse_message_cursor(cursor)
     try:
-        # Direct query for messages
-        query = select(ChatMessage).where(
-            ChatMessage.receiver_id == current_user.id
-        ).order_by(ChatMessage.timestamp.desc())
-        
-        result = await db.execute(query)
-        messages = result.scalars().all()
-        
-        response_messages = []
-        for message in messages:
-            # Get sender info with separate query
-            sender_query = select(User).where(User.id == message.sender_id)
-            sender_result = await db.execute(sender_query)
-            sender = sender_result.scalar_one_or_none()
-            
-            response_messages.append({
+        rows = await get_received_messages_with_senders(
+            db, current_user.id, limit=limit, before=before
+        )
+        _set_next_cursor(response, rows, limit)
+
+        return [
+            {
                 "id": message.id,
                 "sender_id": str(message.sender_id),
-                "sender_email": sender.email if sender else "Unknown",
-                "sender_name": sender.full_name if sender else "Unknown User",
+                "sender_email": sender.email,
+                "sender_name": sender.full_name,
                 "content": message.content,
                 "message_type": message.message_type,
                 "timestamp": message.timestamp.isoformat(),
-                "is_read": message.is_read
-            })
-        
-        return response_messages
+                "is_read": is_read
+            }
+            for message, sender, is_read in rows
+        ]
         
     except Exception as e:
         print(f"❌ Error in /received-messages: {e}")
@@ -490,52 +744,42 @@ async def get_received_messages(
  
 @router.get("/all-messages")
 async def get_all_user_messages(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all messages for current user - SIMPLEST VERSION
+    Get all messages for current user (sent and received), newest first.
+
+    Sender and receiver are joined in the same query. Without `limit` every
+    message is returned (old clients); with it, follow X-Next-Cursor.
     """
+    before = _parse_message_cursor(cursor)
     try:
-        # Direct query for messages
-        query = select(ChatMessage).where(
-            or_(
-                ChatMessage.sender_id == current_user.id,
-                ChatMessage.receiver_id == current_user.id
-            )
-        ).order_by(ChatMessage.timestamp.desc())
-        
-        result = await db.execute(query)
-        messages = result.scalars().all()
-        
-        response_messages = []
-        for message in messages:
-            # Get sender info
-            sender_query = select(User).where(User.id == message.sender_id)
-            sender_result = await db.execute(sender_query)
-            sender = sender_result.scalar_one_or_none()
-            
-            # Get receiver info
-            receiver_query = select(User).where(User.id == message.receiver_id)
-            receiver_result = await db.execute(receiver_query)
-            receiver = receiver_result.scalar_one_or_none()
-            
-            response_messages.append({
+        rows = await get_all_user_messages_with_users(
+            db, current_user.id, limit=limit, before=before
+        )
+        _set_next_cursor(response, rows, limit)
+
+        return [
+            {
                 "id": message.id,
                 "sender_id": str(message.sender_id),
-                "sender_email": sender.email if sender else "Unknown",
-                "sender_name": sender.full_name if sender else "Unknown User",
+                "sender_email": sender.email,
+                "sender_name": sender.full_name,
                 "receiver_id": str(message.receiver_id),
-                "receiver_email": receiver.email if receiver else "Unknown",
-                "receiver_name": receiver.full_name if receiver else "Unknown User",
+                "receiver_email": receiver.email,
+                "receiver_name": receiver.full_name,
                 "content": message.content,
                 "message_type": message.message_type,
                 "timestamp": message.timestamp.isoformat(),
-                "is_read": message.is_read,
+                "is_read": is_read,
                 "is_sent_by_me": message.sender_id == current_user.id
-            })
-        
-        return response_messages
+            }
+            for message, sender, receiver, is_read in rows
+        ]
         
     except Exception as e:
         print(f"❌ Error in /all-messages: {e}")
@@ -550,65 +794,102 @@ async def mark_message_as_read(
     """
     Mark a message as read
     """
-    query = select(ChatMessage).where(
-        and_(
-            ChatMessage.id == message_id,
-            ChatMessage.receiver_id == current_user.id
-        )
-    )
-    result = await db.execute(query)
-    message = result.scalar_one_or_none()
+    message = await mark_single_message_as_read(db, message_id, current_user.id)
     
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    message.is_read = True
-    await db.commit()
-    
     return {"status": "success", "message": "Message marked as read"}
 
-# Also fix the conversations endpoint to handle empty cases
+@router.get("/unread-count")
+async def get_unread_badge(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Total unread messages for the chat badge, summed from the per
+    conversation counters
+    """
+    return {"unread_count": await get_total_unread(db, current_user.id)}
+
+@router.post("/conversations/{partner_identifier}/read")
+async def mark_conversation_as_read(
+    partner_identifier: str,
+    payload: Optional[MarkReadRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Mark the conversation with partner as read, up to `up_to_id` or the
+    latest message. Moves the read watermark with a single row update.
+    """
+    partner = await resolve_user_identifier(partner_identifier, db)
+    if not partner:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    up_to_id = payload.up_to_id if payload else None
+    watermark = await advance_read_watermark(db, current_user.id, partner.id, up_to_id)
+    if watermark is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Read receipt for the partner if they are online
+    await manager.send_personal_message(
+        json.dumps({
+            "type": "read_receipt",
+            "reader_id": str(current_user.id),
+            "last_read_id": watermark["last_read_id"],
+        }),
+        str(partner.id),
+        coalesce_key=f"read_receipt:{current_user.id}",
+    )
+
+    return {
+        "partner_id": str(partner.id),
+        "last_read_id": watermark["last_read_id"],
+        "unread_count": watermark["unread_count"],
+    }
+
 @router.get("/conversations")
 async def get_user_conversations(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all conversations for current user (users they've chatted with)
+    Get all conversations for current user (users they've chatted with),
+    most recent activity first.
+
+    Partner, last message and unread count come from one query. Without
+    `limit` every conversation is returned (old clients); with it, follow
+    the X-Next-Cursor header.
     """
+    before = _parse_message_cursor(cursor)
     try:
-        from app.crud.chat import get_conversation_users, get_last_message, get_unread_count
-        
-        # Get all users that current user has chatted with
-        users = await get_conversation_users(db, current_user.id)
-        
-        conversations = []
-        for user in users:
-            # Get last message
-            last_message = await get_last_message(db, current_user.id, user.id)
-            
-            # Get unread message count
-            unread_count = await get_unread_count(db, current_user.id, user.id)
-            
-            conversations.append({
+        rows = await get_conversation_summaries(
+            db, current_user.id, limit=limit, before=before
+        )
+        _set_next_cursor(response, rows, limit)
+
+        return [
+            {
                 "user": {
-                    "id": str(user.id),
-                    "email": user.email,
-                    "full_name": user.full_name
+                    "id": str(partner.id),
+                    "email": partner.email,
+                    "full_name": partner.full_name
                 },
                 "last_message": {
-                    "content": last_message.content if last_message else None,
-                    "timestamp": last_message.timestamp.isoformat() if last_message else None,
-                    "is_sent_by_me": last_message.sender_id == current_user.id if last_message else None
+                    "id": last_message.id,
+                    "content": last_message.content,
+                    "timestamp": last_message.timestamp.isoformat(),
+                    "is_sent_by_me": last_message.sender_id == current_user.id
                 },
                 "unread_count": unread_count
-            })
-        
-        # Sort conversations by last message timestamp (most recent first)
-        conversations.sort(key=lambda x: x["last_message"]["timestamp"] or "0001-01-01T00:00:00", reverse=True)
-        
-        return conversations
+            }
+            for last_message, partner, unread_count in rows
+        ]
         
     except Exception as e:
         print(f"❌ Error in /conversations: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -2,7 +2,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_db
-from app.core.jwt import get_current_user
+from app.core.jwt import get_current_user, get_current_user_db
+from app.services.user_cache import user_cache
+from app.services.user_service import get_credential_hashes
 from app.models.user import User
 from app.schemas.profile import (
     ProfileResponse, 
@@ -15,7 +17,7 @@ from app.schemas.profile import (
 from sqlalchemy import select  # ⬅️ ADD THIS
 
 
-from app.core.security import verify_password, hash_password, verify_pin
+from app.core.security import verify_password_async, hash_password_async, verify_pin_async
 
 router = APIRouter(prefix="/profile", tags=["Profile"])
 
@@ -44,7 +46,7 @@ async def get_profile(
 @router.put("/", response_model=ProfileResponse)
 async def update_profile(
     profile_data: ProfileUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_db),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -83,6 +85,7 @@ async def update_profile(
             current_user.mobile_number = profile_data.mobile_number
         
         await db.commit()
+        user_cache.invalidate(current_user.id)
         await db.refresh(current_user)
 
         return ProfileResponse(
@@ -113,8 +116,9 @@ async def verify_user_pin(
     Verify user's transaction PIN
     """
     try:
-        # FIX: Use pin_hashed instead of pin_hash
-        if not current_user.pin_hashed:
+        # Not in the cached current_user: read the hash from the DB
+        hashes = await get_credential_hashes(db, current_user.id)
+        if hashes is None or not hashes.pin_hashed:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="PIN not set for this user"
@@ -127,8 +131,7 @@ async def verify_user_pin(
                 detail="PIN must be exactly 4 digits"
             )
         
-        # FIX: Use pin_hashed instead of pin_hash
-        if not verify_pin(pin_data.pin, current_user.pin_hashed):
+        if not await verify_pin_async(pin_data.pin, hashes.pin_hashed):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid PIN"
@@ -160,7 +163,10 @@ async def verify_user_password(
                 detail="Password is required"
             )
         
-        if not verify_password(password_data.password, current_user.hashed_password):
+        hashes = await get_credential_hashes(db, current_user.id)
+        if hashes is None or not await verify_password_async(
+            password_data.password, hashes.hashed_password
+        ):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid password"
@@ -179,7 +185,7 @@ async def verify_user_password(
 @router.put("/change-password")
 async def change_password(
     password_data: ChangePasswordRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_db),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -187,7 +193,7 @@ async def change_password(
     """
     try:
         # Verify current password
-        if not verify_password(password_data.current_password, current_user.hashed_password):
+        if not await verify_password_async(password_data.current_password, current_user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Current password is incorrect"
@@ -201,8 +207,9 @@ async def change_password(
             )
         
         # Update to new password
-        current_user.hashed_password = hash_password(password_data.new_password)
+        current_user.hashed_password = await hash_password_async(password_data.new_password)
         await db.commit()
+        user_cache.invalidate(current_user.id)
         
         return {"message": "Password changed successfully"}
         
@@ -271,7 +278,7 @@ async def reset_password_with_pin(
             )
 
         # 5) Verify PIN
-        if not verify_pin(data.pin, user.pin_hashed):
+        if not await verify_pin_async(data.pin, user.pin_hashed):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User not found or details incorrect"
@@ -285,8 +292,9 @@ async def reset_password_with_pin(
             )
 
         # 7) Update password
-        user.hashed_password = hash_password(data.new_password)
+        user.hashed_password = await hash_password_async(data.new_password)
         await db.commit()
+        user_cache.invalidate(user.id)
         await db.refresh(user)
 
         return {"message": "Password reset successfully"}
@@ -1,20 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Header
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, tuple_
 from typing import Optional
 from datetime import datetime, date
+from uuid import UUID, uuid4
+import csv
+import io
+import json
 
 from app.db.session import get_db
+from app.db.database import async_session_maker
 from app.core.jwt import get_current_user
-from app.core.security import verify_pin
+from app.core.security import verify_pin_async
+from app.core.cursor import encode_cursor, decode_cursor
+from app.services import wallet_service
+from app.services.user_service import get_credential_hashes
+from app.services.idempotency import idempotency
+from app.services import ledger
 
-from app.models.user import User
 from app.models.wallet import Wallet
 from app.models.transaction import Transaction, TransactionType, TransactionStatus
+from app.models.ledger import EXTERNAL_WALLET_ID
 
-from app.schemas.wallet import WalletRead, AddMoneyRequest, TransferRequest
+from app.schemas.wallet import (
+    WalletRead, AddMoneyRequest, TransferRequest,
+    BatchTransferRequest, BatchTransferResponse,
+)
 from app.schemas.transaction import TransactionRead
-from app.schemas.paginated import PaginatedTransactions
+from app.schemas.paginated import PaginatedTransactions, CursorTransactions
 
 router = APIRouter(
     prefix="/wallet",
@@ -40,9 +54,35 @@ async def get_my_wallet(
 @router.post("/add-money", response_model=WalletRead)
 async def add_money(
     data: AddMoneyRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
+    if not idempotency_key:
+        return await _add_money(data, current_user, db)
+
+    # Retries with the same key get the original response back
+    return await idempotency.run(
+        db,
+        current_user.id,
+        idempotency_key,
+        scope="POST /wallet/add-money",
+        # The request fingerprint is stored; never put the PIN in it
+        payload=data.model_dump(exclude={"pin"}),
+        handler=lambda record: _add_money(data, current_user, db, before_commit=record),
+        response_model=WalletRead,
+    )
+
+
+async def _verify_pin(db: AsyncSession, user_id: UUID, pin: str) -> bool:
+    """The cached current_user has no PIN hash; check against the one in the DB"""
+    hashes = await get_credential_hashes(db, user_id)
+    if hashes is None or not hashes.pin_hashed:
+        return False
+    return await verify_pin_async(pin, hashes.pin_hashed)
+
+
+async def _add_money(data: AddMoneyRequest, current_user, db: AsyncSession, before_commit=None):
     try:
         print(f"🔄 Add money request received for user: {current_user.id}")
         print(f"📦 Request data: amount={data.amount}, pin_length={len(data.pin)}")
@@ -50,21 +90,9 @@ async def add_money(
         if data.amount <= 0:
             raise HTTPException(400, "Amount must be positive")
 
-        # Get user with pin_hashed
-        print(f"🔍 Fetching user with ID: {current_user.id}")
-        user_result = await db.execute(select(User).where(User.id == current_user.id))
-        user = user_result.scalar_one_or_none()
-
-        if not user:
-            print("❌ User not found")
-            raise HTTPException(404, "User not found")
-
-        print(f"✅ User found: {user.email}")
-        print(f"🔐 User has PIN hashed: {bool(user.pin_hashed)}")
-
         # Verify PIN
         print(f"🔑 Verifying PIN...")
-        pin_verified = verify_pin(data.pin, user.pin_hashed)
+        pin_verified = await _verify_pin(db, current_user.id, data.pin)
         print(f"🔑 PIN verification result: {pin_verified}")
         
         # ✅ FIX: Change from 401 to 400 for PIN errors
@@ -73,7 +101,10 @@ async def add_money(
 
         # Get wallet
         print(f"💰 Fetching wallet for user: {current_user.id}")
-        wallet_result = await db.execute(select(Wallet).where(Wallet.user_id == current_user.id))
+        # Row lock so concurrent top-ups can't lose updates (the ledger must match)
+        wallet_result = await db.execute(
+            select(Wallet).where(Wallet.user_id == current_user.id).with_for_update()
+        )
         wallet = wallet_result.scalar_one_or_none()
 
         if not wallet:
@@ -96,6 +127,7 @@ async def add_money(
         # Create transaction record
         print("📝 Creating transaction record...")
         tx = Transaction(
+            id=uuid4(),
             wallet_id=wallet.id,
             amount=amount_decimal,
             type=TransactionType.ADD_MONEY,
@@ -104,6 +136,13 @@ async def add_money(
         )
 
         db.add(tx)
+        # Top-ups come from outside the system
+        await ledger.record_entries(
+            db, [ledger.entry(EXTERNAL_WALLET_ID, wallet.id, amount_decimal, tx.id)]
+        )
+        # Idempotency-Key: store the response in this same transaction
+        if before_commit is not None:
+            await before_commit(wallet)
         print("💾 Committing to database...")
         await db.commit()
         await db.refresh(wallet)
@@ -125,9 +164,27 @@ async def add_money(
 @router.post("/transfer", response_model=WalletRead)
 async def transfer_money(
     data: TransferRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
+    if not idempotency_key:
+        return await _transfer_money(data, current_user, db)
+
+    # Retries with the same key get the original response back
+    return await idempotency.run(
+        db,
+        current_user.id,
+        idempotency_key,
+        scope="POST /wallet/transfer",
+        # The request fingerprint is stored; never put the PIN in it
+        payload=data.model_dump(exclude={"pin"}),
+        handler=lambda record: _transfer_money(data, current_user, db, before_commit=record),
+        response_model=WalletRead,
+    )
+
+
+async def _transfer_money(data: TransferRequest, current_user, db: AsyncSession, before_commit=None):
     try:
         print(f"🔄 Transfer request: {current_user.email} -> {data.to_email}, Amount: {data.amount}")
 
@@ -138,88 +195,86 @@ async def transfer_money(
         from decimal import Decimal
         amount_decimal = Decimal(str(data.amount))
 
-        # Get user with pin_hashed
-        user_result = await db.execute(select(User).where(User.id == current_user.id))
-        user = user_result.scalar_one_or_none()
-
-        if not user:
-            raise HTTPException(404, "User not found")
-
-        # Verify PIN
         # ✅ FIX: Change from 401 to 400 for PIN errors
-        if not verify_pin(data.pin, user.pin_hashed):
+        if not await _verify_pin(db, current_user.id, data.pin):
             raise HTTPException(400, "Invalid PIN")  # Changed from 401 to 400
 
-        # Sender wallet
-        sender_wallet = (
-            await db.execute(select(Wallet).where(Wallet.user_id == current_user.id))
-        ).scalar_one_or_none()
-
-        if not sender_wallet:
-            raise HTTPException(404, "Sender wallet not found")
-
-        # Receiver user
-        receiver_user = (
-            await db.execute(select(User).where(User.email == data.to_email))
-        ).scalar_one_or_none()
-
-        if not receiver_user:
-            raise HTTPException(404, "Receiver not found")
-
-        receiver_wallet = (
-            await db.execute(select(Wallet).where(Wallet.user_id == receiver_user.id))
-        ).scalar_one_or_none()
-
-        if not receiver_wallet:
-            raise HTTPException(404, "Receiver wallet not found")
-
-        # Not enough balance (using Decimal for comparison)
-        if sender_wallet.balance < amount_decimal:
-            tx = Transaction(
-                wallet_id=sender_wallet.id,
-                amount=amount_decimal,
-                type=TransactionType.TRANSFER,
-                status=TransactionStatus.FAILED,
-                counterparty=receiver_user.email
-            )
-            db.add(tx)
-            await db.commit()
-            raise HTTPException(400, "Insufficient balance")
-
-        # Transfer (using Decimal)
-        sender_wallet.balance -= amount_decimal
-        receiver_wallet.balance += amount_decimal
-
-        tx_sender = Transaction(
-            wallet_id=sender_wallet.id,
-            amount=amount_decimal,
-            type=TransactionType.TRANSFER,
-            status=TransactionStatus.SUCCESS,
-            counterparty=receiver_user.email
-        )
-
-        tx_receiver = Transaction(
-            wallet_id=receiver_wallet.id,
-            amount=amount_decimal,
-            type=TransactionType.RECEIVE,
-            status=TransactionStatus.SUCCESS,
-            counterparty=current_user.email
+        # Both wallets are locked in id order and updated in one round-trip
+        sender_wallet = await wallet_service.transfer(
+            db, current_user, data.to_email, amount_decimal, before_commit=before_commit
         )
 
-        db.add(tx_sender)
-        db.add(tx_receiver)
-        await db.commit()
-        await db.refresh(sender_wallet)
-
-        print(f"✅ Transfer successful. New balance: {sender_wallet.balance}")
+        print(f"✅ Transfer successful. New balance: {sender_wallet['balance']}")
         return sender_wallet
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Transfer error: {e}")
         raise HTTPException(500, f"Transfer failed: {str(e)}")
+@router.post("/transfer/batch", response_model=BatchTransferResponse)
+async def transfer_money_batch(
+    data: BatchTransferRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Pay many receivers (payroll, cashback) in one request and one DB transaction.
+
+    The PIN is verified once for the whole batch. Each item is reported
+    separately, so one bad receiver does not fail the others.
+    """
+    try:
+        print(f"🔄 Batch transfer request: {current_user.email} -> {len(data.items)} receivers")
+
+        if not await _verify_pin(db, current_user.id, data.pin):
+            raise HTTPException(400, "Invalid PIN")
+
+        from decimal import Decimal
+        items = [(item.to_email, Decimal(str(item.amount))) for item in data.items]
+
+        report = await wallet_service.batch_transfer(db, current_user, items)
+
+        print(f"✅ Batch transfer done: {report['succeeded']} succeeded, {report['failed']} failed")
+        return report
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Batch transfer error: {e}")
+        raise HTTPException(500, f"Batch transfer failed: {str(e)}")
 # =====================================================
 # TRANSACTION HISTORY
 # =====================================================
+def filtered_history_query(
+    wallet_id,
+    status: Optional[TransactionStatus] = None,
+    type: Optional[TransactionType] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+):
+    """Build the transaction query shared by every history endpoint"""
+    # Base query
+    query = select(Transaction).where(Transaction.wallet_id == wallet_id)
+
+    # Apply filters
+    if status:
+        query = query.where(Transaction.status == status)
+    if type:
+        query = query.where(Transaction.type == type)
+
+    # Handle date filters
+    if start_date:
+        start_datetime = datetime.combine(start_date, datetime.min.time())
+        query = query.where(Transaction.created_at >= start_datetime)
+
+    if end_date:
+        end_datetime = datetime.combine(end_date, datetime.max.time())
+        query = query.where(Transaction.created_at <= end_datetime)
+
+    return query
+
+
 @router.get("/history", response_model=PaginatedTransactions)
 async def get_transaction_history(
     page: int = Query(1, ge=1),
@@ -239,23 +294,7 @@ async def get_transaction_history(
     if not wallet:
         raise HTTPException(status_code=404, detail="Wallet not found")
 
-    # Base query
-    query = select(Transaction).where(Transaction.wallet_id == wallet.id)
-
-    # Apply filters
-    if status:
-        query = query.where(Transaction.status == status)
-    if type:
-        query = query.where(Transaction.type == type)
-
-    # Handle date filters
-    if start_date:
-        start_datetime = datetime.combine(start_date, datetime.min.time())
-        query = query.where(Transaction.created_at >= start_datetime)
-
-    if end_date:
-        end_datetime = datetime.combine(end_date, datetime.max.time())
-        query = query.where(Transaction.created_at <= end_datetime)
+    query = filtered_history_query(wallet.id, status, type, start_date, end_date)
 
     # Count filtered records
     count_query = select(func.count()).select_from(query.subquery())
@@ -298,4 +337,157 @@ async def get_transaction_history(
         next_page=next_page,
         prev_page=prev_page,
         data=data,
-    )
\ No newline at end of file
+    )
+
+@router.get("/history/cursor", response_model=CursorTransactions)
+async def get_transaction_history_cursor(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(10, ge=1, le=100),
+    status: Optional[TransactionStatus] = Query(None),
+    type: Optional[TransactionType] = Query(None),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    include_total: bool = Query(False),
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Keyset-paginated transaction history, newest first.
+
+    Pages are keyed on (created_at, id) instead of OFFSET, so page 500 costs
+    the same as page 1. The total count is only computed when requested.
+    """
+    wallet = (
+        await db.execute(select(Wallet).where(Wallet.user_id == current_user.id))
+    ).scalar_one_or_none()
+
+    if not wallet:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+
+    query = filtered_history_query(wallet.id, status, type, start_date, end_date)
+
+    total_items = None
+    if include_total:
+        count_query = select(func.count()).select_from(query.subquery())
+        total_items = (await db.execute(count_query)).scalar_one()
+
+    if cursor:
+        try:
+            values = decode_cursor(cursor)
+            after_created_at = datetime.fromisoformat(values["created_at"])
+            after_id = UUID(values["id"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        query = query.where(
+            tuple_(Transaction.created_at, Transaction.id) < (after_created_at, after_id)
+        )
+
+    # Fetch one extra row to know whether another page exists
+    tx_result = await db.execute(
+        query.order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(limit + 1)
+    )
+    transactions = tx_result.scalars().all()
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        last = transactions[-1]
+        next_cursor = encode_cursor(
+            {"created_at": last.created_at.isoformat(), "id": str(last.id)}
+        )
+
+    return CursorTransactions(
+        limit=limit,
+        next_cursor=next_cursor,
+        total=total_items,
+        data=[TransactionRead.model_validate(tx) for tx in transactions],
+    )
+
+
+EXPORT_FIELDS = [
+    "id", "wallet_id", "amount", "type", "status",
+    "counterparty", "provider_tx_id", "created_at",
+]
+
+
+def _export_row(tx: Transaction) -> dict:
+    return {
+        "id": str(tx.id),
+        "wallet_id": str(tx.wallet_id),
+        "amount": str(tx.amount),
+        "type": tx.type.value if tx.type else None,
+        "status": tx.status.value if tx.status else None,
+        "counterparty": tx.counterparty,
+        "provider_tx_id": tx.provider_tx_id,
+        "created_at": tx.created_at.isoformat() if tx.created_at else None,
+    }
+
+
+async def _stream_transactions(query, format: str, chunk_rows: int = 1000):
+    """
+    Yield the export in chunks of `chunk_rows` rows from one server-side
+    cursor. Memory stays flat no matter how long the history is.
+
+    Uses its own session: request-scoped dependencies are closed before a
+    StreamingResponse body is sent.
+    """
+    async with async_session_maker() as session:
+        result = await session.stream_scalars(
+            query.execution_options(yield_per=chunk_rows)
+        )
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        if format == "csv":
+            writer.writeheader()
+
+        async for partition in result.partitions(chunk_rows):
+            for tx in partition:
+                row = _export_row(tx)
+                if format == "csv":
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(row))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            # Rows are already serialised; don't keep them in the identity map
+            session.expunge_all()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+@router.get("/history/export")
+async def export_transaction_history(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    status: Optional[TransactionStatus] = Query(None),
+    type: Optional[TransactionType] = Query(None),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Stream the full (filtered) transaction history as CSV or NDJSON, oldest first.
+    """
+    wallet = (
+        await db.execute(select(Wallet).where(Wallet.user_id == current_user.id))
+    ).scalar_one_or_none()
+
+    if not wallet:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+
+    query = filtered_history_query(wallet.id, status, type, start_date, end_date)
+    query = query.order_by(Transaction.created_at.asc(), Transaction.id.asc())
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"transactions-{wallet.id}.{format}"
+    return StreamingResponse(
+        _stream_transactions(query, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
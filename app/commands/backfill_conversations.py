@@ -0,0 +1,93 @@
+# app/commands/backfill_conversations.py
+"""
+Rebuild the conversations table from chat_messages.
+
+Run once after migrating to 8c2f47b1d6e0 (new messages keep the table up
+to date from then on); safe to re-run at any time to repair drift:
+
+    python -m app.commands.backfill_conversations --batch-size 500
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from app.db.database import async_session_maker, engine
+
+# Users are processed in keyset batches by id; a batch rebuilds every pair
+# whose smaller user id (user_a_id) falls in it.
+NEXT_USER_BATCH = text(
+    "SELECT id FROM users WHERE id > :after ORDER BY id LIMIT :batch_size"
+)
+
+REBUILD_BATCH = text("""
+INSERT INTO conversations
+    (user_a_id, user_b_id, last_message_id, last_activity, user_a_unread, user_b_unread)
+SELECT DISTINCT ON (a, b)
+    a, b, id, timestamp,
+    count(*) FILTER (WHERE receiver_id = a AND is_read IS NOT TRUE AND id > a_last_read_id) OVER pair,
+    count(*) FILTER (WHERE receiver_id = b AND is_read IS NOT TRUE AND id > b_last_read_id) OVER pair
+FROM (
+    -- Unread means above the side's read watermark, which a rebuild keeps
+    SELECT least(cm.sender_id, cm.receiver_id) AS a,
+           greatest(cm.sender_id, cm.receiver_id) AS b,
+           cm.id, cm.timestamp, cm.receiver_id, cm.is_read,
+           coalesce(c.user_a_last_read_id, 0) AS a_last_read_id,
+           coalesce(c.user_b_last_read_id, 0) AS b_last_read_id
+    FROM chat_messages cm
+    LEFT JOIN conversations c
+      ON c.user_a_id = least(cm.sender_id, cm.receiver_id)
+     AND c.user_b_id = greatest(cm.sender_id, cm.receiver_id)
+    WHERE cm.sender_id = ANY(:user_ids) OR cm.receiver_id = ANY(:user_ids)
+) m
+WHERE a = ANY(:user_ids)
+WINDOW pair AS (PARTITION BY a, b)
+ORDER BY a, b, timestamp DESC, id DESC
+ON CONFLICT (user_a_id, user_b_id) DO UPDATE SET
+    last_message_id = EXCLUDED.last_message_id,
+    last_activity = EXCLUDED.last_activity,
+    user_a_unread = EXCLUDED.user_a_unread,
+    user_b_unread = EXCLUDED.user_b_unread
+""")
+
+
+async def backfill(batch_size: int) -> int:
+    """Returns the number of conversations written"""
+    total = 0
+    after = "00000000-0000-0000-0000-000000000000"
+    while True:
+        async with async_session_maker() as db:
+            user_ids = (
+                await db.execute(NEXT_USER_BATCH, {"after": after, "batch_size": batch_size})
+            ).scalars().all()
+            if not user_ids:
+                return total
+
+            # create_message and the mark-read functions change conversations
+            # in the same transaction as chat_messages. Holding this lock
+            # (reads still go through) while the batch is rebuilt makes every
+            # concurrent change either visible to the rebuild or applied on
+            # top of it once the lock is released.
+            await db.execute(text("LOCK TABLE conversations IN EXCLUSIVE MODE"))
+            result = await db.execute(REBUILD_BATCH, {"user_ids": list(user_ids)})
+            await db.commit()
+
+        total += result.rowcount
+        after = str(user_ids[-1])
+        print(f"💬 {total} conversations rebuilt (through user {after})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total = await backfill(args.batch_size)
+    print(f"✅ Backfilled {total} conversations in {time.perf_counter() - started:.1f}s")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
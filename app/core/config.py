@@ -10,6 +10,66 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
 
+    # bcrypt thread pool (0 = min(4, CPU count)) and max queued + running jobs
+    BCRYPT_WORKERS: int = 0
+    BCRYPT_QUEUE_LIMIT: int = 64
+
+    # Authenticated-user snapshot cache used by get_current_user
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_SIZE: int = 10000
+
+    # Chat identifier (id / email / full name) -> user cache; "no such user"
+    # answers are kept for a shorter time
+    USER_IDENTIFIER_CACHE_TTL_SECONDS: int = 300
+    USER_IDENTIFIER_NEGATIVE_TTL_SECONDS: int = 5
+
+    # Idempotency-Key support for money-moving routes
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_WAIT_SECONDS: float = 30.0
+
+    # How often ledger entries are folded into balance snapshots
+    LEDGER_CHECKPOINT_INTERVAL_SECONDS: int = 300
+
+    # Unread messages replayed on WebSocket connect: max per request, per frame
+    CHAT_BACKLOG_LIMIT: int = 500
+    CHAT_BACKLOG_FRAME_SIZE: int = 100
+
+    # Pub/sub for WebSocket fan-out across workers, e.g. redis://localhost:6379/0
+    # (empty = in-process, only correct with a single worker)
+    CHAT_BROKER_URL: str = ""
+
+    # Per-connection outbound queue: max frames, what to do when it is full
+    # (drop_oldest | disconnect | coalesce), and how long one send may stall
+    CHAT_OUTBOUND_QUEUE_SIZE: int = 256
+    CHAT_OUTBOUND_OVERFLOW: str = "coalesce"
+    CHAT_SEND_TIMEOUT_SECONDS: float = 10.0
+
+    # Group commit of WebSocket chat messages: how long to gather a batch,
+    # and the most messages per INSERT
+    CHAT_WRITE_WINDOW_MS: float = 5.0
+    CHAT_WRITE_BATCH_SIZE: int = 200
+
+    # Most message sends a v2 client may batch into one WebSocket frame
+    CHAT_WS_MAX_BATCH: int = 100
+
+    # Presence subscriptions: how long changes are gathered before they are
+    # published, how long a dropped user may take to come back before
+    # subscribers see "offline", how long one typing signal lasts, and the
+    # most users one connection may watch
+    PRESENCE_FLUSH_MS: float = 250.0
+    PRESENCE_OFFLINE_GRACE_SECONDS: float = 5.0
+    PRESENCE_TYPING_TTL_SECONDS: float = 6.0
+    PRESENCE_MAX_SUBSCRIPTIONS: int = 500
+
+    # WebSocket heartbeat: ping a connection after this long without a frame
+    # from it, and close it if the ping goes unanswered this long
+    CHAT_HEARTBEAT_INTERVAL_SECONDS: float = 25.0
+    CHAT_HEARTBEAT_TIMEOUT_SECONDS: float = 20.0
+    # v1 clients that never answered a ping (they may not understand it) are
+    # closed after this long without any frame instead
+    CHAT_HEARTBEAT_LEGACY_IDLE_SECONDS: float = 300.0
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
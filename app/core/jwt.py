@@ -9,6 +9,7 @@ from sqlalchemy import select
 
 from app.db.session import get_db
 from app.models.user import User
+from app.services.user_cache import user_cache
 
 SECRET_KEY = "secret123"
 REFRESH_SECRET_KEY = "refreshsecret456"  # Use a different secret
@@ -41,7 +42,7 @@ def verify_refresh_token(token: str):
         return None
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
+def _user_id_from_credentials(credentials: HTTPAuthorizationCredentials) -> str:
     token = credentials.credentials  # Extract "<token>" part
 
     try:
@@ -52,6 +53,36 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
 
+    return user_id
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
+    """
+    Return a read-only snapshot of the authenticated user.
+
+    Served from the per-process user cache when possible, so most requests
+    skip the users lookup entirely. Routes that modify the user should
+    depend on get_current_user_db instead.
+    """
+    user_id = _user_id_from_credentials(credentials)
+
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    result = await db.execute(select(User).where(User.id == user_id))
+    user = result.scalar_one_or_none()
+
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    return user_cache.set(user)
+
+
+async def get_current_user_db(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
+    """Load the authenticated user as an ORM object attached to `db` (uncached)"""
+    user_id = _user_id_from_credentials(credentials)
+
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
 
@@ -1,7 +1,13 @@
 # app/core/security.py
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
 from passlib.context import CryptContext
 import bcrypt
 
+from app.core.config import settings
+
 # Password context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -38,4 +44,60 @@ def verify_pin(plain_pin: str, hashed_pin: str) -> bool:
         hashed_bytes = hashed_pin.encode('utf-8')
         return bcrypt.checkpw(pin_bytes, hashed_bytes)
     except Exception:
-        return False
\ No newline at end of file
+        return False
+
+
+# -----------------------------------------------------
+# Async variants
+# -----------------------------------------------------
+# bcrypt costs ~200 ms of CPU per call. Run it on a bounded thread pool
+# (bcrypt releases the GIL) so the event loop keeps serving other requests
+# and websockets meanwhile.
+
+class HashingQueueFull(HTTPException):
+    """Too many bcrypt jobs are already waiting; the client should retry"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+
+_hash_executor = None
+_hash_jobs = 0
+
+
+def _get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor
+    if _hash_executor is None:
+        workers = settings.BCRYPT_WORKERS or min(4, os.cpu_count() or 1)
+        _hash_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+    return _hash_executor
+
+
+async def _run_hashing(func, *args):
+    global _hash_jobs
+    if _hash_jobs >= settings.BCRYPT_QUEUE_LIMIT:
+        raise HashingQueueFull()
+
+    _hash_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), func, *args)
+    finally:
+        _hash_jobs -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hashing(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+async def hash_pin_async(pin: str) -> str:
+    return await _run_hashing(hash_pin, pin)
+
+async def verify_pin_async(plain_pin: str, hashed_pin: str) -> bool:
+    return await _run_hashing(verify_pin, plain_pin, hashed_pin)
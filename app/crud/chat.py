@@ -1,12 +1,15 @@
 # app/crud/chat.py - FIXED WITH PROPER ALIASES
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_, func
+from sqlalchemy import select, insert, update, or_, and_, func, tuple_, case, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import aliased
 from app.models.chat import ChatMessage
+from app.models.conversation import Conversation, ordered_pair
+from app.models.chat_inbox import ChatInbox
 from app.models.user import User
-from datetime import datetime
+from datetime import datetime, timezone
 from uuid import UUID
-from typing import List, Optional
+from typing import List, Optional, Tuple
 # app/crud/chat.py
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.chat import ChatMessage
@@ -17,69 +20,403 @@ async def create_message(
     sender_id: int, 
     receiver_id: int, 
     content: str, 
-    message_type: str = "text"
+    message_type: str = "text",
+    client_msg_id: Optional[str] = None
 ) -> ChatMessage:
-    """Create a new chat message"""
+    """Create a new chat message (or return the stored one for a retried client_msg_id)"""
     print(f"💾 Creating message: {sender_id} -> {receiver_id}: {content}")
     
     try:
-        message = ChatMessage(
-            sender_id=sender_id,
-            receiver_id=receiver_id,
-            content=content,
-            message_type=message_type,
-            timestamp=datetime.utcnow(),
-            is_read=False
-        )
-        
-        db.add(message)
-        await db.commit()
-        await db.refresh(message)
+        [(message, _)] = await create_messages(db, [{
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "content": content,
+            "message_type": message_type,
+            "client_msg_id": client_msg_id,
+        }])
         
         print(f"✅ Message created successfully: {message.id}")
         return message
         
     except Exception as e:
         print(f"❌ Error creating message: {e}")
-        await db.rollback()
         raise e
+
+def _as_uuid(value) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+async def _stored_by_client_msg_id(db: AsyncSession, params: List[dict]) -> dict:
+    """Already stored messages for the (sender_id, client_msg_id) keys in params"""
+    keys = {
+        (p["sender_id"], p["client_msg_id"]) for p in params if p["client_msg_id"] is not None
+    }
+    if not keys:
+        return {}
+    result = await db.execute(
+        select(ChatMessage).where(
+            tuple_(ChatMessage.sender_id, ChatMessage.client_msg_id).in_(list(keys))
+        )
+    )
+    return {(m.sender_id, m.client_msg_id): m for m in result.scalars()}
+
+async def _assign_recipient_seqs(db: AsyncSession, params: List[dict]) -> None:
+    """
+    Give each new message the next sequence number of its receiver. The
+    inbox rows stay locked until commit, in a fixed order, so each
+    receiver's messages commit in sequence order.
+    """
+    counts = {}
+    for p in params:
+        counts[p["receiver_id"]] = counts.get(p["receiver_id"], 0) + 1
+    if not counts:
+        return
+
+    stmt = pg_insert(ChatInbox).values(
+        [{"user_id": user_id, "last_seq": count} for user_id, count in sorted(counts.items())]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ChatInbox.user_id],
+        set_={
+            "last_seq": ChatInbox.last_seq + stmt.excluded.last_seq,
+            "updated_at": func.now(),
+        },
+    ).returning(ChatInbox.user_id, ChatInbox.last_seq)
+
+    next_seq = {
+        row.user_id: row.last_seq - counts[row.user_id] + 1
+        for row in await db.execute(stmt)
+    }
+    for p in params:
+        p["recipient_seq"] = next_seq[p["receiver_id"]]
+        next_seq[p["receiver_id"]] += 1
+
+async def create_messages(db: AsyncSession, messages: List[dict]) -> List[Tuple[ChatMessage, bool]]:
+    """
+    Group commit: insert many messages with one multi-row
+    INSERT ... RETURNING id, timestamp, number them in their receivers'
+    streams, update their conversations and commit once.
+
+    `messages` are dicts of sender_id, receiver_id, content and optionally
+    message_type, timestamp and client_msg_id. Returns (message, duplicate)
+    in the same order, detached from the session: a send whose
+    (sender_id, client_msg_id) is already stored, or repeated in the same
+    batch, is not written again and returns the stored message.
+    """
+    # Aware, like the rows server_default=now() writes (timestamptz)
+    now = datetime.now(timezone.utc)
+    params = [
+        {
+            "sender_id": _as_uuid(message["sender_id"]),
+            "receiver_id": _as_uuid(message["receiver_id"]),
+            "content": message["content"],
+            "message_type": message.get("message_type", "text"),
+            "timestamp": message.get("timestamp") or now,
+            "is_read": False,
+            "client_msg_id": message.get("client_msg_id"),
+        }
+        for message in messages
+    ]
+    try:
+        stored = await _stored_by_client_msg_id(db, params)
+        results: List[Optional[Tuple[ChatMessage, bool]]] = [None] * len(params)
+        fresh = []
+        first_in_batch = {}
+        for index, p in enumerate(params):
+            key = (p["sender_id"], p["client_msg_id"]) if p["client_msg_id"] is not None else None
+            if key in stored:
+                results[index] = (stored[key], True)
+            elif key in first_in_batch:
+                continue  # filled in from the first copy below
+            else:
+                if key is not None:
+                    first_in_batch[key] = index
+                fresh.append(index)
+
+        created = []
+        if fresh:
+            rows = [params[index] for index in fresh]
+            await _assign_recipient_seqs(db, rows)
+            result = await db.execute(
+                insert(ChatMessage).returning(
+                    ChatMessage.id, ChatMessage.timestamp, sort_by_parameter_order=True
+                ),
+                rows,
+            )
+            for index, row, values in zip(fresh, result.all(), rows):
+                message = ChatMessage(id=row.id, **{**values, "timestamp": row.timestamp})
+                results[index] = (message, False)
+                created.append(message)
+            await _touch_conversations(db, created)
+        await db.commit()
+
+        for index, p in enumerate(params):
+            if results[index] is None:
+                key = (p["sender_id"], p["client_msg_id"])
+                results[index] = (results[first_in_batch[key]][0], True)
+        return results
+    except Exception:
+        await db.rollback()
+        raise
+
+def _pair_filter(user1_id: UUID, user2_id: UUID):
+    """Messages between two users, matching ix_chat_messages_pair_id"""
+    user_a_id, user_b_id = ordered_pair(user1_id, user2_id)
+    return and_(
+        func.least(ChatMessage.sender_id, ChatMessage.receiver_id) == user_a_id,
+        func.greatest(ChatMessage.sender_id, ChatMessage.receiver_id) == user_b_id
+    )
+
+async def _history_slice(
+    db: AsyncSession,
+    pair_filter,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None
+) -> List[ChatMessage]:
+    """
+    Up to `limit` messages of a conversation next to a cursor, oldest first.
+
+    Walks the (pair, id) index from the cursor, so the cost depends on
+    `limit` only, not on how deep into the history the cursor is.
+    """
+    query = select(ChatMessage).where(pair_filter)
+    if after_id is not None:
+        query = query.where(ChatMessage.id > after_id).order_by(ChatMessage.id.asc())
+    else:
+        if before_id is not None:
+            query = query.where(ChatMessage.id < before_id)
+        query = query.order_by(ChatMessage.id.desc())
+
+    result = await db.execute(query.limit(limit))
+    messages = list(result.scalars().all())
+    if after_id is None:
+        messages.reverse()
+    return messages
+
 async def get_chat_history(
     db: AsyncSession,
     user1_id: UUID,
     user2_id: UUID,
     limit: int = 100,
-    offset: int = 0
-) -> List[ChatMessage]:
-    query = select(ChatMessage).where(
-        or_(
-            and_(ChatMessage.sender_id == user1_id, ChatMessage.receiver_id == user2_id),
-            and_(ChatMessage.sender_id == user2_id, ChatMessage.receiver_id == user1_id)
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    around_id: Optional[int] = None
+) -> Tuple[List[ChatMessage], Optional[bool], Optional[bool]]:
+    """
+    One window of the conversation between two users, oldest first.
+
+    By default the newest `limit` messages; `before_id` / `after_id` page
+    older / newer from a message id, `around_id` centres the window on a
+    message (included). Pass at most one cursor.
+
+    Returns (messages, has_more_before, has_more_after); a flag is None
+    when the window was not fetched in that direction.
+    """
+    pair_filter = _pair_filter(user1_id, user2_id)
+
+    if around_id is not None:
+        older_limit = limit // 2
+        newer_limit = limit - older_limit
+        older = await _history_slice(db, pair_filter, older_limit + 1, before_id=around_id)
+        newer = await _history_slice(db, pair_filter, newer_limit + 1, after_id=around_id - 1)
+        has_more_before = len(older) > older_limit
+        has_more_after = len(newer) > newer_limit
+        # Each slice fetched one extra row, at its far end, to detect more
+        if has_more_before:
+            older = older[1:]
+        return older + newer[:newer_limit], has_more_before, has_more_after
+
+    if after_id is not None:
+        messages = await _history_slice(db, pair_filter, limit + 1, after_id=after_id)
+        return messages[:limit], None, len(messages) > limit
+
+    messages = await _history_slice(db, pair_filter, limit + 1, before_id=before_id)
+    has_more_before = len(messages) > limit
+    if has_more_before:
+        messages = messages[1:]
+    return messages, has_more_before, None
+
+async def _touch_conversations(db: AsyncSession, messages: List[ChatMessage]) -> None:
+    """
+    Upsert the conversations rows for new messages in the caller's
+    transaction: move last message / activity forward and bump the
+    receivers' unread counters. One statement for any number of messages;
+    messages of the same pair are folded into one row first, since an
+    upsert cannot touch the same row twice.
+    """
+    rows = {}
+    for message in messages:
+        user_a_id, user_b_id = ordered_pair(message.sender_id, message.receiver_id)
+        row = rows.get((user_a_id, user_b_id))
+        if row is None:
+            row = rows[(user_a_id, user_b_id)] = {
+                "user_a_id": user_a_id,
+                "user_b_id": user_b_id,
+                "last_message_id": message.id,
+                "last_activity": message.timestamp,
+                "user_a_unread": 0,
+                "user_b_unread": 0,
+            }
+        elif (message.timestamp, message.id) >= (row["last_activity"], row["last_message_id"]):
+            row["last_message_id"] = message.id
+            row["last_activity"] = message.timestamp
+        row["user_a_unread" if message.receiver_id == user_a_id else "user_b_unread"] += 1
+
+    if not rows:
+        return
+    # Fixed order so concurrent batches lock conversation rows in the same order
+    stmt = pg_insert(Conversation).values([rows[key] for key in sorted(rows)])
+    is_newer = stmt.excluded.last_activity >= Conversation.last_activity
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Conversation.user_a_id, Conversation.user_b_id],
+            set_={
+                "last_message_id": case(
+                    (is_newer, stmt.excluded.last_message_id),
+                    else_=Conversation.last_message_id,
+                ),
+                "last_activity": func.greatest(Conversation.last_activity, stmt.excluded.last_activity),
+                "user_a_unread": Conversation.user_a_unread + stmt.excluded.user_a_unread,
+                "user_b_unread": Conversation.user_b_unread + stmt.excluded.user_b_unread,
+            },
         )
-    ).order_by(ChatMessage.timestamp.asc()).limit(limit).offset(offset)
-    
-    result = await db.execute(query)
-    return result.scalars().all()
+    )
+
+def _conversation_key(user1_id: UUID, user2_id: UUID):
+    user_a_id, user_b_id = ordered_pair(user1_id, user2_id)
+    return and_(Conversation.user_a_id == user_a_id, Conversation.user_b_id == user_b_id)
+
+def _conversation_of_message():
+    """Join condition from a chat_messages row to its conversations row"""
+    return and_(
+        Conversation.user_a_id == func.least(ChatMessage.sender_id, ChatMessage.receiver_id),
+        Conversation.user_b_id == func.greatest(ChatMessage.sender_id, ChatMessage.receiver_id)
+    )
+
+def receiver_has_read():
+    """
+    SQL expression: has the receiver read this message. Read state is the
+    receiver's watermark on the conversation; is_read still covers messages
+    marked before watermarks existed. Needs an outer join on
+    _conversation_of_message().
+    """
+    receiver_last_read_id = case(
+        (ChatMessage.receiver_id == Conversation.user_a_id, Conversation.user_a_last_read_id),
+        else_=Conversation.user_b_last_read_id,
+    )
+    return or_(
+        ChatMessage.is_read == True,
+        ChatMessage.id <= func.coalesce(receiver_last_read_id, 0)
+    )
+
+async def get_last_read_ids(db: AsyncSession, user1_id: UUID, user2_id: UUID) -> dict:
+    """Read watermark of each side of a conversation: {user_id: last_read_id}"""
+    conversation = (
+        await db.execute(select(Conversation).where(_conversation_key(user1_id, user2_id)))
+    ).scalar_one_or_none()
+    if conversation is None:
+        return {}
+    return {
+        conversation.user_b_id: conversation.user_b_last_read_id,
+        # user_a last so a conversation with yourself reports side a
+        conversation.user_a_id: conversation.user_a_last_read_id,
+    }
+
+def message_is_read(message: ChatMessage, last_read_ids: dict) -> bool:
+    """Python twin of receiver_has_read() for rows of a single conversation"""
+    return bool(message.is_read) or message.id <= last_read_ids.get(message.receiver_id, 0)
+
+async def advance_read_watermark(
+    db: AsyncSession,
+    reader_id: UUID,
+    partner_id: UUID,
+    up_to_id: Optional[int] = None
+) -> Optional[dict]:
+    """
+    Mark everything partner_id sent to reader_id up to message `up_to_id`
+    (default: the latest message) as read by moving the reader's watermark.
+    The watermark never moves backwards.
+
+    One row update whatever the number of unread messages; the reader's
+    unread counter is recounted from the messages above the new watermark,
+    normally none. Returns {"last_read_id", "unread_count"}, or None if the
+    two users have no conversation.
+    """
+    user_a_id, _ = ordered_pair(reader_id, partner_id)
+    # Lock first: a message created concurrently is then either visible to
+    # the recount below or bumps the counter after this transaction commits
+    conversation = (
+        await db.execute(
+            select(Conversation)
+            .where(_conversation_key(reader_id, partner_id))
+            .with_for_update()
+        )
+    ).scalar_one_or_none()
+    if conversation is None:
+        await db.rollback()
+        return None
+
+    if reader_id == user_a_id:
+        last_read_column, unread_column = Conversation.user_a_last_read_id, Conversation.user_a_unread
+    else:
+        last_read_column, unread_column = Conversation.user_b_last_read_id, Conversation.user_b_unread
+
+    target = conversation.last_message_id
+    if up_to_id is not None:
+        target = min(up_to_id, target)
+    new_last_read_id = func.greatest(last_read_column, target)
+
+    still_unread = (
+        select(func.count())
+        .where(
+            _pair_filter(reader_id, partner_id),
+            ChatMessage.id > new_last_read_id,
+            ChatMessage.receiver_id == reader_id,
+            ChatMessage.is_read.isnot(True)
+        )
+        .scalar_subquery()
+    )
+    row = (
+        await db.execute(
+            update(Conversation)
+            .where(_conversation_key(reader_id, partner_id))
+            .values({last_read_column: new_last_read_id, unread_column: still_unread})
+            .returning(last_read_column, unread_column)
+        )
+    ).one()
+    await db.commit()
+    return {"last_read_id": row[0], "unread_count": row[1]}
 
 async def mark_messages_as_read(
     db: AsyncSession,
     sender_id: UUID,
     receiver_id: UUID
 ) -> None:
-    query = select(ChatMessage).where(
-        and_(
-            ChatMessage.sender_id == sender_id,
-            ChatMessage.receiver_id == receiver_id,
-            ChatMessage.is_read == False
+    """Mark everything sender_id sent to receiver_id as read"""
+    await advance_read_watermark(db, receiver_id, sender_id)
+
+async def mark_message_as_read(
+    db: AsyncSession,
+    message_id: int,
+    reader_id: UUID
+) -> Optional[ChatMessage]:
+    """
+    Mark a received message, and everything before it in the conversation,
+    as read. Returns None if reader_id did not receive the message.
+    """
+    message = (
+        await db.execute(
+            select(ChatMessage).where(
+                ChatMessage.id == message_id,
+                ChatMessage.receiver_id == reader_id
+            )
         )
-    )
-    
-    result = await db.execute(query)
-    messages = result.scalars().all()
-    
-    for message in messages:
-        message.is_read = True
-    
-    await db.commit()
+    ).scalar_one_or_none()
+    if message is None:
+        return None
+
+    await advance_read_watermark(db, reader_id, message.sender_id, up_to_id=message.id)
+    return message
 
 async def get_conversation_users(db: AsyncSession, user_id: UUID) -> List[User]:
     """
@@ -161,26 +498,313 @@ async def get_last_message(db: AsyncSession, user1_id: UUID, user2_id: UUID) ->
     result = await db.execute(query)
     return result.scalar_one_or_none()
 
-async def get_all_user_messages_with_users(db: AsyncSession, user_id: UUID):
+def _before_cursor(before: Optional[Tuple[datetime, int]]):
+    """Keyset condition for newest-first pages keyed on (timestamp, id)"""
+    if before is None:
+        return None
+    return tuple_(ChatMessage.timestamp, ChatMessage.id) < before
+
+async def get_all_user_messages_with_users(
+    db: AsyncSession,
+    user_id: UUID,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+):
     """
     Get all messages with user details using proper aliases
+
+    Returns (ChatMessage, Sender, Receiver, is_read) rows newest first in a
+    single query. Pass `limit` / `before` (timestamp, id) to page through them.
     """
     # Create aliases for the User table
     Sender = aliased(User)
     Receiver = aliased(User)
     
     query = (
-        select(ChatMessage, Sender, Receiver)
+        select(ChatMessage, Sender, Receiver, receiver_has_read().label("is_read"))
         .join(Sender, ChatMessage.sender_id == Sender.id)
         .join(Receiver, ChatMessage.receiver_id == Receiver.id)
+        .outerjoin(Conversation, _conversation_of_message())
         .where(
             or_(
                 ChatMessage.sender_id == user_id,
                 ChatMessage.receiver_id == user_id
             )
         )
-        .order_by(ChatMessage.timestamp.desc())
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
     )
+
+    if before is not None:
+        query = query.where(_before_cursor(before))
+    if limit is not None:
+        query = query.limit(limit)
     
     result = await db.execute(query)
-    return result.all()
\ No newline at end of file
+    return result.all()
+
+async def get_received_messages_with_senders(
+    db: AsyncSession,
+    user_id: UUID,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    Get messages received by user together with their sender, newest first,
+    in a single query. Returns (ChatMessage, Sender, is_read) rows.
+    """
+    Sender = aliased(User)
+
+    query = (
+        select(ChatMessage, Sender, receiver_has_read().label("is_read"))
+        .join(Sender, ChatMessage.sender_id == Sender.id)
+        .outerjoin(Conversation, _conversation_of_message())
+        .where(ChatMessage.receiver_id == user_id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    )
+
+    if before is not None:
+        query = query.where(_before_cursor(before))
+    if limit is not None:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return result.all()
+
+async def get_pending_messages_with_senders(
+    db: AsyncSession,
+    user_id: UUID,
+    limit: int,
+    after_id: Optional[int] = None
+):
+    """
+    Messages user received and has not read yet, with their sender, oldest
+    first, in a single query. Returns (ChatMessage, Sender) rows; pass the
+    last id seen as `after_id` to continue.
+    """
+    Sender = aliased(User)
+
+    query = (
+        select(ChatMessage, Sender)
+        .join(Sender, ChatMessage.sender_id == Sender.id)
+        .outerjoin(Conversation, _conversation_of_message())
+        .where(
+            ChatMessage.receiver_id == user_id,
+            # Matches ix_chat_messages_receiver_unread; the watermark does the rest
+            ChatMessage.is_read == False,
+            ~receiver_has_read()
+        )
+        .order_by(ChatMessage.id.asc())
+        .limit(limit)
+    )
+    if after_id is not None:
+        query = query.where(ChatMessage.id > after_id)
+
+    result = await db.execute(query)
+    return result.all()
+
+async def get_messages_since_seq(
+    db: AsyncSession,
+    user_id: UUID,
+    since_seq: int,
+    limit: int
+):
+    """
+    Messages user received with recipient_seq above since_seq, read or
+    not, with their sender, in sequence order (ix_chat_messages_receiver_seq).
+    Returns (ChatMessage, Sender, is_read) rows.
+    """
+    Sender = aliased(User)
+    result = await db.execute(
+        select(ChatMessage, Sender, receiver_has_read().label("is_read"))
+        .join(Sender, ChatMessage.sender_id == Sender.id)
+        .outerjoin(Conversation, _conversation_of_message())
+        .where(
+            ChatMessage.receiver_id == user_id,
+            ChatMessage.recipient_seq > since_seq
+        )
+        .order_by(ChatMessage.recipient_seq.asc())
+        .limit(limit)
+    )
+    return result.all()
+
+async def get_inbox_position(db: AsyncSession, user_id: UUID) -> dict:
+    """{"last_seq", "acked_seq"} of user's inbox; zeros before the first message"""
+    inbox = await db.get(ChatInbox, user_id)
+    if inbox is None:
+        return {"last_seq": 0, "acked_seq": 0}
+    return {"last_seq": inbox.last_seq, "acked_seq": inbox.acked_seq}
+
+async def ack_delivered(db: AsyncSession, user_id: UUID, seq: int) -> Optional[int]:
+    """
+    Record that a client of user has received everything up to seq.
+    Acks are cumulative and never move backwards or past last_seq.
+    Returns the stored acked_seq, or None if user has no inbox yet.
+    """
+    result = await db.execute(
+        update(ChatInbox)
+        .where(ChatInbox.user_id == user_id)
+        .values(
+            acked_seq=func.greatest(ChatInbox.acked_seq, func.least(seq, ChatInbox.last_seq)),
+            updated_at=func.now()
+        )
+        .returning(ChatInbox.acked_seq)
+    )
+    acked_seq = result.scalar_one_or_none()
+    await db.commit()
+    return acked_seq
+
+async def get_conversation_summaries_from_messages(
+    db: AsyncSession,
+    user_id: UUID,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    Every conversation of user with its last message and unread count, most
+    recent activity first, in a single query over chat_messages.
+
+    Reads the raw history, so cost grows with the user's message count;
+    /chat/conversations uses the conversations table instead
+    (get_conversation_summaries). Kept for verifying that table.
+
+    Messages are grouped by partner (the other side of the pair); DISTINCT ON
+    keeps the newest message per partner and a window count over the same
+    partition gives the unread total. Returns (ChatMessage, Partner,
+    unread_count) rows; page with `limit` / `before` (timestamp, id) of the
+    last message on the previous page.
+    """
+    partner_id = case(
+        (ChatMessage.sender_id == user_id, ChatMessage.receiver_id),
+        else_=ChatMessage.sender_id,
+    ).label("partner_id")
+    unread_count = func.count().filter(
+        and_(ChatMessage.receiver_id == user_id, ~receiver_has_read())
+    ).over(partition_by=partner_id).label("unread_count")
+
+    latest = (
+        select(ChatMessage, partner_id, unread_count)
+        .outerjoin(Conversation, _conversation_of_message())
+        .where(
+            or_(
+                ChatMessage.sender_id == user_id,
+                ChatMessage.receiver_id == user_id
+            )
+        )
+        .distinct(partner_id)
+        .order_by(partner_id, ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .subquery()
+    )
+    last_message = aliased(ChatMessage, latest)
+    Partner = aliased(User)
+
+    query = (
+        select(last_message, Partner, latest.c.unread_count)
+        .join(Partner, Partner.id == latest.c.partner_id)
+        .order_by(latest.c.timestamp.desc(), latest.c.id.desc())
+    )
+
+    if before is not None:
+        query = query.where(tuple_(latest.c.timestamp, latest.c.id) < before)
+    if limit is not None:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return result.all()
+
+async def get_conversation_summaries(
+    db: AsyncSession,
+    user_id: UUID,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    Conversations of user from the conversations table, most recent
+    activity first. Returns (ChatMessage, Partner, unread_count) rows like
+    get_conversation_summaries_from_messages.
+
+    The user can be on either side of a row, so each side is read from its
+    own (user, last_activity) index, limited, and the two merged; a page
+    costs O(limit) index reads however long the history is. `before` is
+    the (timestamp, id) of the last message on the previous page.
+    """
+    def side(me_column, partner_column, unread_column):
+        query = (
+            select(
+                Conversation.last_message_id,
+                Conversation.last_activity,
+                partner_column.label("partner_id"),
+                unread_column.label("unread_count"),
+            )
+            .where(me_column == user_id)
+            .order_by(Conversation.last_activity.desc(), Conversation.last_message_id.desc())
+        )
+        if before is not None:
+            query = query.where(
+                tuple_(Conversation.last_activity, Conversation.last_message_id) < before
+            )
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    page = union_all(
+        side(Conversation.user_a_id, Conversation.user_b_id, Conversation.user_a_unread),
+        # A conversation with yourself is only listed once
+        side(Conversation.user_b_id, Conversation.user_a_id, Conversation.user_b_unread)
+        .where(Conversation.user_a_id != user_id),
+    ).subquery()
+    Partner = aliased(User)
+
+    query = (
+        select(ChatMessage, Partner, page.c.unread_count)
+        .join(ChatMessage, ChatMessage.id == page.c.last_message_id)
+        .join(Partner, Partner.id == page.c.partner_id)
+        .order_by(page.c.last_activity.desc(), page.c.last_message_id.desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return result.all()
+
+async def get_conversation_partner_ids(
+    db: AsyncSession, user_id: UUID, limit: Optional[int] = None
+) -> List[UUID]:
+    """
+    Ids of the users user has a conversation with, most recent activity
+    first (the presence subscription of a chat client). Same per-side index
+    reads as get_conversation_summaries, without loading messages or users.
+    """
+    def side(me_column, partner_column):
+        query = (
+            select(partner_column.label("partner_id"), Conversation.last_activity)
+            .where(me_column == user_id)
+            .order_by(Conversation.last_activity.desc())
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    page = union_all(
+        side(Conversation.user_a_id, Conversation.user_b_id),
+        side(Conversation.user_b_id, Conversation.user_a_id)
+        .where(Conversation.user_a_id != user_id),
+    ).subquery()
+
+    query = select(page.c.partner_id).order_by(page.c.last_activity.desc())
+    if limit is not None:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+async def get_total_unread(db: AsyncSession, user_id: UUID) -> int:
+    """Unread messages across all conversations (the chat badge)"""
+    a_side = select(func.coalesce(func.sum(Conversation.user_a_unread), 0)).where(
+        Conversation.user_a_id == user_id
+    ).scalar_subquery()
+    b_side = select(func.coalesce(func.sum(Conversation.user_b_unread), 0)).where(
+        Conversation.user_b_id == user_id,
+        Conversation.user_a_id != user_id
+    ).scalar_subquery()
+    result = await db.execute(select(a_side + b_side))
+    return int(result.scalar_one())
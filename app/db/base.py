@@ -5,4 +5,8 @@ from app.db.base_class import Base
 from app.models.user import User
 from app.models.wallet import Wallet
 from app.models.transaction import Transaction
+from app.models.idempotency import IdempotencyKey
+from app.models.ledger import LedgerEntry, WalletBalanceSnapshot, LedgerCheckpoint
+from app.models.conversation import Conversation
+from app.models.chat_inbox import ChatInbox
 #from app.models.chat import ChatMessage  # Add this line
\ No newline at end of file
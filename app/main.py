@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,6 +9,11 @@ from app.api.v1.wallet.routes import router as wallet_router
 from app.api.v1.profile.routes import router as profile_router
 from app.api.v1.user.routes import router as user_router
 from app.api.v1.chat.routes import router as chat_router
+from app.services.idempotency import idempotency
+from app.services import ledger
+from app.services.chat_manager import manager
+from app.services.message_writer import message_writer
+from app.services.user_cache import user_cache
 
 app = FastAPI(title="Payment Wallet API")
 
@@ -23,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Idempotent-Replayed", "X-Next-Cursor", "X-Has-More-Before", "X-Has-More-After"],
 )
 
 # Include API routers
@@ -32,6 +40,38 @@ app.include_router(profile_router, prefix="/api/v1")
 app.include_router(user_router, prefix="/api/v1")
 app.include_router(chat_router, prefix="/api/v1")
 
+# Background jobs that live as long as the process
+background_tasks = []
+
+USER_CACHE_INVALIDATIONS = "user-cache:invalidate"
+_publish_tasks = set()
+
+async def _on_user_cache_invalidation(channel: str, user_id: str):
+    user_cache.invalidate(user_id, propagate=False)
+
+def _publish_user_cache_invalidation(user_id: str):
+    task = asyncio.create_task(manager.broker.publish(USER_CACHE_INVALIDATIONS, user_id))
+    _publish_tasks.add(task)
+    task.add_done_callback(_publish_tasks.discard)
+
+@app.on_event("startup")
+async def start_background_jobs():
+    background_tasks.append(asyncio.create_task(idempotency.purge_expired_forever()))
+    background_tasks.append(asyncio.create_task(ledger.checkpoint_forever()))
+    await message_writer.start()
+
+    # WebSocket fan-out, and user cache invalidations for the other workers
+    await manager.start()
+    await manager.broker.subscribe(USER_CACHE_INVALIDATIONS, _on_user_cache_invalidation)
+    user_cache.add_invalidation_listener(_publish_user_cache_invalidation)
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for task in background_tasks:
+        task.cancel()
+    await message_writer.stop()
+    await manager.stop()
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
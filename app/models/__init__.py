@@ -4,6 +4,10 @@ from app.models.base import Base
 import app.models.user
 import app.models.wallet
 import app.models.transaction
+import app.models.idempotency
+import app.models.ledger
+import app.models.conversation
+import app.models.chat_inbox
 
 
 # Expose metadata for Alembic
@@ -1,5 +1,5 @@
 # app/models/chat.py
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from sqlalchemy.orm import relationship
@@ -16,7 +16,45 @@ class ChatMessage(Base):
     message_type = Column(String(20), default="text")  # text, image, file
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     is_read = Column(Boolean, default=False)
+
+    # Position in the receiver's stream (chat_inboxes.last_seq); NULL for
+    # messages written before sequence numbers existed
+    recipient_seq = Column(Integer, nullable=True)
+    # Sender-chosen id of the send, so a retried send is stored once
+    client_msg_id = Column(String(64), nullable=True)
     
     # Relationships
     sender = relationship("User", foreign_keys=[sender_id], backref="sent_messages")
-    receiver = relationship("User", foreign_keys=[receiver_id], backref="received_messages")
\ No newline at end of file
+    receiver = relationship("User", foreign_keys=[receiver_id], backref="received_messages")
+
+    __table_args__ = (
+        Index("ix_chat_messages_sender_receiver_timestamp", sender_id, receiver_id, timestamp),
+        Index("ix_chat_messages_receiver_sender_timestamp", receiver_id, sender_id, timestamp),
+        # History windows: both directions of a pair, walked by id
+        Index(
+            "ix_chat_messages_pair_id",
+            func.least(sender_id, receiver_id),
+            func.greatest(sender_id, receiver_id),
+            id,
+        ),
+        Index(
+            "ix_chat_messages_receiver_unread",
+            receiver_id,
+            postgresql_where=(is_read == False),
+        ),
+        # Resume from a sequence number: WHERE receiver_id = ? AND recipient_seq > ?
+        Index(
+            "ix_chat_messages_receiver_seq",
+            receiver_id,
+            recipient_seq,
+            unique=True,
+            postgresql_where=(recipient_seq != None),
+        ),
+        Index(
+            "ix_chat_messages_sender_client_msg_id",
+            sender_id,
+            client_msg_id,
+            unique=True,
+            postgresql_where=(client_msg_id != None),
+        ),
+    )
\ No newline at end of file
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+
+class ChatInbox(Base):
+    """
+    Per-recipient delivery sequence, maintained by create_messages in
+    app/crud/chat.py.
+
+    Every message a user receives gets the next `last_seq` as its
+    chat_messages.recipient_seq. The row is locked while a message is
+    written, so one recipient's messages commit in sequence order and a
+    client resuming from a sequence number cannot skip a late commit.
+    `acked_seq` is the highest sequence any of the user's clients has
+    acknowledged.
+    """
+    __tablename__ = "chat_inboxes"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    acked_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -0,0 +1,48 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, CheckConstraint, Index
+from sqlalchemy.dialects.postgresql import UUID
+from app.db.base_class import Base
+
+
+def ordered_pair(user1_id, user2_id):
+    """(user_a_id, user_b_id) key of the conversation between two users"""
+    return (user1_id, user2_id) if user1_id <= user2_id else (user2_id, user1_id)
+
+
+class Conversation(Base):
+    """
+    One row per pair of users who have exchanged messages, maintained by
+    create_message and the mark-read functions in app/crud/chat.py.
+
+    The pair is stored in a fixed order (user_a_id <= user_b_id, see
+    `ordered_pair`) so both directions share a row; each side has its own
+    read watermark and unread counter.
+    """
+    __tablename__ = "conversations"
+
+    user_a_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    user_b_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+
+    # chat_messages.id; no FK because chat_messages predates the migrations
+    last_message_id = Column(Integer, nullable=False)
+    last_activity = Column(DateTime(timezone=True), nullable=False)
+
+    # Read watermark per side: everything up to this chat_messages.id is read
+    user_a_last_read_id = Column(Integer, nullable=False, default=0, server_default="0")
+    user_b_last_read_id = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Messages the given side has not read yet (received above the watermark)
+    user_a_unread = Column(Integer, nullable=False, default=0, server_default="0")
+    user_b_unread = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        CheckConstraint("user_a_id <= user_b_id", name="ck_conversations_ordered_pair"),
+        # Conversation list pages for either side, most recent first
+        Index(
+            "ix_conversations_user_a_activity",
+            user_a_id, last_activity.desc(), last_message_id.desc(),
+        ),
+        Index(
+            "ix_conversations_user_b_activity",
+            user_b_id, last_activity.desc(), last_message_id.desc(),
+        ),
+    )
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, func
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from app.db.base_class import Base
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Keys are scoped per user, so two users may pick the same key
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+
+    # "POST /wallet/transfer" etc. and a hash of the request body
+    scope = Column(String(100), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+
+    # NULL while the original request is still running
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(JSONB, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,49 @@
+from sqlalchemy import Column, BigInteger, Integer, Numeric, ForeignKey, DateTime, Identity, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import UUID
+from uuid import uuid4, UUID as PyUUID
+from app.db.base_class import Base
+
+# Counterparty for money entering or leaving the system (add-money top-ups).
+# It is not a row in `wallets`; its ledger balance is minus all money in the system.
+EXTERNAL_WALLET_ID = PyUUID(int=0)
+
+
+class LedgerEntry(Base):
+    """
+    One append-only double-entry line: `amount` leaves `debit_wallet_id`
+    and arrives in `credit_wallet_id`. Rows are never updated or deleted.
+    """
+    __tablename__ = "ledger_entries"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    # Monotonic order used by checkpoints to know what has been folded
+    seq = Column(BigInteger, Identity(), nullable=False)
+    transaction_id = Column(UUID(as_uuid=True), ForeignKey("transactions.id"), nullable=True)
+    debit_wallet_id = Column(UUID(as_uuid=True), nullable=False)
+    credit_wallet_id = Column(UUID(as_uuid=True), nullable=False)
+    amount = Column(Numeric(12, 2), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("seq", name="uq_ledger_entries_seq"),
+    )
+
+
+class WalletBalanceSnapshot(Base):
+    """Ledger balance of a wallet folded up to the latest checkpoint"""
+    __tablename__ = "wallet_balance_snapshots"
+
+    wallet_id = Column(UUID(as_uuid=True), primary_key=True)
+    balance = Column(Numeric(14, 2), nullable=False, default=0)
+    last_entry_seq = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class LedgerCheckpoint(Base):
+    __tablename__ = "ledger_checkpoints"
+
+    id = Column(Integer, primary_key=True)
+    # Every entry with seq <= last_entry_seq is folded into the snapshots
+    last_entry_seq = Column(BigInteger, nullable=False)
+    entries_folded = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
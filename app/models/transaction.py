@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Enum as SqlEnum, Numeric, ForeignKey, DateTime, func
+from sqlalchemy import Column, String, Enum as SqlEnum, Numeric, ForeignKey, DateTime, Index, func
 from sqlalchemy.dialects.postgresql import UUID
 from uuid import uuid4
 from enum import Enum
@@ -34,3 +34,10 @@ class Transaction(Base):
 
     # relation
     wallet = relationship("Wallet", back_populates="transactions")
+
+    __table_args__ = (
+        Index(
+            "ix_transactions_wallet_id_created_at",
+            wallet_id, created_at.desc(), id.desc(),
+        ),
+    )
@@ -10,9 +10,9 @@ class User(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String, unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
-    full_name = Column(String, nullable=True)
+    full_name = Column(String, nullable=True, index=True)
     is_active = Column(Boolean, default=True)
     pin_hashed = Column(String, nullable=False)
     # FIX — must match Wallet.back_populates
     wallet = relationship("Wallet", back_populates="user", uselist=False)
-    mobile_number = Column(String(15), nullable=True)
\ No newline at end of file
+    mobile_number = Column(String(15), nullable=True, index=True)
\ No newline at end of file
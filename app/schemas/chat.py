@@ -25,6 +25,10 @@ class MessageCreate(BaseModel):
             raise ValueError('Invalid message type')
         return v
 
+class MarkReadRequest(BaseModel):
+    # Read everything up to this message id; omit to read the whole conversation
+    up_to_id: Optional[int] = None
+
 class MessageResponse(BaseModel):
     id: int
     sender_id: uuid.UUID
@@ -13,3 +13,10 @@ class PaginatedTransactions(BaseModel):
 
     model_config = {"from_attributes": True}
 
+class CursorTransactions(BaseModel):
+    limit: int
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    data: List[TransactionRead]
+
+    model_config = {"from_attributes": True}
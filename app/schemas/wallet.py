@@ -1,7 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from uuid import UUID
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List
 
 class AddMoneyRequest(BaseModel):
     amount: float
@@ -37,4 +37,26 @@ class PaginatedTransactions(BaseModel):
     total_pages: int
     next_page: Optional[int] = None
     prev_page: Optional[int] = None
-    data: list[TransactionRead]
\ No newline at end of file
+    data: list[TransactionRead]
+
+class BatchTransferItem(BaseModel):
+    to_email: EmailStr
+    amount: float
+
+class BatchTransferRequest(BaseModel):
+    items: List[BatchTransferItem] = Field(..., min_length=1, max_length=5000)
+    pin: str
+
+class BatchTransferItemResult(BaseModel):
+    index: int
+    to_email: EmailStr
+    amount: float
+    status: str
+    detail: Optional[str] = None
+
+class BatchTransferResponse(BaseModel):
+    wallet: WalletRead
+    succeeded: int
+    failed: int
+    total_transferred: float
+    results: List[BatchTransferItemResult]
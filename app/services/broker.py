@@ -0,0 +1,263 @@
+# app/services/broker.py
+import asyncio
+import time
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Set
+
+from app.core.config import settings
+
+# handler(channel, message)
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class Broker:
+    """
+    Pub/sub + presence shared by every worker that serves WebSockets.
+
+    Workers subscribe to a channel only while they hold a connection that
+    cares about it, and count their local connections per user so any
+    worker can answer "is this user online".
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str, handler: Handler) -> None:
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str) -> int:
+        """Returns how many subscribers (workers) received the message"""
+        raise NotImplementedError
+
+    async def presence_add(self, user_id: str) -> None:
+        raise NotImplementedError
+
+    async def presence_remove(self, user_id: str) -> None:
+        raise NotImplementedError
+
+    async def is_online(self, user_id: str) -> bool:
+        raise NotImplementedError
+
+    async def online_users(self) -> List[str]:
+        raise NotImplementedError
+
+    async def online_among(self, user_ids: Iterable[str]) -> Set[str]:
+        """Which of user_ids are online, in one round trip where possible"""
+        return {user_id for user_id in user_ids if await self.is_online(user_id)}
+
+
+class InProcessBroker(Broker):
+    """Single-process backend: handlers are called directly"""
+
+    def __init__(self):
+        self._handlers: Dict[str, Set[Handler]] = defaultdict(set)
+        self._presence: Dict[str, int] = {}
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel].add(handler)
+
+    async def unsubscribe(self, channel: str, handler: Handler) -> None:
+        handlers = self._handlers.get(channel)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self._handlers[channel]
+
+    async def publish(self, channel: str, message: str) -> int:
+        handlers = list(self._handlers.get(channel, ()))
+        for handler in handlers:
+            try:
+                await handler(channel, message)
+            except Exception as e:
+                print(f"❌ Broker handler for {channel} failed: {e}")
+        return len(handlers)
+
+    async def presence_add(self, user_id: str) -> None:
+        self._presence[user_id] = self._presence.get(user_id, 0) + 1
+
+    async def presence_remove(self, user_id: str) -> None:
+        remaining = self._presence.get(user_id, 0) - 1
+        if remaining > 0:
+            self._presence[user_id] = remaining
+        else:
+            self._presence.pop(user_id, None)
+
+    async def is_online(self, user_id: str) -> bool:
+        return user_id in self._presence
+
+    async def online_users(self) -> List[str]:
+        return list(self._presence)
+
+    async def online_among(self, user_ids: Iterable[str]) -> Set[str]:
+        return {user_id for user_id in user_ids if user_id in self._presence}
+
+
+class RedisBroker(Broker):
+    """
+    Redis (or any server speaking the Redis protocol) backend.
+
+    One pub/sub connection per worker carries all of its subscriptions.
+    Presence is a hash per worker (user_id -> local connection count) with
+    a TTL kept alive by a heartbeat, plus a sorted set of live workers, so
+    a worker that dies without cleaning up drops out after PRESENCE_TTL.
+    """
+
+    PRESENCE_TTL = 30
+    HEARTBEAT_INTERVAL = 10
+    POLL_TIMEOUT = 1.0
+    WORKERS_KEY = "chat:workers"
+    # Decrement and drop the field in one step so a concurrent connect of
+    # the same user cannot be erased
+    PRESENCE_REMOVE_SCRIPT = """
+        local remaining = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+        if remaining <= 0 then redis.call('HDEL', KEYS[1], ARGV[1]) end
+        return remaining
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.worker_id = uuid.uuid4().hex
+        self.presence_key = f"chat:presence:{self.worker_id}"
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._pubsub = self._redis.pubsub()
+        self._presence_remove = self._redis.register_script(self.PRESENCE_REMOVE_SCRIPT)
+        self._handlers: Dict[str, Set[Handler]] = defaultdict(set)
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self) -> None:
+        # get_message needs a connection even before the first subscription
+        await self._pubsub.connect()
+        self._tasks.append(asyncio.create_task(self._listen_forever()))
+        self._tasks.append(asyncio.create_task(self._heartbeat_forever()))
+
+    async def stop(self) -> None:
+        # A cancel can be swallowed inside redis-py's timed read, so the
+        # listener also checks the flag between polls
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.wait(self._tasks, timeout=self.POLL_TIMEOUT * 2)
+        try:
+            await self._redis.zrem(self.WORKERS_KEY, self.worker_id)
+            await self._redis.delete(self.presence_key)
+        finally:
+            await self._pubsub.aclose()
+            await self._redis.aclose()
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        first = not self._handlers[channel]
+        self._handlers[channel].add(handler)
+        if first:
+            await self._pubsub.subscribe(**{channel: self._dispatch})
+
+    async def unsubscribe(self, channel: str, handler: Handler) -> None:
+        handlers = self._handlers.get(channel)
+        if handlers is None:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self._handlers[channel]
+            await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self._redis.publish(channel, message)
+
+    async def _dispatch(self, message: dict) -> None:
+        channel = message["channel"]
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                await handler(channel, message["data"])
+            except Exception as e:
+                print(f"❌ Broker handler for {channel} failed: {e}")
+
+    async def _listen_forever(self) -> None:
+        """Read pub/sub messages; get_message calls _dispatch for each"""
+        while not self._stopping:
+            try:
+                await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=self.POLL_TIMEOUT
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Redis pub/sub error: {e}")
+                await asyncio.sleep(self.POLL_TIMEOUT)
+
+    async def presence_add(self, user_id: str) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(self.presence_key, user_id, 1)
+            pipe.expire(self.presence_key, self.PRESENCE_TTL)
+            await pipe.execute()
+
+    async def presence_remove(self, user_id: str) -> None:
+        await self._presence_remove(keys=[self.presence_key], args=[user_id])
+
+    async def _live_presence_keys(self) -> List[str]:
+        workers = await self._redis.zrangebyscore(
+            self.WORKERS_KEY, time.time() - self.PRESENCE_TTL, "+inf"
+        )
+        return [f"chat:presence:{worker_id}" for worker_id in workers]
+
+    async def is_online(self, user_id: str) -> bool:
+        keys = await self._live_presence_keys()
+        if not keys:
+            return False
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hexists(key, user_id)
+            return any(await pipe.execute())
+
+    async def online_users(self) -> List[str]:
+        keys = await self._live_presence_keys()
+        if not keys:
+            return []
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hkeys(key)
+            return sorted(set().union(*await pipe.execute()))
+
+    async def online_among(self, user_ids: Iterable[str]) -> Set[str]:
+        user_ids = list(user_ids)
+        keys = await self._live_presence_keys()
+        if not keys or not user_ids:
+            return set()
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hmget(key, user_ids)
+            counts = await pipe.execute()
+        return {
+            user_id
+            for per_worker in counts
+            for user_id, count in zip(user_ids, per_worker)
+            if count is not None
+        }
+
+    async def _heartbeat_forever(self) -> None:
+        while True:
+            try:
+                now = time.time()
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.zadd(self.WORKERS_KEY, {self.worker_id: now})
+                    pipe.expire(self.presence_key, self.PRESENCE_TTL)
+                    pipe.zremrangebyscore(self.WORKERS_KEY, "-inf", now - self.PRESENCE_TTL)
+                    await pipe.execute()
+            except Exception as e:
+                print(f"❌ Presence heartbeat failed: {e}")
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+
+
+def create_broker(url: str = "") -> Broker:
+    """In-process broker unless CHAT_BROKER_URL points at a Redis server"""
+    url = url or settings.CHAT_BROKER_URL
+    if not url:
+        return InProcessBroker()
+    return RedisBroker(url)
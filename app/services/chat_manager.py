@@ -1,41 +1,405 @@
 # app/services/chat_manager.py - UPDATED
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Dict, List, Optional
+from collections import deque
 import json
 import asyncio
+import time
+import uuid
+
+from app.core.config import settings
+from app.services.broker import Broker, create_broker
+from app.services.heartbeat import Heartbeat
+from app.services.presence import PresenceService
+from app.services.ws_protocol import JSON_V1, Frame, WireProtocol
+
+# What a connection does when its outbound queue is full
+DROP_OLDEST = "drop_oldest"      # discard the oldest queued frame
+DISCONNECT = "disconnect"        # close the slow consumer (it replays its backlog on reconnect)
+COALESCE = "coalesce"            # keyed frames replace queued ones with the same key;
+                                 # when full, drop the oldest keyed frame, else disconnect
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT, COALESCE)
+
+# Close code for consumers that cannot keep up (RFC 6455 "try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code when a send fails outright (RFC 6455 "internal error")
+SEND_FAILED_CLOSE_CODE = 1011
+
+# Broker payloads for frames with a coalesce key: "\0<key>\0<frame>".
+# JSON frames never start with a NUL byte.
+_ENVELOPE_MARK = "\0"
+
+
+def _wrap(message: str, coalesce_key: Optional[str]) -> str:
+    if coalesce_key is None:
+        return message
+    return f"{_ENVELOPE_MARK}{coalesce_key}{_ENVELOPE_MARK}{message}"
+
+
+def _unwrap(payload: str):
+    if not payload.startswith(_ENVELOPE_MARK):
+        return payload, None
+    coalesce_key, message = payload[1:].split(_ENVELOPE_MARK, 1)
+    return message, coalesce_key
+
+
+class OutboundMetrics:
+    """Counters and time-in-queue samples shared by a manager's connections"""
+
+    SAMPLES = 2048
+
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_consumer_disconnects = 0
+        self.send_failures = 0
+        self._waits = deque(maxlen=self.SAMPLES)
+        self.max_wait = 0.0
+
+    def observe_wait(self, seconds: float):
+        self._waits.append(seconds)
+        if seconds > self.max_wait:
+            self.max_wait = seconds
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(len(waits) * p))] * 1000
+
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_consumer_disconnects": self.slow_consumer_disconnects,
+            "send_failures": self.send_failures,
+            "time_in_queue_ms": {
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": self.max_wait * 1000,
+            },
+        }
+
+
+class Connection:
+    """
+    One WebSocket (one device of a user) plus its bounded outbound queue.
+
+    Everything written to the socket goes through `enqueue`, which never
+    blocks; a writer task drains the queue. A slow or stalled client
+    therefore only ever delays its own frames, never the sender's receive
+    loop or the broker listener.
+
+    Idle connections are kept small: the queue and the writer task exist
+    only while frames are pending, and settings are read from the manager.
+    """
+
+    __slots__ = (
+        "connection_id", "websocket", "user_id", "manager", "protocol", "closed",
+        "last_seen", "answers_pings", "_queue", "_keyed", "_writer",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        manager: "ConnectionManager",
+        protocol: WireProtocol = JSON_V1,
+    ):
+        self.connection_id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.user_id = user_id
+        self.manager = manager
+        self.protocol = protocol
+        self.closed = False
+        # monotonic time of the last frame from the client (see Heartbeat)
+        self.last_seen = time.monotonic()
+        self.answers_pings = False
+        # Items are [frame, enqueued_at, coalesce_key]; lists so coalescing
+        # can swap the frame in place
+        self._queue: Optional[deque] = None
+        self._keyed: Optional[Dict[str, list]] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    def touch(self):
+        """Record a frame from the client"""
+        self.last_seen = time.monotonic()
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue) if self._queue else 0
+
+    def send_frame(self, frame: dict, coalesce_key: Optional[str] = None) -> bool:
+        """Encode a frame with this socket's protocol and queue it"""
+        return self.enqueue(self.protocol.encode(frame), coalesce_key)
+
+    def enqueue(self, message: Frame, coalesce_key: Optional[str] = None) -> bool:
+        """Queue an encoded frame for this socket. Returns False if it was not queued."""
+        if self.closed:
+            return False
+        manager = self.manager
+
+        if coalesce_key is not None and self._keyed and manager.overflow == COALESCE:
+            pending = self._keyed.get(coalesce_key)
+            if pending is not None:
+                # Newer state supersedes the queued one; keep its position
+                pending[0] = message
+                manager.metrics.coalesced += 1
+                return True
+
+        if self._queue is None:
+            self._queue = deque()
+        elif len(self._queue) >= manager.max_queue and not self._make_room():
+            return False
+
+        item = [message, time.monotonic(), coalesce_key]
+        self._queue.append(item)
+        if coalesce_key is not None:
+            if self._keyed is None:
+                self._keyed = {}
+            self._keyed[coalesce_key] = item
+        manager.metrics.enqueued += 1
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+        return True
+
+    def _make_room(self) -> bool:
+        metrics = self.manager.metrics
+        if self.manager.overflow == DROP_OLDEST:
+            self._forget(self._queue.popleft())
+            metrics.dropped += 1
+            return True
+
+        if self.manager.overflow == COALESCE:
+            # Keyed frames carry state that a later frame will restate
+            for item in self._queue:
+                if item[2] is not None:
+                    self._queue.remove(item)
+                    self._forget(item)
+                    metrics.dropped += 1
+                    return True
+
+        metrics.slow_consumer_disconnects += 1
+        print(f"🐢 Disconnecting slow consumer {self.user_id} ({len(self._queue)} frames queued)")
+        self.close(SLOW_CONSUMER_CLOSE_CODE)
+        return False
+
+    def _forget(self, item: list):
+        if item[2] is not None and self._keyed.get(item[2]) is item:
+            del self._keyed[item[2]]
+
+    async def _drain(self):
+        queue = self._queue
+        metrics = self.manager.metrics
+        try:
+            while queue:
+                item = queue.popleft()
+                self._forget(item)
+                metrics.observe_wait(time.monotonic() - item[1])
+                async with asyncio.timeout(self.manager.send_timeout):
+                    if isinstance(item[0], bytes):
+                        await self.websocket.send_bytes(item[0])
+                    else:
+                        await self.websocket.send_text(item[0])
+                metrics.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.send_failures += 1
+            print(f"❌ Error sending to user {self.user_id}: {e!r}")
+            # Tear the socket down too, so the client notices and reconnects
+            # instead of sitting on a connection nothing is written to
+            self.close(
+                SLOW_CONSUMER_CLOSE_CODE if isinstance(e, TimeoutError) else SEND_FAILED_CLOSE_CODE
+            )
+            return
+        # Drained: drop the queue and task until the next frame
+        self._writer = None
+        self._queue = None
+        self._keyed = None
+
+    def close(self, code: Optional[int] = None):
+        """Stop writing and release the connection. Safe to call repeatedly."""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue = None
+        self._keyed = None
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        asyncio.create_task(self._finish_close(code))
+
+    async def _finish_close(self, code: Optional[int]):
+        if code is not None:
+            try:
+                await asyncio.wait_for(self.websocket.close(code=code), self.manager.send_timeout)
+            except Exception:
+                pass
+        await self.manager.disconnect(self)
+
+
 # app/services/chat_manager.py
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    """
+    WebSocket connections of this worker plus fan-out through a Broker.
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        user_id_str = str(user_id)
-        await websocket.accept()
-        self.active_connections[user_id_str] = websocket
-        print(f"✅ User {user_id_str} connected. Total: {len(self.active_connections)}")
+    A user may be connected from several devices; each socket is its own
+    Connection with a connection id. Messages for a user are published on
+    the user's channel; the worker holding any of that user's sockets is
+    subscribed to it and queues the frame on every device, encoded once per
+    wire protocol in use. With the in-process broker this degrades to a
+    local dict lookup.
+
+    Users coming and going are reported to `presence`, which sends
+    subscribed connections the changes (see app/services/presence.py);
+    `heartbeat` pings idle connections and releases the ones that went
+    silent (app/services/heartbeat.py).
+    """
+
+    def __init__(
+        self,
+        broker: Optional[Broker] = None,
+        max_queue: Optional[int] = None,
+        overflow: Optional[str] = None,
+        send_timeout: Optional[float] = None,
+    ):
+        self.broker = broker or create_broker()
+        # user_id -> connection_id -> Connection
+        self.active_connections: Dict[str, Dict[str, Connection]] = {}
+        self.metrics = OutboundMetrics()
+        self.max_queue = max_queue or settings.CHAT_OUTBOUND_QUEUE_SIZE
+        self.overflow = overflow or settings.CHAT_OUTBOUND_OVERFLOW
+        self.send_timeout = send_timeout or settings.CHAT_SEND_TIMEOUT_SECONDS
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.overflow}")
+        self.presence = PresenceService(self.broker)
+        self.heartbeat = Heartbeat()
 
-    def disconnect(self, user_id: str):
+    async def start(self):
+        await self.broker.start()
+        await self.presence.start()
+        await self.heartbeat.start()
+
+    async def stop(self):
+        await self.heartbeat.stop()
+        await self.presence.stop()
+        await self.broker.stop()
+
+    @staticmethod
+    def user_channel(user_id: str) -> str:
+        return f"chat:user:{user_id}"
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(devices) for devices in self.active_connections.values())
+
+    def connections_of(self, user_id: str) -> List[Connection]:
+        return list(self.active_connections.get(str(user_id), {}).values())
+
+    async def connect(
+        self, websocket: WebSocket, user_id: str, protocol: WireProtocol = JSON_V1
+    ) -> Connection:
         user_id_str = str(user_id)
-        if user_id_str in self.active_connections:
+        await websocket.accept(subprotocol=protocol.name)
+        connection = Connection(websocket, user_id_str, self, protocol)
+
+        devices = self.active_connections.get(user_id_str)
+        first_device = devices is None
+        if first_device:
+            devices = self.active_connections[user_id_str] = {}
+            await self.broker.subscribe(self.user_channel(user_id_str), self._deliver)
+        devices[connection.connection_id] = connection
+        await self.broker.presence_add(user_id_str)
+        if first_device:
+            self.presence.user_connected(user_id_str)
+        self.heartbeat.watch(connection)
+        print(f"✅ User {user_id_str} connected ({connection.connection_id}, "
+              f"{len(devices)} device(s)). Total: {len(self.active_connections)}")
+        return connection
+
+    async def disconnect(self, connection: Connection):
+        """Release one device's connection; a no-op if it was already released"""
+        connection.close()
+        self.presence.unsubscribe(connection)
+        user_id_str = connection.user_id
+        devices = self.active_connections.get(user_id_str)
+        if devices is None or devices.pop(connection.connection_id, None) is None:
+            return
+        if not devices:
             del self.active_connections[user_id_str]
-            print(f"🔴 User {user_id_str} disconnected. Total: {len(self.active_connections)}")
+            await self.broker.unsubscribe(self.user_channel(user_id_str), self._deliver)
+        await self.broker.presence_remove(user_id_str)
+        if not devices:
+            self.presence.user_disconnected(user_id_str)
+        print(f"🔴 User {user_id_str} disconnected ({connection.connection_id}, "
+              f"{len(devices)} device(s) left). Total: {len(self.active_connections)}")
+
+    async def send_personal_message(
+        self, message: str, user_id: str, coalesce_key: Optional[str] = None
+    ) -> bool:
+        """
+        Publish a frame for all of a user's devices, wherever they are
+        connected. Returns whether any worker holds a connection for them.
 
-    async def send_personal_message(self, message: str, user_id: str) -> bool:
+        `message` is the JSON (v1) frame, serialized once by the caller;
+        devices on other wire protocols get it re-encoded once per protocol
+        per worker. Frames with a `coalesce_key` (state such
+        as read receipts) may be replaced by a newer frame with the same
+        key while still queued.
+        """
         user_id_str = str(user_id)
-        
-        if user_id_str in self.active_connections:
-            websocket = self.active_connections[user_id_str]
-            try:
-                await websocket.send_text(message)
-                return True
-            except Exception as e:
-                print(f"❌ Error sending to user {user_id_str}: {e}")
-                self.disconnect(user_id_str)
-                return False
-        return False
+        try:
+            return await self.broker.publish(
+                self.user_channel(user_id_str), _wrap(message, coalesce_key)
+            ) > 0
+        except Exception as e:
+            print(f"❌ Error publishing to user {user_id_str}: {e}")
+            return False
+
+    async def _deliver(self, channel: str, payload: str):
+        """Broker handler: queue a published frame on every local device"""
+        devices = self.active_connections.get(channel.rsplit(":", 1)[1])
+        if devices:
+            message, coalesce_key = _unwrap(payload)
+            encoded = {JSON_V1: message}
+            frame = None
+            for connection in list(devices.values()):
+                data = encoded.get(connection.protocol)
+                if data is None:
+                    if frame is None:
+                        frame = json.loads(message)
+                    data = encoded[connection.protocol] = connection.protocol.encode(frame)
+                connection.enqueue(data, coalesce_key)
+
+    async def is_user_online(self, user_id: str) -> bool:
+        return await self.broker.is_online(str(user_id))
+
+    async def get_online_users(self) -> List[str]:
+        return await self.broker.online_users()
+
+    def get_metrics(self) -> dict:
+        depths = [
+            connection.depth
+            for devices in self.active_connections.values()
+            for connection in devices.values()
+        ]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(depths),
+            "queue_depth": {
+                "total": sum(depths),
+                "max": max(depths, default=0),
+            },
+            "overflow_policy": self.overflow,
+            **self.metrics.snapshot(),
+            "presence": self.presence.stats(),
+            "heartbeat": self.heartbeat.stats(),
+        }
 
-    def is_user_online(self, user_id: str) -> bool:
-        return str(user_id) in self.active_connections
 
-    def get_online_users(self):
-        return list(self.active_connections.keys())
\ No newline at end of file
+manager = ConnectionManager()
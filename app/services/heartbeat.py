@@ -0,0 +1,149 @@
+# app/services/heartbeat.py
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.services.chat_manager import Connection
+
+# Close code for connections that stopped answering pings (as websockets
+# uses for a keepalive timeout)
+HEARTBEAT_CLOSE_CODE = 1011
+
+
+class Heartbeat:
+    """
+    Server-driven ping/pong for the WebSockets of one worker.
+
+    A connection idle (nothing received) for CHAT_HEARTBEAT_INTERVAL_SECONDS
+    is sent {"type": "ping"}; if nothing arrives within
+    CHAT_HEARTBEAT_TIMEOUT_SECONDS after that it is closed and released, so
+    half-open sockets stop counting as online. Any frame from the client
+    counts as a sign of life, {"type": "pong"} being the cheapest.
+
+    That deadline applies to clients known to answer pings: v2
+    subprotocols, and v1 clients once they have sent a pong. Older v1
+    clients may not understand pings, so they are still pinged but closed
+    only after CHAT_HEARTBEAT_LEGACY_IDLE_SECONDS without any frame; a
+    half-open v1 socket is evicted too, just later.
+
+    All connections share one task and a heap of (next check, connection).
+    Receiving a frame only stamps the connection; it is looked at again when
+    its heap entry comes due, so idle sockets cost one entry each and busy
+    sockets cost nothing extra.
+    """
+
+    def __init__(
+        self,
+        interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+        legacy_idle: Optional[float] = None,
+    ):
+        self.interval = interval or settings.CHAT_HEARTBEAT_INTERVAL_SECONDS
+        self.timeout = timeout or settings.CHAT_HEARTBEAT_TIMEOUT_SECONDS
+        self.legacy_idle = legacy_idle or settings.CHAT_HEARTBEAT_LEGACY_IDLE_SECONDS
+        # (due, tie-breaker, connection, time of the unanswered ping or None)
+        self._heap: List[Tuple[float, int, "Connection", Optional[float]]] = []
+        self._order = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self.checks = 0
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.reaped = 0
+        self.reaped_legacy = 0
+        self.reaped_idle_seconds = 0.0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._heap.clear()
+
+    def watch(self, connection: "Connection"):
+        """Start checking a new connection (only once `start` has run)"""
+        if self._task is not None:
+            self._schedule(connection, connection.last_seen + self.interval)
+
+    def pong(self, connection: "Connection"):
+        connection.answers_pings = True
+        self.pongs_received += 1
+
+    def _schedule(self, connection: "Connection", when: float, pinged_at: Optional[float] = None):
+        heapq.heappush(self._heap, (when, next(self._order), connection, pinged_at))
+
+    async def _run(self):
+        heap = self._heap
+        while True:
+            now = time.monotonic()
+            try:
+                while heap and heap[0][0] <= now:
+                    _, _, connection, pinged_at = heapq.heappop(heap)
+                    if not connection.closed:
+                        self._check(connection, now, pinged_at)
+            except Exception as e:
+                print(f"❌ Heartbeat check failed: {e}")
+            # New connections are due an interval from now, so never sleep
+            # much past the earliest entry
+            delay = heap[0][0] - now if heap else self.interval
+            await asyncio.sleep(min(max(delay, 0.0), self.timeout))
+
+    def _check(self, connection: "Connection", now: float, pinged_at: Optional[float]):
+        """pinged_at: when the ping this check waits on was sent, if any"""
+        self.checks += 1
+        if now - connection.last_seen < self.interval:
+            # Heard from since it was scheduled
+            self._schedule(connection, connection.last_seen + self.interval)
+            return
+
+        if pinged_at is not None and connection.last_seen < pinged_at:
+            # Silent since our ping
+            idle = now - connection.last_seen
+            if connection.answers_pings or connection.protocol.heartbeat:
+                self._reap(connection, idle)
+            elif idle >= self.legacy_idle:
+                self.reaped_legacy += 1
+                self._reap(connection, idle)
+            else:
+                # May not understand pings: ping again next interval, and
+                # look again by the time its idle deadline has passed
+                self._schedule(
+                    connection, min(now + self.interval, connection.last_seen + self.legacy_idle)
+                )
+            return
+
+        # Keyed, so a backed-up queue holds at most one ping
+        ping = {"type": "ping", "timestamp": datetime.utcnow().isoformat()}
+        if connection.send_frame(ping, coalesce_key="heartbeat"):
+            self.pings_sent += 1
+        self._schedule(connection, now + self.timeout, pinged_at=now)
+
+    def _reap(self, connection: "Connection", idle: float):
+        self.reaped += 1
+        self.reaped_idle_seconds += idle
+        print(f"💀 Reaping silent connection {connection.connection_id} of user "
+              f"{connection.user_id} (idle {idle:.0f} s)")
+        connection.close(HEARTBEAT_CLOSE_CODE)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "timeout_seconds": self.timeout,
+            "legacy_idle_seconds": self.legacy_idle,
+            "scheduled": len(self._heap),
+            "checks": self.checks,
+            "pings_sent": self.pings_sent,
+            "pongs_received": self.pongs_received,
+            "reaped": self.reaped,
+            "reaped_legacy": self.reaped_legacy,
+            "reaped_average_idle_seconds": (
+                self.reaped_idle_seconds / self.reaped if self.reaped else 0.0
+            ),
+        }
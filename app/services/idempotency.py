@@ -0,0 +1,315 @@
+# app/services/idempotency.py
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type
+from uuid import UUID
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.database import async_session_maker
+from app.models.idempotency import IdempotencyKey
+
+
+class IdempotencyService:
+    """
+    Replays stored responses for requests carrying an `Idempotency-Key` header.
+
+    Completed responses live in the `idempotency_keys` table (the source of
+    truth, shared by all workers) with an in-process LRU in front of it.
+    A duplicate that arrives while the original is still running waits for
+    it instead of running in parallel: on the same worker through an
+    asyncio future, on other workers by polling the row until it completes.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, ttl_seconds: float, cache_size: int, wait_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl_seconds)
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    @staticmethod
+    def hash_request(scope: str, payload: dict) -> str:
+        raw = json.dumps({"scope": scope, "payload": payload}, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def run(
+        self,
+        db: AsyncSession,
+        user_id: UUID,
+        key: str,
+        scope: str,
+        payload: dict,
+        handler: Callable[[Callable[[object], Awaitable[None]]], Awaitable],
+        response_model: Type[BaseModel],
+    ) -> JSONResponse:
+        """
+        Run `handler` once per (user, key) and replay its response to retries.
+
+        `handler` is called with a `record(result)` coroutine function that
+        it must await right before committing its own changes: it writes the
+        response into the key's row on `db`, so the response is stored in
+        the same transaction as the money movement. A crash after that commit
+        therefore leaves a completed key, never an expired lease that would
+        let a retry charge twice.
+
+        A handler whose failure is itself a committed outcome (a FAILED
+        transaction row) records the HTTPException it is about to raise the
+        same way; that error is replayed. Any other error releases the key,
+        so a retry with a corrected PIN or body runs again.
+
+        The write only matches the row this request claimed (its lease
+        `expires_at` is the claim token). If the lease ran out and a retry
+        took the key over, `record` raises 409 and the handler's changes are
+        rolled back, so only one of the two can commit.
+        """
+        if not key or len(key) > 255:
+            raise HTTPException(400, "Idempotency-Key must be 1-255 characters")
+
+        request_hash = self.hash_request(scope, payload)
+        cache_key = (str(user_id), key)
+
+        stored = self.cache.get(cache_key)
+        if stored is not None:
+            return self._replay(stored, request_hash)
+
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            try:
+                stored = await asyncio.wait_for(asyncio.shield(in_flight), self.wait_seconds)
+            except asyncio.TimeoutError:
+                raise HTTPException(409, "A request with this Idempotency-Key is still in progress")
+            return self._replay(stored, request_hash)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        try:
+            stored, lease = await self._claim(db, user_id, key, scope, request_hash)
+            if stored is not None:
+                # Finished earlier, possibly on another worker
+                self.cache.set(cache_key, stored)
+                future.set_result(stored)
+                return self._replay(stored, request_hash)
+
+            recorded = None
+            lease_lost = False
+
+            async def record(result) -> None:
+                nonlocal recorded, lease_lost
+                if isinstance(result, HTTPException):
+                    recorded = {
+                        "request_hash": request_hash,
+                        "status_code": result.status_code,
+                        "body": {"detail": result.detail},
+                    }
+                else:
+                    recorded = {
+                        "request_hash": request_hash,
+                        "status_code": 200,
+                        "body": response_model.model_validate(result).model_dump(mode="json"),
+                    }
+                completed = await db.execute(self._completion(user_id, key, lease, recorded))
+                if completed.rowcount != 1:
+                    recorded = None
+                    lease_lost = True
+                    raise HTTPException(
+                        409, "Idempotency-Key lease expired before the request finished; retry it"
+                    )
+
+            try:
+                result = await handler(record)
+            except HTTPException as he:
+                if recorded is not None and recorded["status_code"] == he.status_code:
+                    # Committed together with the outcome it describes
+                    self.cache.set(cache_key, recorded)
+                    future.set_result(recorded)
+                    raise
+                # Invalid PIN, validation, lost lease, 5xx: nothing was
+                # committed, so let a retry run (a lost claim's row is left alone)
+                await self._release(db, user_id, key, lease)
+                raise
+            except BaseException:
+                await self._release(db, user_id, key, lease)
+                raise
+
+            stored = recorded
+            if stored is None:
+                # Handler committed without recording: store it afterwards
+                stored = {
+                    "request_hash": request_hash,
+                    "status_code": 200,
+                    "body": response_model.model_validate(result).model_dump(mode="json"),
+                }
+                await self._store(db, user_id, key, lease, stored)
+            self.cache.set(cache_key, stored)
+            future.set_result(stored)
+            return JSONResponse(content=stored["body"], status_code=stored["status_code"])
+        except BaseException as e:
+            # Waiters on this worker see the same failure instead of hanging
+            if not future.done():
+                future.set_exception(e)
+                # Nobody may be waiting; don't log "exception never retrieved"
+                future.exception()
+            raise
+        finally:
+            self._in_flight.pop(cache_key, None)
+
+    def _replay(self, stored: dict, request_hash: str) -> JSONResponse:
+        if stored["request_hash"] != request_hash:
+            raise HTTPException(422, "Idempotency-Key was already used with a different request")
+        return JSONResponse(
+            content=stored["body"],
+            status_code=stored["status_code"],
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    async def _claim(
+        self, db: AsyncSession, user_id: UUID, key: str, scope: str, request_hash: str
+    ) -> Tuple[Optional[dict], Optional[datetime]]:
+        """
+        Insert an in-progress row for the key. Returns (None, lease) if this
+        request now owns the key, or (stored response, None) if it already
+        completed.
+
+        In-progress rows only hold a short lease, so a worker that dies
+        mid-request does not block the key for the full TTL. The lease's
+        `expires_at` identifies the claim: writes for it must match it.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            now = datetime.now(timezone.utc)
+            lease = now + timedelta(seconds=self.wait_seconds * 2)
+            await db.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.expires_at < now,
+                )
+            )
+            claimed = (
+                await db.execute(
+                    pg_insert(IdempotencyKey)
+                    .values(
+                        user_id=user_id,
+                        key=key,
+                        scope=scope,
+                        request_hash=request_hash,
+                        expires_at=lease,
+                    )
+                    .on_conflict_do_nothing()
+                    .returning(IdempotencyKey.key)
+                )
+            ).first()
+            await db.commit()
+            if claimed:
+                return None, lease
+
+            row = (
+                await db.execute(
+                    select(
+                        IdempotencyKey.request_hash,
+                        IdempotencyKey.status_code,
+                        IdempotencyKey.response_body,
+                    ).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+                )
+            ).first()
+            await db.commit()
+
+            if row is None:
+                continue
+            if row.status_code is not None:
+                return {
+                    "request_hash": row.request_hash,
+                    "status_code": row.status_code,
+                    "body": row.response_body,
+                }, None
+            if row.request_hash != request_hash:
+                raise HTTPException(422, "Idempotency-Key was already used with a different request")
+            if time.monotonic() > deadline:
+                raise HTTPException(409, "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    def _completion(self, user_id: UUID, key: str, lease: datetime, stored: dict):
+        """
+        UPDATE that turns the key's in-progress row into a stored response.
+        Matches no row if the claim behind `lease` was lost.
+        """
+        return (
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.status_code.is_(None),
+                IdempotencyKey.expires_at == lease,
+            )
+            .values(
+                status_code=stored["status_code"],
+                response_body=stored["body"],
+                expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+            )
+        )
+
+    async def _store(
+        self, db: AsyncSession, user_id: UUID, key: str, lease: datetime, stored: dict
+    ) -> None:
+        """Store a response in a transaction of its own (nothing else to commit)"""
+        await db.rollback()
+        result = await db.execute(self._completion(user_id, key, lease, stored))
+        await db.commit()
+        if result.rowcount != 1:
+            print(f"⚠️ Idempotency key {key} was taken over before its response was stored")
+
+    async def _release(self, db: AsyncSession, user_id: UUID, key: str, lease: datetime) -> None:
+        """Forget a key whose request failed unexpectedly so a retry can run it"""
+        try:
+            await db.rollback()
+            await db.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.status_code.is_(None),
+                    # Only our own claim, never one a retry took over
+                    IdempotencyKey.expires_at == lease,
+                )
+            )
+            await db.commit()
+        except Exception as e:
+            print(f"❌ Failed to release idempotency key {key}: {e}")
+
+    async def purge_expired(self) -> int:
+        async with async_session_maker() as db:
+            result = await db.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.expires_at < datetime.now(timezone.utc)
+                )
+            )
+            await db.commit()
+            return result.rowcount
+
+    async def purge_expired_forever(self, interval_seconds: float = 3600) -> None:
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    print(f"🧹 Purged {purged} expired idempotency keys")
+            except Exception as e:
+                print(f"❌ Idempotency key purge failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+
+idempotency = IdempotencyService(
+    ttl_seconds=settings.IDEMPOTENCY_KEY_TTL_HOURS * 3600,
+    cache_size=settings.IDEMPOTENCY_CACHE_SIZE,
+    wait_seconds=settings.IDEMPOTENCY_WAIT_SECONDS,
+)
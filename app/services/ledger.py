@@ -0,0 +1,223 @@
+# app/services/ledger.py
+import asyncio
+import time
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import select, insert, func, text, literal, BigInteger
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.database import async_session_maker
+from app.models.ledger import LedgerEntry, LedgerCheckpoint, WalletBalanceSnapshot
+from app.models.wallet import Wallet
+
+
+def entry(
+    debit_wallet_id: UUID,
+    credit_wallet_id: UUID,
+    amount: Decimal,
+    transaction_id: Optional[UUID] = None,
+) -> dict:
+    """Build one ledger line: `amount` moves from debit to credit wallet"""
+    return {
+        "debit_wallet_id": debit_wallet_id,
+        "credit_wallet_id": credit_wallet_id,
+        "amount": amount,
+        "transaction_id": transaction_id,
+    }
+
+
+async def record_entries(db: AsyncSession, entries: list) -> None:
+    """
+    Append ledger entries with one batched INSERT.
+
+    Must run in the same DB transaction as the balance change it describes;
+    the caller commits.
+    """
+    if entries:
+        await db.execute(insert(LedgerEntry), entries)
+
+
+async def last_checkpoint_seq(db: AsyncSession) -> int:
+    seq = (
+        await db.execute(
+            select(LedgerCheckpoint.last_entry_seq)
+            .order_by(LedgerCheckpoint.id.desc())
+            .limit(1)
+        )
+    ).scalar_one_or_none()
+    return seq or 0
+
+
+def _signed_entries(from_seq, to_seq=None):
+    """Entries after `from_seq` as (wallet_id, signed delta) rows"""
+    conditions = [LedgerEntry.seq > from_seq]
+    if to_seq is not None:
+        conditions.append(LedgerEntry.seq <= to_seq)
+
+    credits = select(
+        LedgerEntry.credit_wallet_id.label("wallet_id"),
+        LedgerEntry.amount.label("delta"),
+    ).where(*conditions)
+    debits = select(
+        LedgerEntry.debit_wallet_id.label("wallet_id"),
+        (-LedgerEntry.amount).label("delta"),
+    ).where(*conditions)
+    return credits.union_all(debits).subquery()
+
+
+async def ledger_balance(db: AsyncSession, wallet_id: UUID) -> Decimal:
+    """
+    Balance of a wallet according to the ledger: its snapshot plus the
+    entries written since the last checkpoint (a bounded tail).
+    """
+    from_seq = await last_checkpoint_seq(db)
+    snapshot = (
+        await db.execute(
+            select(WalletBalanceSnapshot.balance).where(
+                WalletBalanceSnapshot.wallet_id == wallet_id
+            )
+        )
+    ).scalar_one_or_none() or Decimal(0)
+
+    tail = _signed_entries(from_seq)
+    delta = (
+        await db.execute(
+            select(func.coalesce(func.sum(tail.c.delta), 0)).where(tail.c.wallet_id == wallet_id)
+        )
+    ).scalar_one()
+    return snapshot + delta
+
+
+async def _settled_seq(db: AsyncSession, timeout: float) -> Optional[int]:
+    """
+    Highest ledger seq below which every entry is committed (or rolled back).
+
+    Identity values are handed out before commit, so max(seq) alone could
+    skip an entry whose transaction commits later. Instead take the last
+    allocated value, then wait until every transaction that was running at
+    that moment has finished.
+    """
+    row = (
+        await db.execute(
+            text(
+                "SELECT pg_sequence_last_value("
+                "pg_get_serial_sequence('ledger_entries', 'seq')::regclass) AS last_seq, "
+                "pg_snapshot_xmax(pg_current_snapshot())::text AS xmax"
+            )
+        )
+    ).one()
+    await db.commit()
+    if row.last_seq is None:
+        return 0
+
+    deadline = time.monotonic() + timeout
+    while True:
+        settled = (
+            await db.execute(
+                text(
+                    "SELECT pg_snapshot_xmin(pg_current_snapshot()) >= CAST(:xmax AS xid8)"
+                ),
+                {"xmax": row.xmax},
+            )
+        ).scalar_one()
+        await db.commit()
+        if settled:
+            return row.last_seq
+        if time.monotonic() > deadline:
+            return None
+        await asyncio.sleep(0.1)
+
+
+async def checkpoint(db: AsyncSession, settle_timeout: float = 30.0) -> int:
+    """
+    Fold every settled entry since the previous checkpoint into
+    wallet_balance_snapshots. Returns the number of entries folded.
+    """
+    to_seq = await _settled_seq(db, settle_timeout)
+    if to_seq is None:
+        print("⏳ Ledger checkpoint skipped: long-running transactions still open")
+        return 0
+
+    # Serialise checkpoints across workers for the rest of this transaction
+    await db.execute(text("SELECT pg_advisory_xact_lock(hashtext('ledger_checkpoint'))"))
+    from_seq = await last_checkpoint_seq(db)
+    if to_seq <= from_seq:
+        await db.commit()
+        return 0
+
+    folded = (
+        await db.execute(
+            select(func.count()).where(LedgerEntry.seq > from_seq, LedgerEntry.seq <= to_seq)
+        )
+    ).scalar_one()
+
+    deltas = _signed_entries(from_seq, to_seq)
+    upsert = pg_insert(WalletBalanceSnapshot).from_select(
+        ["wallet_id", "balance", "last_entry_seq", "updated_at"],
+        select(
+            deltas.c.wallet_id,
+            func.sum(deltas.c.delta),
+            literal(to_seq, BigInteger),
+            func.now(),
+        ).group_by(deltas.c.wallet_id),
+    )
+    await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=[WalletBalanceSnapshot.wallet_id],
+            set_={
+                "balance": WalletBalanceSnapshot.balance + upsert.excluded.balance,
+                "last_entry_seq": upsert.excluded.last_entry_seq,
+                "updated_at": func.now(),
+            },
+        )
+    )
+    db.add(LedgerCheckpoint(last_entry_seq=to_seq, entries_folded=folded))
+    await db.commit()
+    return folded
+
+
+async def find_drift(db: AsyncSession, limit: int = 100) -> list:
+    """
+    Wallets whose stored balance disagrees with the ledger. Intended for
+    ops checks; compares against snapshot + tail for every wallet.
+    """
+    from_seq = await last_checkpoint_seq(db)
+    tail = _signed_entries(from_seq)
+    tail_sum = (
+        select(tail.c.wallet_id, func.sum(tail.c.delta).label("delta"))
+        .group_by(tail.c.wallet_id)
+        .subquery()
+    )
+    ledger_value = (
+        func.coalesce(WalletBalanceSnapshot.balance, 0) + func.coalesce(tail_sum.c.delta, 0)
+    )
+    rows = (
+        await db.execute(
+            select(Wallet.id, Wallet.balance, ledger_value.label("ledger_balance"))
+            .outerjoin(WalletBalanceSnapshot, WalletBalanceSnapshot.wallet_id == Wallet.id)
+            .outerjoin(tail_sum, tail_sum.c.wallet_id == Wallet.id)
+            .where(func.coalesce(Wallet.balance, 0) != ledger_value)
+            .limit(limit)
+        )
+    ).all()
+    return [
+        {"wallet_id": r.id, "balance": r.balance, "ledger_balance": r.ledger_balance}
+        for r in rows
+    ]
+
+
+async def checkpoint_forever(interval_seconds: Optional[float] = None) -> None:
+    interval = interval_seconds or settings.LEDGER_CHECKPOINT_INTERVAL_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with async_session_maker() as db:
+                folded = await checkpoint(db)
+            if folded:
+                print(f"📒 Ledger checkpoint folded {folded} entries")
+        except Exception as e:
+            print(f"❌ Ledger checkpoint failed: {e}")
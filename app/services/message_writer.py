@@ -0,0 +1,147 @@
+# app/services/message_writer.py
+import asyncio
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.crud.chat import create_messages
+from app.db.database import async_session_maker
+from app.models.chat import ChatMessage
+
+
+class MessageWriter:
+    """
+    Group commit for chat messages.
+
+    `submit` queues a message and returns once it is committed. A single
+    flusher collects messages from every connection for up to
+    CHAT_WRITE_WINDOW_MS (or until CHAT_WRITE_BATCH_SIZE are waiting) and
+    writes them with one INSERT ... RETURNING and one commit on a session
+    of its own, then resolves each sender's future. While a batch is being
+    written the next one fills up, so the batch size follows the load.
+
+    If a batch fails it is retried one message at a time, so a bad message
+    (e.g. a receiver deleted meanwhile, or a retried client_msg_id racing
+    its first copy) only fails, or resolves as a duplicate, on its own.
+    """
+
+    def __init__(self, window_ms: Optional[float] = None, batch_size: Optional[int] = None):
+        self.window = (settings.CHAT_WRITE_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self.batch_size = batch_size or settings.CHAT_WRITE_BATCH_SIZE
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.batches = 0
+        self.messages = 0
+
+    async def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._flush_forever())
+
+    async def stop(self):
+        """Write whatever is still queued, then stop the flusher"""
+        if self._task is None:
+            return
+        # Submits from here on flush inline
+        task, self._task = self._task, None
+        self._stopping = True
+        self._has_pending.set()
+        self._batch_full.set()
+        await task
+
+    async def submit(
+        self,
+        sender_id,
+        receiver_id,
+        content: str,
+        message_type: str = "text",
+        client_msg_id: Optional[str] = None,
+    ) -> Tuple[ChatMessage, bool]:
+        """
+        Queue a message for the next batch. Returns (message, duplicate)
+        once committed; duplicate means client_msg_id was already stored
+        and message is the stored copy.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(({
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "content": content,
+            "message_type": message_type,
+            "client_msg_id": client_msg_id,
+        }, future))
+        self._has_pending.set()
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+        if self._task is None:
+            # Not started (scripts, tests): flush inline
+            await self._flush(self._take())
+        return await future
+
+    def _take(self) -> List[Tuple[dict, asyncio.Future]]:
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        if self._stopping:
+            return batch
+        if len(self._pending) < self.batch_size:
+            self._batch_full.clear()
+        if not self._pending:
+            self._has_pending.clear()
+        return batch
+
+    async def _flush_forever(self):
+        while True:
+            await self._has_pending.wait()
+            if not self._pending:
+                # Woken by stop with nothing left to write
+                return
+            if len(self._pending) < self.batch_size and self.window > 0:
+                try:
+                    async with asyncio.timeout(self.window):
+                        await self._batch_full.wait()
+                except TimeoutError:
+                    pass
+            await self._flush(self._take())
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        if not batch:
+            return
+        try:
+            async with async_session_maker() as db:
+                created = await create_messages(db, [values for values, _ in batch])
+        except Exception as e:
+            print(f"❌ Batch of {len(batch)} messages failed, retrying one by one: {e}")
+            await self._flush_one_by_one(batch)
+            return
+
+        self.batches += 1
+        self.messages += len(created)
+        for (_, future), result in zip(batch, created):
+            if not future.done():
+                future.set_result(result)
+
+    async def _flush_one_by_one(self, batch: List[Tuple[dict, asyncio.Future]]):
+        for values, future in batch:
+            try:
+                async with async_session_maker() as db:
+                    [result] = await create_messages(db, [values])
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.messages += 1
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "average_batch": self.messages / self.batches if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
+
+
+message_writer = MessageWriter()
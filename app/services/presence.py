@@ -0,0 +1,271 @@
+# app/services/presence.py
+import asyncio
+import json
+import sys
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.broker import Broker
+
+if TYPE_CHECKING:
+    from app.services.chat_manager import Connection
+
+# One channel for every worker: a message holds all changes of one flush
+PRESENCE_CHANNEL = "chat:presence"
+
+ONLINE = "online"
+OFFLINE = "offline"
+TYPING = "typing"
+
+
+class PresenceService:
+    """
+    Presence subscriptions for the WebSockets of this worker.
+
+    A connection subscribes to a set of users (its conversation partners)
+    and is then sent only what changes:
+    {"type": "presence", "changes": {user_id: "online" | "offline" | "typing"}}.
+
+    Local transitions are gathered for PRESENCE_FLUSH_MS and published as
+    one broker message per worker; every worker forwards them to its own
+    subscribers, one frame per connection per message. A user whose last
+    device drops is announced offline only after
+    PRESENCE_OFFLINE_GRACE_SECONDS, and only if no worker has seen them
+    back, so flaky networks and page reloads cause no frames. Subscribers
+    are never told a state they already have. Typing is per conversation,
+    refreshed by the client and dropped after PRESENCE_TYPING_TTL_SECONDS.
+
+    State is dicts and sets of interned user id strings: one entry per
+    watched user, per subscribing connection and per pending transition.
+    Transitions are only recorded once `start` has run.
+    """
+
+    def __init__(
+        self,
+        broker: Broker,
+        flush_ms: Optional[float] = None,
+        offline_grace: Optional[float] = None,
+        typing_ttl: Optional[float] = None,
+        max_subscriptions: Optional[int] = None,
+    ):
+        self.broker = broker
+        self.flush_interval = (flush_ms if flush_ms is not None else settings.PRESENCE_FLUSH_MS) / 1000
+        self.offline_grace = (
+            offline_grace if offline_grace is not None else settings.PRESENCE_OFFLINE_GRACE_SECONDS
+        )
+        self.typing_ttl = typing_ttl if typing_ttl is not None else settings.PRESENCE_TYPING_TTL_SECONDS
+        self.max_subscriptions = max_subscriptions or settings.PRESENCE_MAX_SUBSCRIPTIONS
+
+        # watched user_id -> local connections subscribed to it
+        self._watchers: Dict[str, Set["Connection"]] = {}
+        # connection -> the user ids it watches
+        self._subscriptions: Dict["Connection", Tuple[str, ...]] = {}
+        # watched user_id -> last state sent to its watchers
+        self._known: Dict[str, str] = {}
+
+        # Transitions of users connected to this worker, until the next flush
+        self._went_online: Set[str] = set()
+        self._offline_at: Dict[str, float] = {}  # user_id -> end of grace period
+        self._typing: Dict[Tuple[str, str], float] = {}  # (typist, partner) -> expiry
+        self._typing_started: Set[Tuple[str, str]] = set()
+        self._typing_stopped: Set[Tuple[str, str]] = set()
+
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.received = 0
+        self.frames = 0
+        self.flaps_suppressed = 0
+
+    async def start(self):
+        await self.broker.subscribe(PRESENCE_CHANNEL, self._on_presence)
+        self._task = asyncio.create_task(self._flush_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.broker.unsubscribe(PRESENCE_CHANNEL, self._on_presence)
+
+    # Local transitions (called by ConnectionManager and the socket loop)
+
+    def user_connected(self, user_id: str):
+        """First device of user_id connected to this worker"""
+        if self._task is None:
+            return
+        user_id = sys.intern(user_id)
+        if self._offline_at.pop(user_id, None) is not None:
+            # Back within the grace period. Still announced, but watchers
+            # that never saw "offline" drop it as a repeat.
+            self.flaps_suppressed += 1
+        self._went_online.add(user_id)
+
+    def user_disconnected(self, user_id: str):
+        """Last device of user_id on this worker went away"""
+        if self._task is None:
+            return
+        user_id = sys.intern(user_id)
+        self._went_online.discard(user_id)
+        self._offline_at[user_id] = time.monotonic() + self.offline_grace
+
+    def typing(self, user_id: str, partner_id: str):
+        """user_id is typing to partner_id; call again to keep it going"""
+        if self._task is None:
+            return
+        key = (sys.intern(user_id), sys.intern(partner_id))
+        if key not in self._typing:
+            self._typing_started.add(key)
+            self._typing_stopped.discard(key)
+        self._typing[key] = time.monotonic() + self.typing_ttl
+
+    def typing_stopped(self, user_id: str, partner_id: str):
+        key = (user_id, partner_id)
+        if self._typing.pop(key, None) is None:
+            return
+        if key in self._typing_started:
+            # Never published: nothing to take back
+            self._typing_started.discard(key)
+        else:
+            self._typing_stopped.add(key)
+
+    # Subscriptions
+
+    async def subscribe(self, connection: "Connection", user_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        Watch user_ids (replacing any earlier subscription of connection).
+        Returns their current state, the first frame the client needs.
+        """
+        self.unsubscribe(connection)
+        watched = tuple(dict.fromkeys(sys.intern(str(user_id)) for user_id in user_ids))
+        watched = watched[: self.max_subscriptions]
+        if not watched or connection.closed:
+            return {}
+        self._subscriptions[connection] = watched
+        for user_id in watched:
+            watchers = self._watchers.get(user_id)
+            if watchers is None:
+                watchers = self._watchers[user_id] = set()
+            watchers.add(connection)
+
+        online = await self.broker.online_among(watched)
+        snapshot = {}
+        for user_id in watched:
+            state = ONLINE if user_id in online else OFFLINE
+            snapshot[user_id] = state
+            if user_id in self._watchers:
+                self._known[user_id] = state
+        return snapshot
+
+    def unsubscribe(self, connection: "Connection"):
+        for user_id in self._subscriptions.pop(connection, ()):
+            watchers = self._watchers.get(user_id)
+            if watchers is None:
+                continue
+            watchers.discard(connection)
+            if not watchers:
+                del self._watchers[user_id]
+                self._known.pop(user_id, None)
+
+    # Publishing
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Presence flush failed: {e}")
+
+    async def flush(self):
+        """Publish the transitions gathered since the last flush, if any"""
+        now = time.monotonic()
+        for key, expires in list(self._typing.items()):
+            if expires <= now:
+                self.typing_stopped(*key)
+
+        offline = [user_id for user_id, deadline in self._offline_at.items() if deadline <= now]
+        for user_id in offline:
+            del self._offline_at[user_id]
+        if offline:
+            # Another worker (or device) may hold the user by now
+            still_online = await self.broker.online_among(offline)
+            offline = [user_id for user_id in offline if user_id not in still_online]
+            gone = set(offline)
+            for key in [key for key in self._typing if key[0] in gone]:
+                # Offline supersedes typing for every watcher
+                del self._typing[key]
+                self._typing_started.discard(key)
+            self._typing_stopped = {key for key in self._typing_stopped if key[0] not in gone}
+
+        if not (offline or self._went_online or self._typing_started or self._typing_stopped):
+            return
+        event = {
+            "off": offline,
+            "on": list(self._went_online),
+            "typing": [list(key) for key in self._typing_started],
+            "stopped": [list(key) for key in self._typing_stopped],
+        }
+        self._went_online = set()
+        self._typing_started = set()
+        self._typing_stopped = set()
+        await self.broker.publish(PRESENCE_CHANNEL, json.dumps(event, separators=(",", ":")))
+        self.published += 1
+
+    async def _on_presence(self, channel: str, payload: str):
+        """Broker handler: turn one worker's flush into frames for local watchers"""
+        self.received += 1
+        if not self._watchers:
+            return
+        event = json.loads(payload)
+        diffs: Dict["Connection", Dict[str, str]] = {}
+        for user_id in event.get("off", ()):
+            self._changed(user_id, OFFLINE, diffs)
+        for user_id in event.get("on", ()):
+            self._changed(user_id, ONLINE, diffs)
+        for user_id, partner_id in event.get("typing", ()):
+            self._typed(user_id, partner_id, TYPING, diffs)
+        for user_id, partner_id in event.get("stopped", ()):
+            self._typed(user_id, partner_id, ONLINE, diffs)
+
+        for connection, changes in diffs.items():
+            if connection.send_frame({"type": "presence", "changes": changes}):
+                self.frames += 1
+
+    def _changed(self, user_id: str, state: str, diffs: dict):
+        watchers = self._watchers.get(user_id)
+        if not watchers or self._known.get(user_id) == state:
+            return
+        self._known[user_id] = state
+        for connection in watchers:
+            changes = diffs.get(connection)
+            if changes is None:
+                changes = diffs[connection] = {}
+            changes[user_id] = state
+
+    def _typed(self, user_id: str, partner_id: str, state: str, diffs: dict):
+        # Typing only concerns the partner's own devices
+        watchers = self._watchers.get(user_id)
+        if not watchers or self._known.get(user_id) == OFFLINE:
+            return
+        for connection in watchers:
+            if connection.user_id != partner_id:
+                continue
+            changes = diffs.get(connection)
+            if changes is None:
+                changes = diffs[connection] = {}
+            changes[user_id] = state
+
+    def stats(self) -> dict:
+        return {
+            "watched_users": len(self._watchers),
+            "subscribed_connections": len(self._subscriptions),
+            "subscriptions": sum(len(watched) for watched in self._subscriptions.values()),
+            "pending_offline": len(self._offline_at),
+            "typing": len(self._typing),
+            "published": self.published,
+            "received": self.received,
+            "frames": self.frames,
+            "flaps_suppressed": self.flaps_suppressed,
+        }
@@ -0,0 +1,124 @@
+# app/services/user_cache.py
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+from uuid import UUID
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models.user import User
+
+# Identifier cache value for "no such user"
+_NOT_FOUND = object()
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """
+    Read-only copy of the columns request handlers need from `users`.
+
+    Frozen because one snapshot is shared by every concurrent request of
+    that user; routes that modify the user must load the ORM row instead.
+    Password and PIN hashes are left out; routes that verify them read
+    them from the database with `user_service.get_credential_hashes`.
+    """
+    id: UUID
+    email: str
+    full_name: Optional[str]
+    mobile_number: Optional[str]
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            mobile_number=user.mobile_number,
+            is_active=user.is_active,
+        )
+
+
+class UserCache:
+    """
+    TTL + LRU cache of UserSnapshot keyed by the JWT `sub` (user id string),
+    plus a second one keyed by the identifiers chat clients address users
+    by (id, email or full name). Lookups that found nobody are cached too,
+    for a shorter time.
+
+    Call `invalidate` whenever a user row changes or a user is created; it
+    drops the user's identifier entries and all negative ones, since a new
+    email or name may now resolve. Other workers hold their own copies;
+    register a publisher with `add_invalidation_listener` to fan the
+    invalidation out (e.g. over pub/sub) and call `invalidate(...,
+    propagate=False)` when such a message arrives.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        identifier_ttl: Optional[float] = None,
+        negative_ttl: float = 5.0,
+    ):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._identifiers = TTLCache(maxsize=maxsize, ttl=identifier_ttl or ttl)
+        self.negative_ttl = negative_ttl
+        self._listeners: List[Callable[[str], None]] = []
+
+    def get(self, user_id: str) -> Optional[UserSnapshot]:
+        return self._cache.get(str(user_id))
+
+    def set(self, user: User) -> UserSnapshot:
+        snapshot = UserSnapshot.from_user(user)
+        self._cache.set(str(user.id), snapshot)
+        return snapshot
+
+    def get_by_identifier(self, identifier: str) -> Tuple[bool, Optional[UserSnapshot]]:
+        """(cached, snapshot): snapshot is None when the user is known not to exist"""
+        value = self._identifiers.get(identifier, None)
+        if value is None:
+            return False, None
+        return True, None if value is _NOT_FOUND else value
+
+    def set_identifier(self, identifier: str, user: Optional[User]) -> Optional[UserSnapshot]:
+        if user is None:
+            self._identifiers.set(identifier, _NOT_FOUND, ttl=self.negative_ttl)
+            return None
+        snapshot = user if isinstance(user, UserSnapshot) else UserSnapshot.from_user(user)
+        self._identifiers.set(identifier, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id, propagate: bool = True) -> None:
+        user_id_str = str(user_id)
+        self._cache.delete(user_id_str)
+        self._identifiers.delete_matching(
+            lambda value: value is _NOT_FOUND or str(value.id) == user_id_str
+        )
+        if not propagate:
+            return
+        for listener in self._listeners:
+            try:
+                listener(user_id_str)
+            except Exception as e:
+                print(f"❌ User cache invalidation listener failed: {e}")
+
+    def add_invalidation_listener(self, listener: Callable[[str], None]) -> None:
+        self._listeners.append(listener)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._identifiers.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    def identifier_stats(self) -> dict:
+        return self._identifiers.stats()
+
+
+user_cache = UserCache(
+    maxsize=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL_SECONDS,
+    identifier_ttl=settings.USER_IDENTIFIER_CACHE_TTL_SECONDS,
+    negative_ttl=settings.USER_IDENTIFIER_NEGATIVE_TTL_SECONDS,
+)
@@ -1,8 +1,10 @@
 # app/services/user_service.py
+from uuid import UUID
 from sqlalchemy import select
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
-from app.core.security import get_password_hash, verify_password
+from app.core.security import hash_password, verify_password
 
 async def get_user_by_email(db: AsyncSession, email: str) -> User | None:
     q = select(User).where(User.email == email)
@@ -11,7 +13,7 @@ async def get_user_by_email(db: AsyncSession, email: str) -> User | None:
     return user
 
 async def create_user(db: AsyncSession, email: str, password: str, full_name: str | None = None) -> User:
-    hashed = get_password_hash(password)
+    hashed = hash_password(password)
     user = User(email=email, hashed_password=hashed, full_name=full_name or None)
     db.add(user)
     await db.commit()
@@ -25,3 +27,9 @@ async def authenticate_user(db: AsyncSession, email: str, password: str) -> User
     if not verify_password(password, user.hashed_password):
         return None
     return user
+
+async def get_credential_hashes(db: AsyncSession, user_id: UUID) -> Row | None:
+    """Fresh (hashed_password, pin_hashed) of a user; the user cache does not hold them"""
+    q = select(User.hashed_password, User.pin_hashed).where(User.id == user_id)
+    res = await db.execute(q)
+    return res.first()
@@ -0,0 +1,282 @@
+# app/services/wallet_service.py
+from decimal import Decimal
+from typing import Awaitable, Callable, Optional
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, insert, or_, column, values, Numeric
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.models.wallet import Wallet
+from app.models.transaction import Transaction, TransactionType, TransactionStatus
+from app.services import ledger
+
+
+async def lock_transfer_wallets(db: AsyncSession, sender_id: UUID, to_email: str):
+    """
+    Resolve the sender and receiver wallets in one query and lock both rows.
+
+    Rows are locked in wallet id order so two transfers touching the same
+    pair of wallets (in either direction) can never deadlock each other.
+    """
+    query = (
+        select(Wallet.id, Wallet.user_id, Wallet.balance, User.email)
+        .join(User, Wallet.user_id == User.id)
+        .where(or_(User.id == sender_id, User.email == to_email))
+        .order_by(Wallet.id)
+        .with_for_update(of=Wallet)
+    )
+    rows = (await db.execute(query)).all()
+
+    sender_wallet = next((row for row in rows if row.user_id == sender_id), None)
+    receiver_wallet = next((row for row in rows if row.email == to_email), None)
+    return sender_wallet, receiver_wallet
+
+
+async def apply_balance_deltas(db: AsyncSession, deltas: dict) -> dict:
+    """
+    Add each signed delta to its wallet with a single UPDATE ... FROM (VALUES ...).
+
+    `deltas` maps wallet id -> Decimal. Returns wallet id -> updated row
+    (id, user_id, balance). The wallets must already be locked by the caller.
+    """
+    delta_rows = values(
+        column("wallet_id", PG_UUID(as_uuid=True)),
+        column("delta", Numeric(10, 2)),
+        name="deltas",
+    ).data(list(deltas.items()))
+
+    result = await db.execute(
+        update(Wallet)
+        .where(Wallet.id == delta_rows.c.wallet_id)
+        .values(balance=Wallet.balance + delta_rows.c.delta)
+        .returning(Wallet.id, Wallet.user_id, Wallet.balance)
+        .execution_options(synchronize_session=False)
+    )
+    return {row.id: row for row in result.all()}
+
+
+async def transfer(
+    db: AsyncSession,
+    sender: User,
+    to_email: str,
+    amount: Decimal,
+    before_commit: Optional[Callable[[object], Awaitable[None]]] = None,
+) -> dict:
+    """
+    Move `amount` from the sender's wallet to the wallet owned by `to_email`.
+
+    Round-trips: one locking SELECT for both wallets, one UPDATE for both
+    balances, one batched INSERT for both transaction rows and one for the
+    ledger entry. The caller is
+    expected to have verified the sender's PIN already. `before_commit` is
+    awaited with the result (or the "Insufficient balance" error) just
+    before the transfer commits (the Idempotency-Key response is stored in
+    the same transaction).
+    """
+    try:
+        sender_wallet, receiver_wallet = await lock_transfer_wallets(db, sender.id, to_email)
+
+        # Release the row locks before bailing out
+        if not sender_wallet:
+            await db.rollback()
+            raise HTTPException(404, "Sender wallet not found")
+        if not receiver_wallet:
+            await db.rollback()
+            raise HTTPException(404, "Receiver not found")
+
+        # Balance is read under the row lock, so this check cannot go stale
+        if sender_wallet.balance < amount:
+            await db.execute(
+                insert(Transaction),
+                [
+                    {
+                        "wallet_id": sender_wallet.id,
+                        "amount": amount,
+                        "type": TransactionType.TRANSFER,
+                        "status": TransactionStatus.FAILED,
+                        "counterparty": to_email,
+                    }
+                ],
+            )
+            error = HTTPException(400, "Insufficient balance")
+            # The FAILED row is an outcome of this request: replay it to retries
+            if before_commit is not None:
+                await before_commit(error)
+            await db.commit()
+            raise error
+
+        # Summed, so a transfer to your own wallet nets to zero as it always has
+        deltas = {sender_wallet.id: -amount}
+        deltas[receiver_wallet.id] = deltas.get(receiver_wallet.id, Decimal(0)) + amount
+        updated = await apply_balance_deltas(db, deltas)
+
+        transfer_tx_id = uuid4()
+        await db.execute(
+            insert(Transaction),
+            [
+                {
+                    "id": transfer_tx_id,
+                    "wallet_id": sender_wallet.id,
+                    "amount": amount,
+                    "type": TransactionType.TRANSFER,
+                    "status": TransactionStatus.SUCCESS,
+                    "counterparty": to_email,
+                },
+                {
+                    "wallet_id": receiver_wallet.id,
+                    "amount": amount,
+                    "type": TransactionType.RECEIVE,
+                    "status": TransactionStatus.SUCCESS,
+                    "counterparty": sender.email,
+                },
+            ],
+        )
+        await ledger.record_entries(
+            db, [ledger.entry(sender_wallet.id, receiver_wallet.id, amount, transfer_tx_id)]
+        )
+
+        sender_row = updated[sender_wallet.id]
+        result = {
+            "id": sender_row.id,
+            "user_id": sender_row.user_id,
+            "balance": sender_row.balance,
+        }
+        if before_commit is not None:
+            await before_commit(result)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception:
+        await db.rollback()
+        raise
+
+    return result
+
+
+async def batch_transfer(db: AsyncSession, sender: User, items: list) -> dict:
+    """
+    Pay many receivers from one sender inside a single DB transaction.
+
+    `items` is a list of (to_email, Decimal amount) pairs. All wallets are
+    resolved and locked with one IN query, balances are changed with one
+    bulk UPDATE, and the TRANSFER/RECEIVE rows and ledger entries go in with
+    one batched INSERT each.
+    Items are applied in request order; an item that cannot be paid (unknown
+    receiver, insufficient balance, ...) is reported as FAILED and does not
+    stop the rest of the batch.
+    """
+    emails = {to_email for to_email, _amount in items if to_email != sender.email}
+
+    try:
+        query = (
+            select(Wallet.id, Wallet.user_id, Wallet.balance, User.email)
+            .join(User, Wallet.user_id == User.id)
+            .where(or_(User.id == sender.id, User.email.in_(emails)))
+            .order_by(Wallet.id)
+            .with_for_update(of=Wallet)
+        )
+        rows = (await db.execute(query)).all()
+
+        sender_wallet = next((row for row in rows if row.user_id == sender.id), None)
+        if not sender_wallet:
+            # Release the row locks before bailing out
+            await db.rollback()
+            raise HTTPException(404, "Sender wallet not found")
+        wallets_by_email = {row.email: row for row in rows if row.user_id != sender.id}
+
+        balance = sender_wallet.balance
+        deltas = {}
+        tx_rows = []
+        ledger_rows = []
+        results = []
+
+        for index, (to_email, amount) in enumerate(items):
+            detail = None
+            receiver_wallet = wallets_by_email.get(to_email)
+
+            if amount <= 0:
+                detail = "Amount must be positive"
+            elif to_email == sender.email:
+                detail = "Cannot transfer to your own wallet"
+            elif not receiver_wallet:
+                detail = "Receiver not found"
+            elif balance < amount:
+                detail = "Insufficient balance"
+
+            if detail:
+                if detail == "Insufficient balance":
+                    tx_rows.append({
+                        "wallet_id": sender_wallet.id,
+                        "amount": amount,
+                        "type": TransactionType.TRANSFER,
+                        "status": TransactionStatus.FAILED,
+                        "counterparty": to_email,
+                    })
+                results.append({
+                    "index": index,
+                    "to_email": to_email,
+                    "amount": amount,
+                    "status": TransactionStatus.FAILED,
+                    "detail": detail,
+                })
+                continue
+
+            balance -= amount
+            deltas[sender_wallet.id] = deltas.get(sender_wallet.id, Decimal(0)) - amount
+            deltas[receiver_wallet.id] = deltas.get(receiver_wallet.id, Decimal(0)) + amount
+
+            transfer_tx_id = uuid4()
+            tx_rows.append({
+                "id": transfer_tx_id,
+                "wallet_id": sender_wallet.id,
+                "amount": amount,
+                "type": TransactionType.TRANSFER,
+                "status": TransactionStatus.SUCCESS,
+                "counterparty": to_email,
+            })
+            tx_rows.append({
+                "wallet_id": receiver_wallet.id,
+                "amount": amount,
+                "type": TransactionType.RECEIVE,
+                "status": TransactionStatus.SUCCESS,
+                "counterparty": sender.email,
+            })
+            ledger_rows.append(
+                ledger.entry(sender_wallet.id, receiver_wallet.id, amount, transfer_tx_id)
+            )
+            results.append({
+                "index": index,
+                "to_email": to_email,
+                "amount": amount,
+                "status": TransactionStatus.SUCCESS,
+                "detail": None,
+            })
+
+        if deltas:
+            updated = await apply_balance_deltas(db, deltas)
+            balance = updated[sender_wallet.id].balance
+        if tx_rows:
+            await db.execute(insert(Transaction), tx_rows)
+        await ledger.record_entries(db, ledger_rows)
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception:
+        await db.rollback()
+        raise
+
+    succeeded = sum(1 for r in results if r["status"] == TransactionStatus.SUCCESS)
+    return {
+        "wallet": {
+            "id": sender_wallet.id,
+            "user_id": sender_wallet.user_id,
+            "balance": balance,
+        },
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "total_transferred": -deltas.get(sender_wallet.id, Decimal(0)),
+        "results": results,
+    }
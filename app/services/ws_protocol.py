@@ -0,0 +1,165 @@
+# app/services/ws_protocol.py
+import json
+from typing import Any, Iterable, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # optional: only the chat.v2.msgpack subprotocol needs it
+    msgpack = None
+
+Frame = Union[str, bytes]
+
+
+class FrameDecodeError(ValueError):
+    """A client frame the negotiated protocol cannot decode"""
+
+
+# v2 field names on the wire, both directions. Keys not listed pass through.
+COMPACT_KEYS = {
+    "type": "T",
+    "id": "i",
+    "sender_id": "s",
+    "receiver_id": "r",
+    "receiver_identifier": "to",
+    "content": "c",
+    "message_type": "k",
+    "timestamp": "ts",
+    "is_read": "rd",
+    "is_pending": "p",
+    "sender_name": "sn",
+    "messages": "m",
+    "done": "d",
+    "more_available": "ma",
+    "next_after_id": "na",
+    "after_id": "af",
+    "acks": "A",
+    "status": "st",
+    "message_id": "mi",
+    "receiver_online": "ro",
+    "client_msg_id": "cm",
+    "error": "e",
+    "reader_id": "ri",
+    "last_read_id": "lr",
+    "user_id": "u",
+    "connection_id": "cn",
+    "protocol": "pv",
+    "seq": "q",
+    "since": "sc",
+    "next_since": "ns",
+    "last_seq": "ls",
+    "acked_seq": "as",
+    "changes": "ch",
+    "user_ids": "us",
+}
+EXPANDED_KEYS = {short: key for key, short in COMPACT_KEYS.items()}
+
+# Left out of v2 frames: a client knows its own identity and resolves
+# other users by id
+V2_OMITTED = frozenset({"sender_email", "receiver_email", "receiver_name", "user_email"})
+
+
+def _rename(value: Any, keys: dict, omitted: frozenset = frozenset()) -> Any:
+    if isinstance(value, dict):
+        return {
+            keys.get(key, key): _rename(item, keys, omitted)
+            for key, item in value.items()
+            if key not in omitted
+        }
+    if isinstance(value, list):
+        return [_rename(item, keys, omitted) for item in value]
+    return value
+
+
+class WireProtocol:
+    """
+    How frames of one WebSocket subprotocol are encoded.
+
+    Server code builds frames as v1-shaped dicts (the JSON the socket has
+    always sent) and client frames are decoded back into that shape, so
+    only this module knows about compact keys and binary encodings.
+    """
+
+    # Sec-WebSocket-Protocol token; None for the default (nothing negotiated)
+    name: Optional[str] = None
+    binary = False
+    # Clients may send a list of message sends in one frame
+    batching = False
+    # Clients answer server pings, so silent connections may be reaped
+    heartbeat = False
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def encode(self, frame: dict) -> Frame:
+        raise NotImplementedError
+
+    def decode(self, data: Frame) -> Any:
+        raise NotImplementedError
+
+
+class JsonV1(WireProtocol):
+    """The original protocol: one JSON text frame per message, full field names"""
+
+    def encode(self, frame: dict) -> Frame:
+        return json.dumps(frame)
+
+    def decode(self, data: Frame) -> Any:
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise FrameDecodeError("Invalid JSON format")
+
+
+class JsonV2(WireProtocol):
+    """Compact keys, no repeated user details, batched sends; JSON text"""
+
+    name = "chat.v2.json"
+    batching = True
+    heartbeat = True
+
+    def encode(self, frame: dict) -> Frame:
+        return json.dumps(_rename(frame, COMPACT_KEYS, V2_OMITTED), separators=(",", ":"))
+
+    def decode(self, data: Frame) -> Any:
+        try:
+            return _rename(json.loads(data), EXPANDED_KEYS)
+        except ValueError:
+            raise FrameDecodeError("Invalid JSON format")
+
+
+class MsgpackV2(JsonV2):
+    """chat.v2 in binary MessagePack frames"""
+
+    name = "chat.v2.msgpack"
+    binary = True
+
+    @property
+    def available(self) -> bool:
+        return msgpack is not None
+
+    def encode(self, frame: dict) -> Frame:
+        return msgpack.packb(_rename(frame, COMPACT_KEYS, V2_OMITTED))
+
+    def decode(self, data: Frame) -> Any:
+        if isinstance(data, str):
+            raise FrameDecodeError("chat.v2.msgpack expects binary frames")
+        try:
+            return _rename(msgpack.unpackb(data), EXPANDED_KEYS)
+        except Exception:
+            raise FrameDecodeError("Invalid MessagePack frame")
+
+
+JSON_V1 = JsonV1()
+JSON_V2 = JsonV2()
+MSGPACK_V2 = MsgpackV2()
+PROTOCOLS = {protocol.name: protocol for protocol in (JSON_V2, MSGPACK_V2)}
+
+
+def negotiate(offered: Iterable[str]) -> WireProtocol:
+    """First subprotocol the client offered that this server speaks; JSON v1 otherwise"""
+    for name in offered:
+        protocol = PROTOCOLS.get(name)
+        if protocol is not None and protocol.available:
+            return protocol
+    return JSON_V1
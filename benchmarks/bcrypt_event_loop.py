@@ -0,0 +1,72 @@
+# benchmarks/bcrypt_event_loop.py
+"""
+Event-loop lag and login throughput with inline vs pooled bcrypt checks.
+
+Simulates N concurrent logins (one verify_password each) while a probe task
+measures how late the event loop wakes it up. Inline bcrypt blocks the loop
+for every check; the async variants hand the work to the hashing pool.
+
+    python -m benchmarks.bcrypt_event_loop --logins 40
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.core.security import hash_password, verify_password, verify_password_async
+
+PROBE_INTERVAL = 0.01
+
+
+async def probe_lag(samples: list, stop: asyncio.Event):
+    """Record how much later than requested each short sleep returns"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def login_inline(password: str, hashed: str):
+    return verify_password(password, hashed)
+
+
+async def login_pooled(password: str, hashed: str):
+    return await verify_password_async(password, hashed)
+
+
+async def run(label: str, login, logins: int, password: str, hashed: str):
+    samples = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(samples, stop))
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login(password, hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    assert all(results)
+
+    lag_ms = sorted(s * 1000 for s in samples) or [0.0]
+    p99 = lag_ms[min(len(lag_ms) - 1, int(len(lag_ms) * 0.99))]
+    print(f"{label:<8} {logins / elapsed:>8.1f} logins/s   "
+          f"loop lag mean {statistics.mean(lag_ms):>7.1f} ms   "
+          f"p99 {p99:>7.1f} ms   max {lag_ms[-1]:>7.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=40)
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = hash_password(password)
+
+    print(f"🔐 {args.logins} concurrent logins")
+    await run("inline", login_inline, args.logins, password, hashed)
+    await run("pooled", login_pooled, args.logins, password, hashed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
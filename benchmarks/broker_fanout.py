@@ -0,0 +1,117 @@
+# benchmarks/broker_fanout.py
+"""
+Cross-worker WebSocket fan-out check.
+
+Runs two ConnectionManagers (standing in for two uvicorn workers) with fake
+sockets: Alice connects to worker A, Bob to worker B. Messages sent from
+either worker must reach the other user, presence must be visible from
+both, and a disconnected user must stop receiving. Then measures publish
+-> delivery latency.
+
+    python -m benchmarks.broker_fanout                                   # in-process broker
+    python -m benchmarks.broker_fanout --redis-url redis://localhost:6379/0
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.services.broker import InProcessBroker, RedisBroker
+from app.services.chat_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = []
+        self.arrived = asyncio.Event()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        self.received.append((time.perf_counter(), message))
+        self.arrived.set()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def wait_for(socket: FakeWebSocket, count: int, timeout: float = 2.0) -> bool:
+    deadline = time.perf_counter() + timeout
+    while len(socket.received) < count:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return False
+        socket.arrived.clear()
+        try:
+            await asyncio.wait_for(socket.arrived.wait(), remaining)
+        except asyncio.TimeoutError:
+            return False
+    return True
+
+
+def check(label: str, ok: bool) -> bool:
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--redis-url", default="")
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.redis_url:
+        worker_a = ConnectionManager(RedisBroker(args.redis_url))
+        worker_b = ConnectionManager(RedisBroker(args.redis_url))
+    else:
+        shared = InProcessBroker()
+        worker_a = ConnectionManager(shared)
+        worker_b = ConnectionManager(shared)
+    await worker_a.start()
+    await worker_b.start()
+
+    alice, bob = FakeWebSocket(), FakeWebSocket()
+    alice_conn = await worker_a.connect(alice, "alice")
+    bob_conn = await worker_b.connect(bob, "bob")
+    # Let Redis process the SUBSCRIBE commands
+    await asyncio.sleep(0.2)
+
+    ok = True
+    ok &= check("A -> Bob reports online", await worker_a.send_personal_message("hi bob", "bob"))
+    ok &= check("Bob receives on worker B", await wait_for(bob, 1) and bob.received[0][1] == "hi bob")
+    ok &= check("B -> Alice reports online", await worker_b.send_personal_message("hi alice", "alice"))
+    ok &= check("Alice receives on worker A", await wait_for(alice, 1))
+    ok &= check("Presence shared", await worker_a.is_user_online("bob") and await worker_b.is_user_online("alice"))
+    ok &= check("Online list", set(await worker_a.get_online_users()) >= {"alice", "bob"})
+
+    # Latency: publish on A, deliver on B
+    bob.received.clear()
+    sent_at = []
+    for i in range(args.messages):
+        sent_at.append(time.perf_counter())
+        await worker_a.send_personal_message(str(i), "bob")
+        # Give bob's writer a turn, as a sender's receive loop would
+        await asyncio.sleep(0)
+    ok &= check(f"{args.messages} messages delivered", await wait_for(bob, args.messages, timeout=30))
+    latencies = sorted(
+        (received - sent_at[int(message)]) * 1000 for received, message in bob.received
+    )
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"📨 publish -> deliver: median {statistics.median(latencies):.2f} ms, p99 {p99:.2f} ms")
+
+    await worker_b.disconnect(bob_conn)
+    await asyncio.sleep(0.2)
+    ok &= check("Bob offline after disconnect", not await worker_a.is_user_online("bob"))
+    ok &= check("Send to offline Bob reports offline", not await worker_a.send_personal_message("gone", "bob"))
+
+    await worker_a.disconnect(alice_conn)
+    await worker_a.stop()
+    await worker_b.stop()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+# benchmarks/connection_footprint.py
+"""
+Multi-device check and idle connection footprint.
+
+First checks that one user's devices each get every message (the very same
+frame string), and that closing one device leaves the others connected and
+the user online. Then opens --connections idle fake sockets spread over
+users with --devices each and reports the memory the manager keeps per
+idle connection (tracemalloc), before and after a message burst drains.
+
+This counts ConnectionManager bookkeeping only; the ASGI server's own
+per-socket buffers come on top.
+
+    python -m benchmarks.connection_footprint
+    python -m benchmarks.connection_footprint --connections 50000 --devices 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+import tracemalloc
+
+from app.services.broker import InProcessBroker
+from app.services.chat_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    __slots__ = ("received",)
+
+    def __init__(self):
+        self.received = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        self.received.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class IdleWebSocket:
+    __slots__ = ()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def check(label: str, ok: bool) -> bool:
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+
+async def check_devices() -> bool:
+    manager = ConnectionManager(InProcessBroker())
+    phone, laptop, tablet = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    with contextlib.redirect_stdout(io.StringIO()):
+        connections = [await manager.connect(socket, "alice") for socket in (phone, laptop, tablet)]
+
+    ok = True
+    ok &= check("Distinct connection ids", len({c.connection_id for c in connections}) == 3)
+    frame = '{"content": "hi"}'
+    ok &= check("Send reports online", await manager.send_personal_message(frame, "alice"))
+    await asyncio.sleep(0)
+    ok &= check(
+        "Every device gets the same frame object",
+        all(len(s.received) == 1 and s.received[0] is frame for s in (phone, laptop, tablet)),
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await manager.disconnect(connections[0])
+        await manager.disconnect(connections[0])
+    ok &= check("Closing one device keeps the others", len(manager.connections_of("alice")) == 2)
+    ok &= check("User still online", await manager.is_user_online("alice"))
+    await manager.send_personal_message("second", "alice")
+    await asyncio.sleep(0)
+    ok &= check(
+        "Closed device gets nothing more",
+        len(phone.received) == 1 and laptop.received[-1] == "second" and tablet.received[-1] == "second",
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for connection in connections[1:]:
+            await manager.disconnect(connection)
+    ok &= check("Offline after last device", not await manager.is_user_online("alice"))
+    ok &= check("Send to offline user reports offline", not await manager.send_personal_message("x", "alice"))
+    return ok
+
+
+async def measure(connections: int, devices: int):
+    manager = ConnectionManager(InProcessBroker())
+    users = max(1, connections // devices)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(connections):
+            await manager.connect(IdleWebSocket(), f"user-{i % users}")
+    elapsed = time.perf_counter() - started
+    idle = tracemalloc.get_traced_memory()[0] - baseline
+
+    print(f"\n🔌 {manager.connection_count} connections for {len(manager.active_connections)} users"
+          f" opened in {elapsed:.2f} s")
+    print(f"   idle: {idle / 1024 / 1024:.1f} MiB, {idle / connections:.0f} bytes per connection"
+          f" (sockets themselves included)")
+
+    # One frame to everybody, then let every writer drain
+    frame = '{"type": "announcement"}'
+    for i in range(users):
+        await manager.send_personal_message(frame, f"user-{i}")
+    busy = tracemalloc.get_traced_memory()[0] - baseline
+    await asyncio.sleep(0.1)
+    drained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    print(f"   with one frame queued everywhere: {busy / connections:.0f} bytes per connection")
+    print(f"   after the burst drained: {drained / connections:.0f} bytes per connection")
+    metrics = manager.get_metrics()
+    print(f"   frames sent {metrics['sent']}, queue depth now {metrics['queue_depth']['total']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--devices", type=int, default=2)
+    args = parser.parse_args()
+
+    ok = await check_devices()
+    await measure(args.connections, args.devices)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
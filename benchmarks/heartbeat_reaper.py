@@ -0,0 +1,164 @@
+# benchmarks/heartbeat_reaper.py
+"""
+Heartbeat reaper: half-open sockets are released, live ones are not.
+
+Opens --connections fake sockets. Most answer every ping; --dead of them
+are half-open v2 sockets (sends succeed, nothing ever comes back) and
+--legacy are v1 clients that do not understand pings: half of them
+half-open, half still sending frames of their own. With a short
+--interval, --timeout and --legacy-idle, checks that every half-open
+socket is closed with 1011 and its user reported offline (v2 within
+interval + timeout, v1 within --legacy-idle), that no live socket is
+touched, and reports reaper CPU per check and the memory of the schedule
+against one sleeping task per socket.
+
+    python -m benchmarks.heartbeat_reaper
+    python -m benchmarks.heartbeat_reaper --connections 50000 --dead 0.05 --interval 1 --timeout 1 --legacy-idle 3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+from app.services.broker import InProcessBroker
+from app.services.chat_manager import ConnectionManager
+from app.services.heartbeat import HEARTBEAT_CLOSE_CODE, Heartbeat
+from app.services.ws_protocol import JSON_V1, JSON_V2
+
+
+class FakeWebSocket:
+    """Answers pings (pong), only sends frames of its own (chatty), or is half-open"""
+
+    __slots__ = ("mode", "connection", "closed_with", "pings")
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.connection = None
+        self.closed_with = None
+        self.pings = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        if '"ping"' in message:
+            self.pings += 1
+            if self.mode != "silent":
+                # What the socket loop does with any client frame
+                self.connection.touch()
+            if self.mode == "pong":
+                self.connection.manager.heartbeat.pong(self.connection)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def check(label: str, ok: bool) -> bool:
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+
+async def one_task_per_socket(count: int, interval: float) -> int:
+    """Memory of the design this replaces: a sleeping ping task per socket"""
+    async def pinger():
+        while True:
+            await asyncio.sleep(interval)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(pinger()) for _ in range(count)]
+    await asyncio.sleep(0)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return used
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=20000)
+    parser.add_argument("--dead", type=float, default=0.05)
+    parser.add_argument("--legacy", type=float, default=0.05)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--legacy-idle", type=float, default=3.0)
+    args = parser.parse_args()
+
+    manager = ConnectionManager(InProcessBroker())
+    manager.heartbeat = Heartbeat(
+        interval=args.interval, timeout=args.timeout, legacy_idle=args.legacy_idle
+    )
+    await manager.start()
+
+    dead_count = int(args.connections * args.dead)
+    legacy_count = int(args.connections * args.legacy)
+    sockets = []
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    with quiet:
+        for i in range(args.connections):
+            dead = i < dead_count
+            legacy = dead_count <= i < dead_count + legacy_count
+            if dead:
+                mode = "silent"
+            elif legacy:
+                mode = "silent" if i < dead_count + legacy_count // 2 else "chatty"
+            else:
+                mode = "pong"
+            socket = FakeWebSocket(mode)
+            socket.connection = await manager.connect(
+                socket, f"user-{i}", JSON_V1 if legacy else JSON_V2
+            )
+            sockets.append(socket)
+    # The schedule is one heap entry (a 4-tuple plus a list slot) per connection
+    entry_bytes = sys.getsizeof(manager.heartbeat._heap[0]) + 8
+    started = time.perf_counter()
+    print(f"🔌 {args.connections} connections: {dead_count} half-open, {legacy_count} legacy v1"
+          f" ({legacy_count // 2} of them half-open)")
+
+    # Run until the dead v1 sockets are due, plus one check of slack, measuring loop CPU
+    cpu_started = time.process_time()
+    with quiet:
+        await asyncio.sleep(
+            max(args.interval, args.legacy_idle) + args.interval + args.timeout * 2 + 0.1
+        )
+    cpu = time.process_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    stats = manager.heartbeat.stats()
+
+    legacy = sockets[dead_count:dead_count + legacy_count]
+    dead = sockets[:dead_count] + [s for s in legacy if s.mode == "silent"]
+    live = [s for s in sockets if s.mode != "silent"]
+    ok = True
+    ok &= check(f"All {len(dead)} half-open sockets reaped with {HEARTBEAT_CLOSE_CODE}, v1 included",
+                all(s.closed_with == HEARTBEAT_CLOSE_CODE for s in dead))
+    ok &= check("Reaped users reported offline",
+                not any([await manager.is_user_online(s.connection.user_id) for s in dead]))
+    ok &= check("No live socket reaped", all(s.closed_with is None for s in live))
+    ok &= check("Live v1 sockets that never pong kept",
+                all(s.closed_with is None and s.pings > 0 for s in legacy if s.mode == "chatty"))
+    ok &= check("Every live socket pinged", all(s.pings > 0 for s in live))
+    ok &= check("Reaped connections gone from the manager",
+                manager.connection_count == args.connections - len(dead))
+    metrics = manager.get_metrics()["heartbeat"]
+    print(json.dumps(metrics, indent=2))
+
+    print(f"\n⏱️  {stats['checks']} checks in {elapsed:.1f} s, {cpu * 1000:.0f} ms CPU"
+          f" ({cpu / max(stats['checks'], 1) * 1e6:.1f} µs per check, sends included)")
+    tasks = await one_task_per_socket(args.connections, args.interval)
+    print(f"💾 schedule: {entry_bytes} bytes per connection;"
+          f" one ping task per socket would take {tasks / args.connections:.0f} bytes each")
+
+    await manager.stop()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
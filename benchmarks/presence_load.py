@@ -0,0 +1,268 @@
+# benchmarks/presence_load.py
+"""
+Presence subscriptions: correctness checks and a 10k-subscriber load test.
+
+First checks the diff semantics on a few users: a snapshot on subscribe,
+online/offline diffs, no frames for a reconnect within the grace period,
+typing shown only to the partner and expiring, and several changes in one
+flush arriving as one frame.
+
+Then connects --subscribers users, each watching --partners random others,
+and churns them for --seconds: every flush interval --churn of the online
+users drop, half of them come back within the grace period (flapping) and
+half stay away for twice the grace period. Reports presence frames per
+subscriber, frames saved against one frame per transition per watcher,
+time spent turning a flush into frames, and the memory the subscriptions
+take.
+
+    python -m benchmarks.presence_load
+    python -m benchmarks.presence_load --subscribers 10000 --partners 20 --seconds 10
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from app.services.broker import InProcessBroker
+from app.services.chat_manager import ConnectionManager
+from app.services.presence import PresenceService
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        self.received.append(json.loads(message))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class CountingWebSocket:
+    __slots__ = ("frames",)
+
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        self.frames += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def check(label: str, ok: bool) -> bool:
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+
+async def started_manager(flush_ms: float, grace: float, typing_ttl: float) -> ConnectionManager:
+    manager = ConnectionManager(InProcessBroker())
+    manager.presence = PresenceService(
+        manager.broker, flush_ms=flush_ms, offline_grace=grace, typing_ttl=typing_ttl
+    )
+    await manager.start()
+    return manager
+
+
+async def check_semantics() -> bool:
+    flush = 0.02
+    manager = await started_manager(flush_ms=flush * 1000, grace=0.1, typing_ttl=0.1)
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        alice_socket = FakeWebSocket()
+        alice = await manager.connect(alice_socket, "alice")
+        carol_socket = FakeWebSocket()
+        carol = await manager.connect(carol_socket, "carol")
+        bob = await manager.connect(FakeWebSocket(), "bob")
+
+    async def settle(seconds: float = flush * 3):
+        await asyncio.sleep(seconds)
+
+    def diffs(socket):
+        frames = [frame for frame in socket.received if frame.get("type") == "presence"]
+        socket.received.clear()
+        return frames
+
+    await settle()
+    ok = True
+    snapshot = await manager.presence.subscribe(alice, ["bob", "dave"])
+    ok &= check("Snapshot on subscribe", snapshot == {"bob": "online", "dave": "offline"})
+    await manager.presence.subscribe(carol, ["bob"])
+    await settle()
+    ok &= check("Already-known state is not repeated", diffs(alice_socket) == [])
+
+    with quiet:
+        await manager.connect(FakeWebSocket(), "dave")
+    await settle()
+    ok &= check("Partner coming online is one diff",
+                diffs(alice_socket) == [{"type": "presence", "changes": {"dave": "online"}}])
+
+    with quiet:
+        await manager.disconnect(bob)
+        await settle(0.03)
+        bob = await manager.connect(FakeWebSocket(), "bob")
+    await settle(0.2)
+    ok &= check("Reconnect within the grace period sends nothing", diffs(alice_socket) == [])
+
+    manager.presence.typing("bob", "alice")
+    manager.presence.typing("bob", "alice")
+    await settle()
+    ok &= check("Typing reaches the partner once", diffs(alice_socket) == [
+        {"type": "presence", "changes": {"bob": "typing"}}
+    ])
+    ok &= check("Other watchers do not see typing", diffs(carol_socket) == [])
+    await settle(0.2)
+    ok &= check("Typing expires back to online", diffs(alice_socket) == [
+        {"type": "presence", "changes": {"bob": "online"}}
+    ])
+
+    with quiet:
+        for connection in manager.connections_of("bob") + manager.connections_of("dave"):
+            await manager.disconnect(connection)
+    await settle(0.2)
+    ok &= check("Two users leaving together are one frame", diffs(alice_socket) == [
+        {"type": "presence", "changes": {"bob": "offline", "dave": "offline"}}
+    ])
+
+    with quiet:
+        await manager.disconnect(alice)
+    ok &= check("Closing a connection drops its subscription",
+                manager.presence.stats()["subscribed_connections"] == 1)
+    await manager.stop()
+    return ok
+
+
+async def load(args):
+    manager = await started_manager(args.flush_ms, args.grace, typing_ttl=6.0)
+    presence = manager.presence
+    users = [f"user-{i}" for i in range(args.subscribers)]
+    sockets = {}
+    connections = {}
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    with quiet:
+        for user_id in users:
+            sockets[user_id] = CountingWebSocket()
+            connections[user_id] = await manager.connect(sockets[user_id], user_id)
+    # The connects above were announced; let that flush pass
+    await asyncio.sleep(args.flush_ms / 1000 * 3)
+
+    random.seed(11)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    watchers_of = {user_id: 0 for user_id in users}
+    for user_id in users:
+        partners = random.sample(users, args.partners + 1)
+        partners = [p for p in partners if p != user_id][: args.partners]
+        for partner in partners:
+            watchers_of[partner] += 1
+        await presence.subscribe(connections[user_id], partners)
+    subscribe_s = time.perf_counter() - started
+    footprint = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    subscriptions = args.subscribers * args.partners
+    print(f"\n👀 {args.subscribers} subscribers x {args.partners} partners subscribed in {subscribe_s:.2f} s")
+    print(f"   presence state {footprint / 1024 / 1024:.1f} MiB,"
+          f" {footprint / subscriptions:.0f} bytes per subscription")
+    for socket in sockets.values():
+        socket.frames = 0
+
+    # Time the broker handler, i.e. one worker's flush turned into frames
+    handler_ms = []
+    handle = presence._on_presence
+
+    async def timed_handler(channel, payload):
+        began = time.perf_counter()
+        await handle(channel, payload)
+        handler_ms.append((time.perf_counter() - began) * 1000)
+
+    await manager.broker.unsubscribe("chat:presence", handle)
+    await manager.broker.subscribe("chat:presence", timed_handler)
+
+    transitions = 0
+    naive_frames = 0
+    flaps = 0
+    offline = {}
+    tick = args.flush_ms / 1000
+    deadline = time.perf_counter() + args.seconds
+    with quiet:
+        while time.perf_counter() < deadline:
+            online = [user_id for user_id in users if user_id not in offline]
+            dropping = random.sample(online, max(1, int(len(online) * args.churn)))
+            flapping = dropping[: len(dropping) // 2]
+            for user_id in dropping:
+                await manager.disconnect(connections[user_id])
+                transitions += 1
+                naive_frames += watchers_of[user_id]
+            # The other half stay away for longer than the grace period
+            now = time.perf_counter()
+            for user_id, back_at in list(offline.items()):
+                if back_at <= now:
+                    del offline[user_id]
+                    connections[user_id] = await manager.connect(sockets[user_id], user_id)
+                    await presence.subscribe(connections[user_id], random.sample(users, args.partners))
+                    transitions += 1
+                    naive_frames += watchers_of[user_id]
+            for user_id in dropping[len(dropping) // 2:]:
+                offline[user_id] = now + args.grace * 2
+            await asyncio.sleep(tick / 2)
+            for user_id in flapping:
+                connections[user_id] = await manager.connect(sockets[user_id], user_id)
+                await presence.subscribe(connections[user_id], random.sample(users, args.partners))
+                transitions += 1
+                naive_frames += watchers_of[user_id]
+                flaps += 1
+            await asyncio.sleep(tick / 2)
+        await asyncio.sleep(args.grace + tick * 3)
+
+    frames = sum(socket.frames for socket in sockets.values())
+    stats = presence.stats()
+    handler_ms.sort()
+    print(f"\n🔁 {args.seconds} s of churn: {transitions} connect/disconnect transitions ({flaps} flaps)")
+    print(f"   presence frames: {frames} total, {frames / args.subscribers / args.seconds:.2f}"
+          f" per subscriber per second")
+    print(f"   one frame per transition per watcher would be {naive_frames}"
+          f" ({1 - frames / max(naive_frames, 1):.0%} saved)")
+    print(f"   {stats['published']} broker messages, {stats['flaps_suppressed']} flaps absorbed")
+    if handler_ms:
+        print(f"   flush -> frames: median {statistics.median(handler_ms):.2f} ms,"
+              f" p99 {handler_ms[min(len(handler_ms) - 1, int(len(handler_ms) * 0.99))]:.2f} ms,"
+              f" max {handler_ms[-1]:.2f} ms")
+    metrics = manager.get_metrics()
+    print(f"   outbound queues: dropped {metrics['dropped']}, coalesced {metrics['coalesced']},"
+          f" time in queue p99 {metrics['time_in_queue_ms']['p99']:.2f} ms")
+    await manager.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--partners", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--churn", type=float, default=0.01)
+    parser.add_argument("--flush-ms", type=float, default=250.0)
+    parser.add_argument("--grace", type=float, default=1.0)
+    args = parser.parse_args()
+
+    ok = await check_semantics()
+    await load(args)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+# benchmarks/slow_consumer.py
+"""
+Slow-consumer isolation check for the per-connection outbound queues.
+
+One sender fans out to many fast fake sockets and one socket that takes
+--slow-ms per frame, under each overflow policy. The sender's publish loop
+must not be held up by the slow socket, fast sockets must get everything,
+and the slow one is trimmed or disconnected according to the policy.
+
+    python -m benchmarks.slow_consumer
+    python -m benchmarks.slow_consumer --fast 500 --messages 1000 --queue-size 64
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.services.broker import InProcessBroker
+from app.services.chat_manager import COALESCE, DISCONNECT, DROP_OLDEST, ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+async def run(policy: str, args) -> bool:
+    manager = ConnectionManager(InProcessBroker(), max_queue=args.queue_size, overflow=policy)
+    await manager.start()
+
+    fast = [FakeWebSocket() for _ in range(args.fast)]
+    slow = FakeWebSocket(delay=args.slow_ms / 1000)
+    for i, socket in enumerate(fast):
+        await manager.connect(socket, f"fast-{i}")
+    await manager.connect(slow, "slow")
+    users = [f"fast-{i}" for i in range(args.fast)] + ["slow"]
+
+    started = time.perf_counter()
+    for n in range(args.messages):
+        for user_id in users:
+            # Every other frame is keyed state, like a read receipt
+            key = f"receipt:{n % 8}" if n % 2 else None
+            await manager.send_personal_message(json.dumps({"n": n}), user_id, coalesce_key=key)
+        await asyncio.sleep(0)
+    publish_ms = (time.perf_counter() - started) * 1000
+
+    # Let fast writers drain
+    deadline = time.perf_counter() + 10
+    while time.perf_counter() < deadline and any(s.received < args.messages for s in fast):
+        await asyncio.sleep(0.01)
+    metrics = manager.get_metrics()
+
+    coalescing = policy == COALESCE
+    fast_ok = all(s.received <= args.messages for s in fast) and (
+        coalescing or all(s.received == args.messages for s in fast)
+    )
+    print(f"\n📦 policy={policy}")
+    print(f"   publish loop: {publish_ms:.1f} ms for {args.messages * len(users)} frames"
+          f" (inline sends would spend >= {args.messages * args.slow_ms:.0f} ms on the slow socket)")
+    print(f"   fast sockets complete: {fast_ok}  slow received: {slow.received}/{args.messages}"
+          f"  slow closed with: {slow.closed_with}")
+    print(f"   dropped {metrics['dropped']}  coalesced {metrics['coalesced']}"
+          f"  slow disconnects {metrics['slow_consumer_disconnects']}")
+    print(f"   queue depth total {metrics['queue_depth']['total']} max {metrics['queue_depth']['max']}")
+    waits = metrics["time_in_queue_ms"]
+    print(f"   time in queue p50 {waits['p50']:.2f} ms  p99 {waits['p99']:.2f} ms  max {waits['max']:.2f} ms")
+
+    # The sender must never wait on the slow socket
+    ok = fast_ok and publish_ms < args.messages * args.slow_ms
+    if policy == DISCONNECT:
+        ok &= slow.closed_with is not None
+    if policy == DROP_OLDEST:
+        ok &= metrics["dropped"] > 0 and slow.closed_with is None
+
+    for devices in list(manager.active_connections.values()):
+        for connection in list(devices.values()):
+            await manager.disconnect(connection)
+    await asyncio.sleep(0)
+    await manager.stop()
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fast", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--slow-ms", type=float, default=20.0)
+    parser.add_argument("--queue-size", type=int, default=32)
+    args = parser.parse_args()
+
+    ok = True
+    for policy in (DROP_OLDEST, DISCONNECT, COALESCE):
+        result = await run(policy, args)
+        print(f"{'✅' if result else '❌'} {policy}")
+        ok &= result
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+# benchmarks/ws_protocol.py
+"""
+Bytes on the wire and CPU per message for the chat WebSocket protocols.
+
+Checks subprotocol negotiation and that a user with devices on JSON v1,
+chat.v2.json and chat.v2.msgpack gets the same message on each. Then
+encodes a stream of realistic frames (incoming messages, acks, backlog
+pages) with every protocol and reports bytes per message, with and
+without permessage-deflate (context takeover, as uvicorn negotiates it),
+and server encode / client decode time. Finally compares ten sends as ten
+frames against one batched v2 frame.
+
+    python -m benchmarks.ws_protocol
+    python -m benchmarks.ws_protocol --messages 5000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+from app.services.broker import InProcessBroker
+from app.services.chat_manager import ConnectionManager
+from app.services.ws_protocol import (
+    JSON_V1, JSON_V2, MSGPACK_V2, V2_OMITTED, negotiate,
+)
+
+PROTOCOLS = [JSON_V1, JSON_V2, MSGPACK_V2]
+WORDS = "pay later thanks sent the money for dinner see you tomorrow ok sure".split()
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        self.received.append(message)
+
+    async def send_bytes(self, message: bytes):
+        self.received.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def check(label: str, ok: bool) -> bool:
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+
+def message_frame(i: int) -> dict:
+    sender, receiver = uuid.uuid4(), uuid.uuid4()
+    return {
+        "id": 100000 + i,
+        "sender_id": str(sender),
+        "receiver_id": str(receiver),
+        "content": " ".join(random.choices(WORDS, k=random.randint(2, 12))),
+        "message_type": "text",
+        "timestamp": datetime.utcnow().isoformat(),
+        "is_read": False,
+        "sender_email": "priya.sharma@example.com",
+        "sender_name": "Priya Sharma",
+        "receiver_email": "arjun.mehta@example.com",
+        "receiver_name": "Arjun Mehta",
+    }
+
+
+def ack_frame(i: int) -> dict:
+    return {
+        "type": "message_status",
+        "status": "sent",
+        "message_id": 100000 + i,
+        "receiver_online": True,
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+def without_omitted(frame):
+    if isinstance(frame, dict):
+        return {k: without_omitted(v) for k, v in frame.items() if k not in V2_OMITTED}
+    if isinstance(frame, list):
+        return [without_omitted(v) for v in frame]
+    return frame
+
+
+def deflated_sizes(frames) -> int:
+    """permessage-deflate with context takeover: one compressor for the stream"""
+    compressor = zlib.compressobj(wbits=-15)
+    total = 0
+    for frame in frames:
+        data = frame.encode() if isinstance(frame, str) else frame
+        # RFC 7692: flush per message and drop the trailing 00 00 ff ff
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+
+def header_bytes(length: int, from_client: bool) -> int:
+    size = 2 if length < 126 else 4 if length < 65536 else 10
+    return size + (4 if from_client else 0)
+
+
+async def check_fanout() -> bool:
+    manager = ConnectionManager(InProcessBroker())
+    sockets = {protocol: FakeWebSocket() for protocol in PROTOCOLS}
+    for protocol, socket in sockets.items():
+        await manager.connect(socket, "alice", protocol)
+
+    frame = message_frame(1)
+    await manager.send_personal_message(json.dumps(frame), "alice")
+    await asyncio.sleep(0)
+
+    ok = True
+    for protocol, socket in sockets.items():
+        received = socket.received[-1] if socket.received else None
+        binary = isinstance(received, bytes)
+        decoded = protocol.decode(received) if received is not None else None
+        expected = frame if protocol is JSON_V1 else without_omitted(frame)
+        ok &= check(
+            f"{protocol.name or 'json (v1)'} device gets the message as a {'binary' if binary else 'text'} frame",
+            decoded == expected and binary == protocol.binary,
+        )
+    for connection in manager.connections_of("alice"):
+        await manager.disconnect(connection)
+    return ok
+
+
+def measure(frames, label: str, args):
+    print(f"\n📦 {label} ({len(frames)} frames)")
+    baseline = None
+    for protocol in PROTOCOLS:
+        started = time.perf_counter()
+        encoded = [protocol.encode(frame) for frame in frames]
+        encode_us = (time.perf_counter() - started) / len(frames) * 1e6
+        started = time.perf_counter()
+        for data in encoded:
+            protocol.decode(data)
+        decode_us = (time.perf_counter() - started) / len(frames) * 1e6
+
+        raw = sum(len(data.encode() if isinstance(data, str) else data) for data in encoded) / len(frames)
+        deflated = deflated_sizes(encoded) / len(frames)
+        baseline = baseline or raw
+        print(f"   {protocol.name or 'json (v1)':<16} {raw:7.1f} B/frame ({raw / baseline:4.0%})"
+              f"  deflated {deflated:6.1f} B  encode {encode_us:5.1f} µs  decode {decode_us:5.1f} µs")
+
+
+def measure_batching(batch: int):
+    sends = [
+        {"receiver_identifier": "arjun.mehta@example.com", "content": "see you at dinner", "client_msg_id": f"c-{i}"}
+        for i in range(batch)
+    ]
+    acks = [{**ack_frame(i), "client_msg_id": f"c-{i}"} for i in range(batch)]
+
+    def wire(data, from_client):
+        length = len(data.encode() if isinstance(data, str) else data)
+        return length + header_bytes(length, from_client)
+
+    single = sum(wire(JSON_V1.encode(s), True) for s in sends) + sum(wire(JSON_V1.encode(a), False) for a in acks)
+    print(f"\n📨 {batch} sends + acks, frame headers included")
+    print(f"   json (v1), one frame each    {single:6d} B, {2 * batch} frames")
+    for protocol in (JSON_V2, MSGPACK_V2):
+        # Clients write compact keys; reuse the server encoder to produce them
+        request = protocol.encode(sends)
+        response = protocol.encode({"type": "acks", "acks": acks})
+        total = wire(request, True) + wire(response, False)
+        print(f"   {protocol.name:<16} batched    {total:6d} B, 2 frames ({total / single:.0%})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=10)
+    args = parser.parse_args()
+
+    ok = True
+    ok &= check("No subprotocol offered -> JSON v1", negotiate([]) is JSON_V1)
+    ok &= check("Unknown subprotocol -> JSON v1", negotiate(["chat.v9"]) is JSON_V1)
+    ok &= check("Client order wins", negotiate(["chat.v2.msgpack", "chat.v2.json"]) is MSGPACK_V2)
+    ok &= await check_fanout()
+
+    random.seed(7)
+    messages = [message_frame(i) for i in range(args.messages)]
+    measure(messages, "incoming messages", args)
+    measure([ack_frame(i) for i in range(args.messages)], "send acks", args)
+    backlog = [
+        {"type": "backlog", "messages": [{**m, "is_pending": True} for m in messages[i:i + 100]],
+         "done": False, "more_available": False, "next_after_id": None}
+        for i in range(0, len(messages), 100)
+    ]
+    measure(backlog, "backlog pages of 100", args)
+    measure_batching(args.batch)
+
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())